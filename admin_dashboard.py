@@ -0,0 +1,128 @@
+import argparse
+from datetime import date, timedelta
+
+from database import Database
+
+# Reads only the rollup tables kept current by the triggers in migration 0012,
+# so every query touches a bounded number of rows however long the history is
+
+REVENUE_BY_DAY_QUERY = """
+    SELECT day,
+           sum(tickets_sold) AS tickets_sold,
+           sum(revenue) AS revenue,
+           sum(tickets_cancelled) AS tickets_cancelled,
+           sum(refunds) AS refunds,
+           sum(revenue) - sum(refunds) AS net_revenue
+    FROM sales_daily
+    WHERE day BETWEEN %(start)s AND %(end)s
+    GROUP BY day
+    ORDER BY day
+"""
+
+TOP_TRIPS_QUERY = """
+    SELECT s.trip_id, tr.start_time, tr.capacity, s.tickets_sold, s.revenue,
+           round(100.0 * s.tickets_sold / nullif(tr.capacity, 0), 1) AS occupancy
+    FROM trip_sales s
+    JOIN trips tr ON tr.id = s.trip_id
+    ORDER BY s.revenue DESC
+    LIMIT %(limit)s
+"""
+
+# Trips departing in a window, read through the trips(start_time) index
+OCCUPANCY_QUERY = """
+    SELECT tr.start_time::date AS day,
+           count(*) AS trips,
+           sum(tr.capacity) AS seats,
+           coalesce(sum(s.tickets_sold), 0) AS tickets_sold,
+           round(
+               100.0 * coalesce(sum(s.tickets_sold), 0) / nullif(sum(tr.capacity), 0), 1
+           ) AS occupancy
+    FROM trips tr
+    LEFT JOIN trip_sales s ON s.trip_id = tr.id
+    WHERE tr.start_time >= %(start)s AND tr.start_time < %(end)s
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+TOP_CUSTOMERS_QUERY = """
+    SELECT c.user_id, u.username, c.tickets, c.spent
+    FROM customer_sales c
+    JOIN users u ON u.id = c.user_id
+    ORDER BY c.spent DESC
+    LIMIT %(limit)s
+"""
+
+
+class AdminDashboard:
+    def __init__(self, db=None):
+        self.db = db or Database()
+
+    def revenue_by_day(self, days=14, end=None):
+        """Sales, cancellations and net revenue for each of the last ``days`` days"""
+        end = end or date.today()
+        return self.db.execute_query(
+            REVENUE_BY_DAY_QUERY,
+            {"start": end - timedelta(days=days - 1), "end": end},
+        )
+
+    def top_trips(self, limit=10):
+        """Highest-revenue trips with their occupancy percentage"""
+        return self.db.execute_query(TOP_TRIPS_QUERY, {"limit": limit})
+
+    def occupancy_by_day(self, days=7, start=None):
+        """Seats sold against seats offered for trips departing each day"""
+        start = start or date.today()
+        return self.db.execute_query(
+            OCCUPANCY_QUERY, {"start": start, "end": start + timedelta(days=days)}
+        )
+
+    def top_customers(self, limit=10):
+        return self.db.execute_query(TOP_CUSTOMERS_QUERY, {"limit": limit})
+
+
+def print_report(dashboard, days=14, limit=10):
+    print(f"--- Revenue, last {days} days ---")
+    for row in dashboard.revenue_by_day(days):
+        print(
+            f"{row['day']} | Sold: {row['tickets_sold']} | "
+            f"Revenue: ${row['revenue']:.2f} | "
+            f"Cancelled: {row['tickets_cancelled']} | Refunds: ${row['refunds']:.2f} | "
+            f"Net: ${row['net_revenue']:.2f}"
+        )
+
+    print("--- Occupancy of upcoming departures ---")
+    for row in dashboard.occupancy_by_day():
+        print(
+            f"{row['day']} | Trips: {row['trips']} | "
+            f"Sold: {row['tickets_sold']}/{row['seats']} | "
+            f"Occupancy: {row['occupancy'] or 0}%"
+        )
+
+    print(f"--- Top {limit} trips by revenue ---")
+    for row in dashboard.top_trips(limit):
+        print(
+            f"Trip {row['trip_id']} | Start: {row['start_time']} | "
+            f"Sold: {row['tickets_sold']}/{row['capacity']} "
+            f"({row['occupancy'] or 0}%) | Revenue: ${row['revenue']:.2f}"
+        )
+
+    print(f"--- Top {limit} customers ---")
+    for row in dashboard.top_customers(limit):
+        print(
+            f"{row['username']} (ID {row['user_id']}) | "
+            f"Tickets: {row['tickets']} | Spent: ${row['spent']:.2f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Admin sales dashboard")
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    print_report(AdminDashboard(), args.days, args.limit)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
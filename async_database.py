@@ -0,0 +1,209 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import RealDictCursor
+from decouple import config
+
+from database import (
+    CONFLICT_MESSAGE,
+    TRANSACTION_ATTEMPTS,
+    Database,
+    is_retryable,
+    prepared_statements,
+    retry_delay,
+)
+from exceptions import PoolTimeoutError, TransactionConflictError
+from query_stats import query_stats
+
+
+async def wait_ready(conn):
+    """Drive a psycopg2 async connection until its current operation completes"""
+    loop = asyncio.get_running_loop()
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            return
+        if state == extensions.POLL_READ:
+            add, remove = loop.add_reader, loop.remove_reader
+        elif state == extensions.POLL_WRITE:
+            add, remove = loop.add_writer, loop.remove_writer
+        else:
+            raise psycopg2.OperationalError(f"Unexpected poll state {state}")
+
+        ready = loop.create_future()
+        fd = conn.fileno()
+        add(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            remove(fd)
+
+
+class AsyncConnection:
+    """Non-blocking counterpart of a pooled connection.
+
+    psycopg2 async connections are always in autocommit mode, so transactions
+    are opened and closed with explicit statements.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    @property
+    def closed(self):
+        return bool(self.conn.closed)
+
+    async def execute(self, query, params=None):
+        """Run one statement; returns rows if it has a result set, else rowcount"""
+        started = time.perf_counter()
+        cursor = self.conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            statement = prepared_statements.get(query)
+            if statement is None:
+                cursor.execute(query, params or ())
+            else:
+                if not prepared_statements.is_prepared(self.conn, statement):
+                    cursor.execute(statement.prepare_sql)
+                    await wait_ready(self.conn)
+                    prepared_statements.mark_prepared(self.conn, statement)
+                cursor.execute(statement.execute_sql, statement.arguments(params))
+            await wait_ready(self.conn)
+            result = cursor.fetchall() if cursor.description is not None else None
+            rowcount = cursor.rowcount
+        except BaseException:
+            # A cancelled or failed poll leaves the protocol state unknown
+            if self.conn.isexecuting():
+                self.conn.close()
+            raise
+        finally:
+            cursor.close()
+        query_stats.record_query(
+            query, params, (time.perf_counter() - started) * 1000, rowcount
+        )
+        return result if result is not None else rowcount
+
+    async def fetchone(self, query, params=None):
+        rows = await self.execute(query, params)
+        return rows[0] if rows else None
+
+    async def close(self):
+        self.conn.close()
+
+
+class AsyncConnectionPool:
+    def __init__(self, maxconn, timeout, **dsn):
+        self.timeout = timeout
+        self._dsn = dsn
+        self._idle = []
+        self._slots = asyncio.Semaphore(maxconn)
+
+    async def _connect(self):
+        conn = psycopg2.connect(async_=True, **self._dsn)
+        await wait_ready(conn)
+        return AsyncConnection(conn)
+
+    async def getconn(self):
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeoutError(
+                f"No database connection available after {self.timeout}s"
+            )
+        try:
+            while self._idle:
+                conn = self._idle.pop()
+                if not conn.closed:
+                    return conn
+            return await self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            if conn.closed:
+                return
+            # Never hand out a connection stuck inside a transaction
+            status = conn.conn.info.transaction_status
+            if status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.conn.close()
+                return
+            self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    async def closeall(self):
+        while self._idle:
+            await self._idle.pop().close()
+
+
+class AsyncDatabase:
+    """asyncio mirror of Database: a pool plus execute_query and transaction()"""
+
+    _pool = None
+
+    @classmethod
+    def get_pool(cls):
+        if cls._pool is None:
+            cls._pool = AsyncConnectionPool(
+                maxconn=config("DB_POOL_MAX", default=10, cast=int),
+                timeout=config("DB_POOL_TIMEOUT", default=5.0, cast=float),
+                **Database.connection_params(),
+            )
+        return cls._pool
+
+    @classmethod
+    async def close_pool(cls):
+        if cls._pool is not None:
+            await cls._pool.closeall()
+            cls._pool = None
+
+    def __init__(self):
+        self.pool = self.get_pool()
+
+    @asynccontextmanager
+    async def connection(self):
+        started = time.perf_counter()
+        conn = await self.pool.getconn()
+        query_stats.record_checkout((time.perf_counter() - started) * 1000)
+        try:
+            yield conn
+        finally:
+            self.pool.putconn(conn)
+
+    @asynccontextmanager
+    async def transaction(self):
+        async with self.connection() as conn:
+            await conn.execute("BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                if not conn.closed:
+                    await conn.execute("ROLLBACK")
+                raise
+            await conn.execute("COMMIT")
+
+    async def run_transaction(self, work, idempotent=False, attempts=None):
+        """Return ``await work(conn)`` run in a transaction, retried like
+        Database.run_transaction"""
+        attempts = attempts or TRANSACTION_ATTEMPTS
+        for attempt in range(attempts):
+            try:
+                async with self.transaction() as conn:
+                    return await work(conn)
+            except psycopg2.Error as e:
+                if not is_retryable(e, idempotent):
+                    raise
+                if attempt == attempts - 1:
+                    if isinstance(e, psycopg2.extensions.TransactionRollbackError):
+                        raise TransactionConflictError(CONFLICT_MESSAGE) from e
+                    raise
+                query_stats.record_retry(e)
+                await asyncio.sleep(retry_delay(attempt))
+
+    async def execute_query(self, query, params=None):
+        async with self.connection() as conn:
+            return await conn.execute(query, params)
@@ -0,0 +1,201 @@
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from decouple import config
+
+from database import Database, prepared_statements
+
+HASH_ALGORITHM = "pbkdf2_sha256"
+SALT_BYTES = 16
+MIN_ITERATIONS = 50_000
+# Stored hashes below this are upgraded at login. Fixed rather than the
+# calibrated count, which differs per process and would rehash every login.
+REHASH_BELOW = config("PASSWORD_REHASH_BELOW", default=MIN_ITERATIONS, cast=int)
+
+_iterations = config("PASSWORD_HASH_ITERATIONS", default=0, cast=int) or None
+_iterations_lock = threading.Lock()
+_dummy_hash = None
+
+
+def calibrate_iterations(target_ms, sample_iterations=20_000):
+    """Pick a PBKDF2 iteration count that takes about ``target_ms`` on this host"""
+    started = time.perf_counter()
+    hashlib.pbkdf2_hmac("sha256", b"calibration", b"0" * SALT_BYTES, sample_iterations)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    return max(MIN_ITERATIONS, int(sample_iterations * target_ms / max(elapsed_ms, 0.001)))
+
+
+def hash_iterations():
+    """Iteration count for new hashes: PASSWORD_HASH_ITERATIONS, or measured once
+    so hashing stays near PASSWORD_HASH_TARGET_MS and login latency is bounded"""
+    global _iterations
+    if _iterations is None:
+        with _iterations_lock:
+            if _iterations is None:
+                _iterations = calibrate_iterations(
+                    config("PASSWORD_HASH_TARGET_MS", default=100.0, cast=float)
+                )
+    return _iterations
+
+
+def hash_password(password, iterations=None):
+    iterations = iterations or hash_iterations()
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"{HASH_ALGORITHM}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def verify_password(password, stored):
+    """Check ``password`` against a stored hash, including legacy SHA-256 hashes"""
+    if stored.startswith(f"{HASH_ALGORITHM}$"):
+        _, iterations, salt, expected = stored.split("$")
+        digest = hashlib.pbkdf2_hmac(
+            "sha256", password.encode(), bytes.fromhex(salt), int(iterations)
+        )
+        return hmac.compare_digest(digest.hex(), expected)
+    legacy = hashlib.sha256(password.encode()).hexdigest()
+    return hmac.compare_digest(legacy, stored)
+
+
+def dummy_verify(password):
+    """Spend the same KDF time as a real check, so unknown usernames cannot be
+    told apart from wrong passwords by response time"""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_hex(8))
+    verify_password(password, _dummy_hash)
+    return False
+
+
+def needs_rehash(stored):
+    """True for legacy hashes and hashes made with fewer than REHASH_BELOW
+    iterations"""
+    if not stored.startswith(f"{HASH_ALGORITHM}$"):
+        return True
+    return int(stored.split("$")[1]) < REHASH_BELOW
+
+
+class Session:
+    def __init__(self, token, user):
+        self.token = token
+        self.user = user
+        self.last_seen = time.monotonic()
+
+
+class SessionManager:
+    """Opaque login tokens mapped to cached users, with idle expiry and LRU eviction.
+
+    Cached users are refreshed by comparing ``users.version`` (bumped by a
+    trigger on every update) and only re-read when it has changed.
+    """
+
+    # Runs on every menu redraw of a logged-in session
+    VERSION_QUERY = prepared_statements.register(
+        "session_version", "SELECT version FROM users WHERE id = %s"
+    )
+    USER_QUERY = (
+        "SELECT id, username, balance, is_admin, version FROM users WHERE id = %s"
+    )
+
+    def __init__(self, idle_timeout, max_sessions):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def login(self, username, password):
+        """Authenticate and open a session; returns (token, user) or (None, None)"""
+        from models import User
+
+        user = User.login(username, password)
+        if user is None:
+            return None, None
+        return self.open(user), user
+
+    def open(self, user):
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._sessions[token] = Session(token, user)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return token
+
+    def logout(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def session(self, token):
+        """Return the live session for ``token`` and mark it used, or None"""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+            if now - session.last_seen > self.idle_timeout:
+                del self._sessions[token]
+                return None
+            session.last_seen = now
+            self._sessions.move_to_end(token)
+            return session
+
+    def get_user(self, token):
+        """Current user for ``token`` with database-fresh state, or None if expired"""
+        session = self.session(token)
+        if session is None:
+            return None
+
+        db = Database()
+        result = db.execute_query(self.VERSION_QUERY, (session.user.id,))
+        if not result:
+            self.logout(token)
+            return None
+        if result[0]["version"] != session.user.version:
+            self.refresh(session, db.execute_query(self.USER_QUERY, (session.user.id,)))
+        return session.user
+
+    async def aget_user(self, token, db):
+        """get_user for the async server, using an AsyncDatabase"""
+        session = self.session(token)
+        if session is None:
+            return None
+
+        result = await db.execute_query(self.VERSION_QUERY, (session.user.id,))
+        if not result:
+            self.logout(token)
+            return None
+        if result[0]["version"] != session.user.version:
+            self.refresh(
+                session, await db.execute_query(self.USER_QUERY, (session.user.id,))
+            )
+        return session.user
+
+    @staticmethod
+    def refresh(session, result):
+        row = result[0]
+        user = session.user
+        user.username = row["username"]
+        user.balance = row["balance"]
+        user.is_admin = row["is_admin"]
+        user.version = row["version"]
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                token
+                for token, session in self._sessions.items()
+                if now - session.last_seen > self.idle_timeout
+            ]
+            for token in expired:
+                del self._sessions[token]
+        return len(expired)
+
+
+sessions = SessionManager(
+    idle_timeout=config("SESSION_IDLE_TIMEOUT", default=900.0, cast=float),
+    max_sessions=config("SESSION_CACHE_SIZE", default=10_000, cast=int),
+)
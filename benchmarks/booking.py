@@ -0,0 +1,327 @@
+"""Load test for the passenger booking workflow.
+
+Seeds the configured database with benchmark users, trips and ticket history,
+then drives simulated passengers through login -> list trips -> purchase ->
+view tickets from a thread or process pool and reports throughput, latency
+percentiles and correctness checks.
+
+Run from the repository root, e.g.::
+
+    python -m benchmarks.booking --users 2000 --trips 200 --sessions 5000 --workers 32
+"""
+
+import argparse
+import json
+import random
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from database import Database
+from exceptions import InsufficientBalanceError, TripNotAvailableError
+from models import Ticket, Trip, User
+from partition_manager import PARTITIONED_TABLES
+
+PASSWORD = "bench-password"
+STEPS = ("login", "list_trips", "purchase", "view_tickets")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[round(fraction * (len(sorted_values) - 1))]
+
+
+def seed(run_id, users, trips, history, seats, balance, cost):
+    """Insert benchmark data with set-based statements; returns the trip ids"""
+    db = Database()
+    with db.transaction() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO users (username, password)
+                SELECT %s || g, %s FROM generate_series(1, %s) g
+            """,
+                (f"bench_{run_id}_", User.hash_password(PASSWORD), users),
+            )
+
+            # Past trips carry the ticket history, future trips are bookable
+            cursor.execute(
+                """
+                INSERT INTO trips (cost, start_time, end_time, capacity, available_seats, status)
+                SELECT
+                    %(cost)s,
+                    CURRENT_TIMESTAMP + (g - %(past)s) * INTERVAL '1 hour',
+                    CURRENT_TIMESTAMP + (g - %(past)s) * INTERVAL '1 hour' + INTERVAL '3 hours',
+                    %(seats)s,
+                    %(seats)s,
+                    CASE WHEN g <= %(past)s THEN 'COMPLETED' ELSE 'SCHEDULED' END
+                FROM generate_series(1, %(past)s + %(trips)s) g
+                RETURNING id, status
+            """,
+                {"cost": cost, "past": trips, "trips": trips, "seats": seats},
+            )
+            rows = cursor.fetchall()
+            past_ids = [trip_id for trip_id, status in rows if status == "COMPLETED"]
+            future_ids = [trip_id for trip_id, status in rows if status == "SCHEDULED"]
+
+            cursor.execute(
+                """
+                CREATE TEMPORARY TABLE bench_users ON COMMIT DROP AS
+                SELECT id, row_number() OVER (ORDER BY id) - 1 AS n
+                FROM users WHERE username LIKE %s
+            """,
+                (f"bench\\_{run_id}\\_%",),
+            )
+            # History goes back ``history`` minutes, possibly into months older
+            # than any partition on a fresh database
+            for table in PARTITIONED_TABLES:
+                cursor.execute(
+                    """
+                    SELECT ensure_monthly_partitions(
+                        %s, (CURRENT_TIMESTAMP - %s * INTERVAL '1 minute')::date,
+                        CURRENT_DATE
+                    )
+                """,
+                    (table, history),
+                )
+            cursor.execute(
+                """
+                INSERT INTO tickets (user_id, trip_id, purchase_time)
+                SELECT u.id, (%(past_ids)s::int[])[1 + g %% cardinality(%(past_ids)s::int[])],
+                       CURRENT_TIMESTAMP - g * INTERVAL '1 minute'
+                FROM generate_series(1, %(history)s) g
+                JOIN bench_users u ON u.n = g %% %(users)s
+            """,
+                {"past_ids": past_ids, "history": history, "users": users},
+            )
+            cursor.execute(
+                """
+                UPDATE trips t SET available_seats = t.capacity - sold.count
+                FROM (
+                    SELECT trip_id, count(*) FROM tickets
+                    WHERE trip_id = ANY(%s) GROUP BY trip_id
+                ) sold
+                WHERE t.id = sold.trip_id
+            """,
+                (past_ids,),
+            )
+
+            # Ledger: one purchase row per historical ticket plus a deposit that
+            # leaves every user with the requested starting balance
+            cursor.execute(
+                """
+                INSERT INTO transactions (user_id, amount, type, description, created_at)
+                SELECT t.user_id, -tr.cost, 'PURCHASE', 'Benchmark history', t.purchase_time
+                FROM tickets t
+                JOIN trips tr ON tr.id = t.trip_id
+                WHERE t.user_id IN (SELECT id FROM bench_users)
+            """
+            )
+            cursor.execute(
+                """
+                INSERT INTO transactions (user_id, amount, type, description)
+                SELECT u.id, %s + coalesce(sum(-t.amount), 0), 'DEPOSIT', 'Benchmark deposit'
+                FROM bench_users u
+                LEFT JOIN transactions t ON t.user_id = u.id
+                GROUP BY u.id
+            """,
+                (balance,),
+            )
+            cursor.execute(
+                "UPDATE users SET balance = %s WHERE id IN (SELECT id FROM bench_users)",
+                (balance,),
+            )
+            cursor.execute("ANALYZE")
+    return future_ids
+
+
+def passenger_session(username, trip_ids):
+    """One simulated passenger; returns per-step timings and the outcome"""
+    timings = {}
+    started = time.perf_counter()
+    user = User.login(username, PASSWORD)
+    timings["login"] = time.perf_counter() - started
+    if user is None:
+        return timings, "login_failed"
+
+    started = time.perf_counter()
+    available = [trip.id for trip in Trip.get_available_trips() if trip.id in trip_ids]
+    timings["list_trips"] = time.perf_counter() - started
+    if not available:
+        return timings, "sold_out"
+
+    outcome = "purchased"
+    started = time.perf_counter()
+    try:
+        Ticket.purchase_ticket(user, random.choice(available))
+    except TripNotAvailableError:
+        outcome = "sold_out"
+    except InsufficientBalanceError:
+        outcome = "insufficient_balance"
+    except Exception:
+        outcome = "error"
+    timings["purchase"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    Ticket.get_user_tickets(user.id)
+    timings["view_tickets"] = time.perf_counter() - started
+    return timings, outcome
+
+
+def run_sessions(usernames, trip_ids, threads):
+    """Run a batch of sessions on a thread pool (also the process-pool worker)"""
+    trip_ids = set(trip_ids)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(
+            executor.map(lambda name: passenger_session(name, trip_ids), usernames)
+        )
+
+
+def drive(run_id, users, sessions, trip_ids, mode, workers):
+    usernames = [f"bench_{run_id}_{random.randint(1, users)}" for _ in range(sessions)]
+    if mode == "thread":
+        return run_sessions(usernames, trip_ids, workers)
+
+    # Each process runs its share of the sessions on a small thread pool
+    chunks = [usernames[i::workers] for i in range(workers)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(run_sessions, chunk, trip_ids, 4) for chunk in chunks
+        ]
+        return [result for future in futures for result in future.result()]
+
+
+def check_correctness(run_id, trip_ids):
+    """Return the list of violated invariants for this run's data"""
+    db = Database()
+    problems = []
+    oversold = db.execute_query(
+        """
+        SELECT t.id, t.capacity, t.available_seats, count(k.id) AS sold
+        FROM trips t
+        LEFT JOIN tickets k ON k.trip_id = t.id
+        WHERE t.id = ANY(%s)
+        GROUP BY t.id
+        HAVING t.available_seats < 0 OR t.capacity - t.available_seats <> count(k.id)
+    """,
+        (list(trip_ids),),
+        primary=True,
+    )
+    for trip in oversold:
+        problems.append(
+            f"trip {trip['id']}: {trip['sold']} tickets sold, "
+            f"{trip['available_seats']}/{trip['capacity']} seats left"
+        )
+
+    mismatched = db.execute_query(
+        """
+        SELECT u.id, u.balance, coalesce(sum(t.amount), 0) AS ledger
+        FROM users u
+        LEFT JOIN transactions t ON t.user_id = u.id
+        WHERE u.username LIKE %s
+        GROUP BY u.id
+        HAVING u.balance <> coalesce(sum(t.amount), 0) OR u.balance < 0
+    """,
+        (f"bench\\_{run_id}\\_%",),
+        primary=True,
+    )
+    for user in mismatched:
+        problems.append(
+            f"user {user['id']}: balance {user['balance']} "
+            f"but ledger sums to {user['ledger']}"
+        )
+    return problems
+
+
+def report(results, elapsed):
+    latencies = defaultdict(list)
+    outcomes = defaultdict(int)
+    for timings, outcome in results:
+        outcomes[outcome] += 1
+        for step, seconds in timings.items():
+            latencies[step].append(seconds * 1000)
+
+    summary = {
+        "sessions": len(results),
+        "elapsed_s": elapsed,
+        "sessions_per_s": len(results) / elapsed if elapsed else 0.0,
+        "outcomes": dict(outcomes),
+        "latency_ms": {},
+    }
+    for step in STEPS:
+        values = sorted(latencies[step])
+        summary["latency_ms"][step] = {
+            "count": len(values),
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+        }
+    return summary
+
+
+def print_summary(summary, problems):
+    print(
+        f"{summary['sessions']} sessions in {summary['elapsed_s']:.2f}s "
+        f"({summary['sessions_per_s']:.1f} sessions/s)"
+    )
+    print("Outcomes: " + ", ".join(f"{k}={v}" for k, v in summary["outcomes"].items()))
+    for step, stats in summary["latency_ms"].items():
+        print(
+            f"{step:>13}: n={stats['count']:<6} p50={stats['p50']:8.2f}ms "
+            f"p95={stats['p95']:8.2f}ms p99={stats['p99']:8.2f}ms"
+        )
+    if problems:
+        print("Correctness checks FAILED:")
+        for problem in problems:
+            print(f"  {problem}")
+    else:
+        print("Correctness checks passed: no oversold seats, ledger matches balances")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--trips", type=int, default=100, help="future trips")
+    parser.add_argument("--history", type=int, default=10000, help="past tickets")
+    parser.add_argument("--seats", type=int, default=50)
+    parser.add_argument("--balance", type=float, default=100.0)
+    parser.add_argument("--cost", type=float, default=10.0)
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--mode", choices=("thread", "process"), default="thread")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--json", action="store_true", help="print JSON only")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    Database.bootstrap()
+    run_id = uuid.uuid4().hex[:8]
+
+    started = time.perf_counter()
+    trip_ids = seed(
+        run_id, args.users, args.trips, args.history, args.seats, args.balance, args.cost
+    )
+    seed_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    results = drive(run_id, args.users, args.sessions, trip_ids, args.mode, args.workers)
+    summary = report(results, time.perf_counter() - started)
+    summary.update(
+        run_id=run_id, mode=args.mode, workers=args.workers, seed_s=seed_elapsed
+    )
+    problems = check_correctness(run_id, trip_ids)
+    summary["problems"] = problems
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"Run {run_id}: seeded in {seed_elapsed:.2f}s")
+        print_summary(summary, problems)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,194 @@
+"""Multi-process purchase contention check for TicketManager.purchase.
+
+Creates one bookable trip and a set of passengers whose balances cover only a
+few tickets each, then has several processes buy tickets on that trip at the
+same time until the attempts run out. Afterwards it checks that the trip was
+not oversold, that no seat was sold twice and that every passenger's balance
+is non-negative and equal to their ledger. Exits non-zero if any check fails.
+
+Creates benchmark rows in the configured database. Run from the repository
+root::
+
+    python -m benchmarks.contention --processes 16 --attempts 100 --seats 200
+"""
+
+import argparse
+import json
+import random
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from database import Database
+from exceptions import (
+    InsufficientBalanceError,
+    TransactionConflictError,
+    TripNotAvailableError,
+)
+from ticket_manager import TicketManager
+
+TRIP_CHECK_QUERY = """
+    SELECT t.capacity, t.available_seats,
+           count(k.id) AS sold,
+           count(DISTINCT k.seat_number) AS seats
+    FROM trips t
+    LEFT JOIN tickets k ON k.trip_id = t.id AND k.status = 'PURCHASED'
+    WHERE t.id = %s
+    GROUP BY t.id
+"""
+
+USER_CHECK_QUERY = """
+    SELECT u.id, u.balance, coalesce(sum(t.amount), 0) AS ledger
+    FROM users u
+    LEFT JOIN transactions t ON t.user_id = u.id
+    WHERE u.username LIKE %s
+    GROUP BY u.id
+"""
+
+
+def seed(run_id, users, seats, balance, cost):
+    """Insert the trip and passengers; returns (trip id, user ids)"""
+    db = Database()
+    with db.transaction() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO trips (cost, start_time, end_time, capacity, available_seats)
+                VALUES (%s, CURRENT_TIMESTAMP + INTERVAL '30 days',
+                        CURRENT_TIMESTAMP + INTERVAL '31 days', %s, %s)
+                RETURNING id
+            """,
+                (cost, seats, seats),
+            )
+            trip_id = cursor.fetchone()[0]
+            cursor.execute(
+                """
+                INSERT INTO users (username, password, balance)
+                SELECT %s || g, 'x', %s FROM generate_series(1, %s) g
+                RETURNING id
+            """,
+                (f"contention_{run_id}_", balance, users),
+            )
+            user_ids = [row[0] for row in cursor.fetchall()]
+            # Opening deposits, so balances match the ledger from the start
+            cursor.execute(
+                """
+                INSERT INTO transactions (user_id, amount, type, description)
+                SELECT id, %s, 'DEPOSIT', 'Contention check deposit'
+                FROM unnest(%s::int[]) id
+            """,
+                (balance, user_ids),
+            )
+    return trip_id, user_ids
+
+
+def buy(trip_id, user_ids, attempts):
+    """Process-pool worker: ``attempts`` purchases by random passengers"""
+    manager = TicketManager()
+    outcomes = Counter()
+    for _ in range(attempts):
+        try:
+            manager.purchase(random.choice(user_ids), trip_id)
+            outcomes["purchased"] += 1
+        except TripNotAvailableError:
+            outcomes["sold_out"] += 1
+        except InsufficientBalanceError:
+            outcomes["insufficient_balance"] += 1
+        except TransactionConflictError:
+            outcomes["conflict"] += 1
+    return outcomes
+
+
+def check(run_id, trip_id, purchased):
+    """Return the list of violated invariants"""
+    db = Database()
+    problems = []
+    trip = db.execute_query(TRIP_CHECK_QUERY, (trip_id,), primary=True)[0]
+    if trip["available_seats"] < 0 or trip["sold"] > trip["capacity"]:
+        problems.append(
+            f"trip {trip_id} oversold: {trip['sold']} tickets for "
+            f"{trip['capacity']} seats"
+        )
+    if trip["capacity"] - trip["available_seats"] != trip["sold"]:
+        problems.append(
+            f"trip {trip_id}: {trip['sold']} tickets but "
+            f"{trip['available_seats']}/{trip['capacity']} seats left"
+        )
+    if trip["seats"] != trip["sold"]:
+        problems.append(
+            f"trip {trip_id}: {trip['sold'] - trip['seats']} seats sold twice"
+        )
+    if trip["sold"] != purchased:
+        problems.append(
+            f"trip {trip_id}: {trip['sold']} tickets stored, "
+            f"{purchased} purchases reported"
+        )
+
+    rows = db.execute_query(
+        USER_CHECK_QUERY, (f"contention\\_{run_id}\\_%",), primary=True
+    )
+    for user in rows:
+        if user["balance"] < 0 or user["balance"] != user["ledger"]:
+            problems.append(
+                f"user {user['id']}: balance {user['balance']} "
+                f"but ledger sums to {user['ledger']}"
+            )
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--attempts", type=int, default=50, help="per process")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--seats", type=int, default=100)
+    parser.add_argument("--cost", type=float, default=10.0)
+    parser.add_argument(
+        "--balance", type=float, default=30.0, help="starting balance per passenger"
+    )
+    parser.add_argument("--json", action="store_true", help="print JSON only")
+    args = parser.parse_args(argv)
+
+    Database.bootstrap()
+    run_id = uuid.uuid4().hex[:8]
+    trip_id, user_ids = seed(run_id, args.users, args.seats, args.balance, args.cost)
+
+    started = time.perf_counter()
+    outcomes = Counter()
+    with ProcessPoolExecutor(max_workers=args.processes) as executor:
+        futures = [
+            executor.submit(buy, trip_id, user_ids, args.attempts)
+            for _ in range(args.processes)
+        ]
+        for future in futures:
+            outcomes.update(future.result())
+    elapsed = time.perf_counter() - started
+
+    problems = check(run_id, trip_id, outcomes["purchased"])
+    summary = {
+        "run_id": run_id,
+        "trip_id": trip_id,
+        "elapsed_s": elapsed,
+        "outcomes": dict(outcomes),
+        "problems": problems,
+    }
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(
+            f"Run {run_id}: {args.processes} processes x {args.attempts} attempts "
+            f"on trip {trip_id} in {elapsed:.2f}s"
+        )
+        print("Outcomes: " + ", ".join(f"{k}={v}" for k, v in outcomes.items()))
+        if problems:
+            print("Contention checks FAILED:")
+            for problem in problems:
+                print(f"  {problem}")
+        else:
+            print("Contention checks passed: no oversold seats, no lost balance")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
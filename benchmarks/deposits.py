@@ -0,0 +1,155 @@
+"""Deposit throughput with and without group commit.
+
+Drives concurrent asyncio sessions that each make a series of deposits
+through ``DepositBatcher``, first with batching off (one DEPOSIT_QUERY and one
+commit per deposit) and then on, and reports throughput, latency
+percentiles, the number of commits the server recorded and whether every
+benchmark user's balance and ledger match the deposits made.
+
+Creates benchmark users in the configured database. Run from the repository
+root::
+
+    python -m benchmarks.deposits --sessions 200 --deposits 20
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from decimal import Decimal
+
+from async_database import AsyncDatabase
+from database import Database
+from deposit_batcher import DepositBatcher
+
+COMMITS_QUERY = """
+    SELECT xact_commit FROM pg_stat_database WHERE datname = current_database()
+"""
+
+CHECK_QUERY = """
+    SELECT u.balance,
+           (SELECT count(*) FROM transactions t WHERE t.user_id = u.id) AS entries,
+           (SELECT coalesce(sum(t.amount), 0) FROM transactions t
+            WHERE t.user_id = u.id) AS ledger
+    FROM users u
+    WHERE u.username LIKE %s
+"""
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[round(fraction * (len(sorted_values) - 1))]
+
+
+def seed(run_id, users):
+    rows = Database().execute_query(
+        """
+        INSERT INTO users (username, password)
+        SELECT %s || g, 'x' FROM generate_series(1, %s) g
+        RETURNING id
+    """,
+        (f"deposits_{run_id}_", users),
+        primary=True,
+    )
+    return [row["id"] for row in rows]
+
+
+def commits():
+    return Database().execute_query(COMMITS_QUERY, primary=True)[0]["xact_commit"]
+
+
+async def drive(batcher, user_ids, sessions, deposits):
+    timings = []
+
+    async def session(number):
+        user_id = user_ids[number % len(user_ids)]
+        for _ in range(deposits):
+            started = time.perf_counter()
+            await batcher.deposit(user_id, "1.25")
+            timings.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(number) for number in range(sessions)))
+    elapsed = time.perf_counter() - started
+    await AsyncDatabase.close_pool()
+    return elapsed, sorted(timings)
+
+
+def measure(users, sessions, deposits, max_size, max_wait):
+    run_id = uuid.uuid4().hex[:8]
+    user_ids = seed(run_id, users)
+    summary = {}
+    for mode in ("single", "batched"):
+        batcher = DepositBatcher(
+            enabled=mode == "batched", max_size=max_size, max_wait=max_wait
+        )
+        before = commits()
+        elapsed, timings = asyncio.run(drive(batcher, user_ids, sessions, deposits))
+        # Statistics reach pg_stat_database asynchronously
+        time.sleep(1)
+        made = sessions * deposits
+        summary[mode] = {
+            "deposits": made,
+            "deposits_per_s": made / elapsed,
+            "p50_ms": percentile(timings, 0.50),
+            "p95_ms": percentile(timings, 0.95),
+            "p99_ms": percentile(timings, 0.99),
+            "commits": commits() - before,
+        }
+
+    rows = Database().execute_query(CHECK_QUERY, (f"deposits_{run_id}_%",), primary=True)
+    expected_entries = 2 * sessions * deposits
+    summary["checks"] = {
+        "ledger_entries": sum(row["entries"] for row in rows),
+        "expected_entries": expected_entries,
+        "balance_total": str(sum(row["balance"] for row in rows)),
+        "expected_total": str(Decimal("1.25") * expected_entries),
+        "ledger_mismatches": sum(row["balance"] != row["ledger"] for row in rows),
+    }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--deposits", type=int, default=20, help="per session")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--batch-wait-ms", type=float, default=2.0)
+    parser.add_argument("--json", action="store_true", help="print JSON only")
+    args = parser.parse_args(argv)
+
+    summary = measure(
+        args.users,
+        args.sessions,
+        args.deposits,
+        args.batch_size,
+        args.batch_wait_ms / 1000,
+    )
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return 0
+
+    print(
+        f"{args.sessions} sessions x {args.deposits} deposits over {args.users} users"
+    )
+    for mode in ("single", "batched"):
+        stats = summary[mode]
+        print(
+            f"{mode:>8}: {stats['deposits_per_s']:8,.0f} deposits/s | "
+            f"p50={stats['p50_ms']:.1f}ms p95={stats['p95_ms']:.1f}ms "
+            f"p99={stats['p99_ms']:.1f}ms | {stats['commits']} commits"
+        )
+    checks = summary["checks"]
+    print(
+        f"ledger entries {checks['ledger_entries']}/{checks['expected_entries']} | "
+        f"balances {checks['balance_total']}/{checks['expected_total']} | "
+        f"{checks['ledger_mismatches']} ledger mismatches"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
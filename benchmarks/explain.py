@@ -0,0 +1,145 @@
+"""Index check for the hot queries.
+
+Seeds the configured database the way the booking benchmark does, plus a
+backlog of completed trips so bookable ones are a small fraction of the
+table, then runs EXPLAIN on each hot query in models.py and
+transaction_manager.py and checks that every scan of its table, empty
+partitions aside, uses an index. Exits non-zero if any hot query falls back to a sequential scan.
+
+Run from the repository root::
+
+    python -m benchmarks.explain --users 2000 --history 100000
+"""
+
+import argparse
+import json
+import uuid
+
+from benchmarks.booking import seed
+from database import Database
+from models import (
+    AVAILABLE_TRIPS_QUERY,
+    LOGIN_QUERY,
+    TRIP_BY_ID_QUERY,
+    USER_TICKETS_FIRST_PAGE,
+    USER_TICKETS_PAGE_QUERY,
+)
+from transaction_manager import BALANCE_QUERY
+
+INDEX_SCANS = {"Index Scan", "Index Only Scan", "Bitmap Index Scan"}
+
+# Monthly partitions that ANALYZE found empty; scanning those sequentially
+# costs nothing, so they do not fail the check
+EMPTY_PARTITIONS_QUERY = r"""
+    SELECT c.relname
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = current_schema()
+    WHERE c.relkind = 'r' AND c.relname ~ '_y\d{4}m\d{2}$' AND c.reltuples = 0
+"""
+
+
+def hot_queries(username, user_id, trip_id):
+    """name -> (table that must be read through an index, query, parameters)"""
+    return {
+        "login": ("users", LOGIN_QUERY, (username,)),
+        "trip_by_id": ("trips", TRIP_BY_ID_QUERY, (trip_id,)),
+        "available_trips": ("trips", AVAILABLE_TRIPS_QUERY, ()),
+        "user_tickets_page": (
+            "tickets",
+            USER_TICKETS_PAGE_QUERY.format(seek=USER_TICKETS_FIRST_PAGE),
+            (user_id, 21),
+        ),
+        "user_balance": ("transactions", BALANCE_QUERY, {"user_id": user_id}),
+    }
+
+
+def scans(plan, table, empty=frozenset()):
+    """Node types of every scan of ``table`` or one of its monthly partitions,
+    leaving out the partitions named in ``empty``"""
+    found = []
+    relation = plan.get("Relation Name", "")
+    if relation == table or (
+        relation.startswith(f"{table}_y") and relation not in empty
+    ):
+        found.append(plan["Node Type"])
+    for child in plan.get("Plans", ()):
+        found.extend(scans(child, table, empty))
+    return found
+
+
+def seed_completed_trips(count, cost):
+    db = Database()
+    db.execute_query(
+        """
+        INSERT INTO trips (cost, start_time, end_time, capacity, available_seats, status)
+        SELECT %s,
+               CURRENT_TIMESTAMP - g * INTERVAL '1 hour' - INTERVAL '1 day',
+               CURRENT_TIMESTAMP - g * INTERVAL '1 hour' - INTERVAL '21 hours',
+               50, 0, 'COMPLETED'
+        FROM generate_series(1, %s) g
+    """,
+        (cost, count),
+    )
+    db.execute_query("ANALYZE trips")
+
+
+def check(run_id, trip_id):
+    """Return (plans by query name, list of problems)"""
+    db = Database()
+    username = f"bench_{run_id}_1"
+    user_id = db.execute_query(
+        "SELECT id FROM users WHERE username = %s", (username,), primary=True
+    )[0]["id"]
+
+    empty = {
+        row["relname"]
+        for row in db.execute_query(EMPTY_PARTITIONS_QUERY, primary=True)
+    }
+    plans = {}
+    problems = []
+    for name, (table, query, params) in hot_queries(username, user_id, trip_id).items():
+        plan = db.execute_query(
+            "EXPLAIN (FORMAT JSON) " + query, params, primary=True
+        )[0]["QUERY PLAN"][0]["Plan"]
+        plans[name] = plan
+        found = scans(plan, table, empty)
+        if not found:
+            problems.append(f"{name}: plan does not read {table}")
+        elif not set(found) <= INDEX_SCANS:
+            problems.append(f"{name}: {table} read with {', '.join(sorted(set(found)))}")
+    return plans, problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--trips", type=int, default=200, help="future trips")
+    parser.add_argument(
+        "--completed-trips", type=int, default=20000, help="extra past trips"
+    )
+    parser.add_argument("--history", type=int, default=100000, help="past tickets")
+    parser.add_argument("--json", action="store_true", help="print plans as JSON")
+    args = parser.parse_args(argv)
+
+    Database.bootstrap()
+    run_id = uuid.uuid4().hex[:8]
+    trip_ids = seed(run_id, args.users, args.trips, args.history, 50, 100.0, 10.0)
+    seed_completed_trips(args.completed_trips, 10.0)
+
+    plans, problems = check(run_id, trip_ids[0])
+    if args.json:
+        print(json.dumps({"plans": plans, "problems": problems}, indent=2))
+    else:
+        for name, plan in plans.items():
+            print(f"{name:>17}: {plan['Node Type']} (cost {plan['Total Cost']:.2f})")
+        if problems:
+            print("Index checks FAILED:")
+            for problem in problems:
+                print(f"  {problem}")
+        else:
+            print("Index checks passed: every hot query reads its table by index")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,116 @@
+"""Per-call latency of the hot queries, as text versus prepared statements.
+
+Runs each statement registered with ``prepared_statements`` (login lookup,
+trip by id, session version check, seat purchase and deposit) through the
+normal code paths, first with prepared statements turned off and then on,
+over one pooled connection, and reports latency percentiles for both.
+
+Creates one benchmark user and trip in the configured database. Run from the
+repository root::
+
+    python -m benchmarks.prepared --calls 2000
+"""
+
+import argparse
+import json
+import time
+import uuid
+
+from auth import SessionManager
+from database import Database, prepared_statements
+from models import LOGIN_QUERY, TRIP_BY_ID_QUERY, Trip, User
+from ticket_manager import TicketManager
+from transaction_manager import TransactionManager
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[round(fraction * (len(sorted_values) - 1))]
+
+
+def setup(calls):
+    """A funded user and a trip with a seat for every purchase in both passes"""
+    db = Database()
+    username = f"prepared_{uuid.uuid4().hex[:8]}"
+    user = User.register(username, uuid.uuid4().hex)
+    TransactionManager(db).deposit(user.id, 10 * calls)
+    trip = db.execute_query(
+        """
+        INSERT INTO trips (cost, start_time, end_time, capacity, available_seats)
+        VALUES (1, CURRENT_TIMESTAMP + INTERVAL '30 days',
+                CURRENT_TIMESTAMP + INTERVAL '31 days', %s, %s)
+        RETURNING id
+    """,
+        (2 * calls, 2 * calls),
+    )[0]["id"]
+    return username, user.id, trip
+
+
+def operations(username, user_id, trip_id, seats):
+    db = Database()
+    tickets = TicketManager(db)
+    ledger = TransactionManager(db)
+    # primary=True keeps every read on one server, replicas or not
+    return {
+        "login": lambda: db.execute_query(LOGIN_QUERY, (username,), primary=True),
+        "trip_by_id": lambda: db.execute_query(
+            TRIP_BY_ID_QUERY, (trip_id,), primary=True, row_factory=Trip
+        ),
+        "session_version": lambda: db.execute_query(
+            SessionManager.VERSION_QUERY, (user_id,), primary=True
+        ),
+        "purchase": lambda: tickets.purchase(user_id, trip_id, next(seats)),
+        "deposit": lambda: ledger.deposit(user_id, 1),
+    }
+
+
+def measure(calls, warmup):
+    username, user_id, trip_id = setup(calls + warmup)
+    # Both passes draw from one seat sequence, so no purchase hits a taken seat
+    seats = iter(range(1, 2 * (calls + warmup) + 1))
+    summary = {}
+    for mode in ("text", "prepared"):
+        prepared_statements.enabled = mode == "prepared"
+        for name, run in operations(username, user_id, trip_id, seats).items():
+            for _ in range(warmup):
+                run()
+            timings = []
+            for _ in range(calls):
+                started = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            summary.setdefault(name, {})[mode] = {
+                "p50_ms": percentile(timings, 0.50),
+                "p95_ms": percentile(timings, 0.95),
+                "mean_ms": sum(timings) / len(timings),
+            }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--json", action="store_true", help="print JSON only")
+    args = parser.parse_args(argv)
+
+    summary = measure(args.calls, args.warmup)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return 0
+
+    print(f"{args.calls} calls per query and mode")
+    for name, modes in summary.items():
+        text, prepared = modes["text"], modes["prepared"]
+        print(
+            f"{name:>15}: text p50={text['p50_ms']:.3f}ms p95={text['p95_ms']:.3f}ms | "
+            f"prepared p50={prepared['p50_ms']:.3f}ms p95={prepared['p95_ms']:.3f}ms | "
+            f"mean {100 * (prepared['mean_ms'] / text['mean_ms'] - 1):+.0f}%"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,121 @@
+"""Row materialization benchmark: dict rows versus slotted models.
+
+Fetches trip-shaped rows generated by the server (no table data needed) and
+compares three ways of holding them:
+
+* ``dicts`` - DictCursor rows kept as dicts (what listings used to return)
+* ``dict_to_model`` - DictCursor rows copied into models with ``Trip(**row)``
+* ``row_factory`` - RowCursor building slotted Trip objects from tuples
+
+For each it reports fetch throughput and the memory retained by the result.
+
+Run from the repository root::
+
+    python -m benchmarks.rows --rows 100000 --runs 5
+"""
+
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+from database import Database
+from models import Trip
+
+ROWS_QUERY = """
+    SELECT g AS id,
+           (10 + g %% 90)::numeric(10, 2) AS cost,
+           timestamp '2030-01-01' + g * interval '1 minute' AS start_time,
+           timestamp '2030-01-01' + g * interval '1 minute' + interval '2 hours'
+               AS end_time,
+           50 AS capacity,
+           50 - g %% 50 AS available_seats,
+           'SCHEDULED' AS status
+    FROM generate_series(1, %s) g
+"""
+
+
+def fetch_dicts(db, rows):
+    return db.execute_query(ROWS_QUERY, (rows,), primary=True)
+
+
+def fetch_dict_to_model(db, rows):
+    return [Trip(**row) for row in fetch_dicts(db, rows)]
+
+
+def fetch_row_factory(db, rows):
+    return db.execute_query(ROWS_QUERY, (rows,), primary=True, row_factory=Trip)
+
+
+SCENARIOS = {
+    "dicts": fetch_dicts,
+    "dict_to_model": fetch_dict_to_model,
+    "row_factory": fetch_row_factory,
+}
+
+
+def retained_bytes(fetch, db, rows):
+    """Bytes still allocated once the result is built, excluding transients"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = fetch(db, rows)
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    assert len(result) == rows
+    return after - before
+
+
+def measure(rows, runs):
+    db = Database()
+    # Warm the pool, the server's plan and the code paths
+    for fetch in SCENARIOS.values():
+        fetch(db, 100)
+
+    summary = {}
+    for name, fetch in SCENARIOS.items():
+        timings = []
+        for _ in range(runs):
+            gc.collect()
+            started = time.perf_counter()
+            fetch(db, rows)
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        memory = retained_bytes(fetch, db, rows)
+        summary[name] = {
+            "best_ms": best * 1000,
+            "rows_per_s": rows / best,
+            "retained_mb": memory / 2**20,
+            "bytes_per_row": memory / rows,
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print JSON only")
+    args = parser.parse_args(argv)
+
+    summary = measure(args.rows, args.runs)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return 0
+
+    print(f"{args.rows} rows, best of {args.runs} runs")
+    for name, stats in summary.items():
+        print(
+            f"{name:>13}: {stats['best_ms']:8.1f}ms "
+            f"{stats['rows_per_s']:>10,.0f} rows/s "
+            f"{stats['retained_mb']:7.1f}MB ({stats['bytes_per_row']:.0f} B/row)"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
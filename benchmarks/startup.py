@@ -0,0 +1,135 @@
+"""Startup-time benchmark for the terminal CLI.
+
+Launches fresh interpreter processes and reports how long it takes until the
+first menu is ready for input, how long importing the CLI takes, the latency
+of the first database query in a new process and the cost of a no-op
+``init-db`` run against an up-to-date schema.
+
+Run from the repository root::
+
+    python -m benchmarks.startup --runs 20
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+MENU_PROMPT = b"Enter your choice: "
+EXIT_CHOICE = b"5\n"
+
+FIRST_QUERY = """
+import time
+started = time.perf_counter()
+from models import Trip
+Trip.get_trip_by_id(0)
+print(time.perf_counter() - started)
+"""
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[round(fraction * (len(sorted_values) - 1))]
+
+
+def time_to_menu():
+    """Seconds from spawning ``cli.py`` until its first menu prompt is printed"""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "cli.py"],
+        cwd=ROOT,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        env={**os.environ, "TERM": "dumb"},
+    )
+    output = b""
+    while MENU_PROMPT not in output:
+        chunk = os.read(process.stdout.fileno(), 4096)
+        if not chunk:
+            raise RuntimeError("cli.py exited before showing the menu")
+        output += chunk
+    elapsed = time.perf_counter() - started
+    process.communicate(EXIT_CHOICE)
+    return elapsed
+
+
+def time_python(code):
+    """Wall time of a fresh interpreter running ``code``"""
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+    return time.perf_counter() - started
+
+
+def first_query():
+    """In-process time for importing the models and running one query"""
+    result = subprocess.run(
+        [sys.executable, "-c", FIRST_QUERY],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+    )
+    return float(result.stdout)
+
+
+def init_db():
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "database.py", "init-db"],
+        cwd=ROOT,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - started
+
+
+def measure(runs):
+    scenarios = {
+        "interpreter": lambda: time_python("pass"),
+        "import_cli": lambda: time_python("import cli"),
+        "menu_ready": time_to_menu,
+        "first_query": first_query,
+        "init_db_noop": init_db,
+    }
+    # One untimed pass warms the OS file cache and creates the schema
+    for run in scenarios.values():
+        run()
+
+    summary = {}
+    for name, run in scenarios.items():
+        values = sorted(run() * 1000 for _ in range(runs))
+        summary[name] = {
+            "p50_ms": percentile(values, 0.50),
+            "p95_ms": percentile(values, 0.95),
+            "max_ms": values[-1],
+        }
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="print JSON only")
+    args = parser.parse_args(argv)
+
+    summary = measure(args.runs)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return 0
+
+    print(f"{args.runs} runs per scenario")
+    for name, stats in summary.items():
+        print(
+            f"{name:>13}: p50={stats['p50_ms']:8.1f}ms "
+            f"p95={stats['p95_ms']:8.1f}ms max={stats['max_ms']:8.1f}ms"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,169 @@
+import argparse
+import sys
+
+from database import Database
+from exceptions import ImportValidationError
+from trip_cache import trip_cache
+
+TRIP_COLUMNS = ("cost", "start_time", "end_time", "capacity")
+
+STAGING_TABLE = """
+    CREATE TEMPORARY TABLE trips_staging (
+        line_no SERIAL,
+        cost TEXT,
+        start_time TEXT,
+        end_time TEXT,
+        capacity TEXT
+    ) ON COMMIT DROP
+"""
+
+# CASE stops at the first failing check, so casts only run on well-formed text;
+# timestamps go through try_timestamp (migration 0016), which turns dates like
+# Feb 30 into NULL instead of aborting the import with a cast error.
+# Reported line numbers count the header, matching what an editor shows.
+VALIDATE_STAGING = r"""
+    SELECT line_no + 1, error FROM (
+        SELECT line_no, CASE
+            WHEN cost IS NULL OR cost !~ '^\d{1,8}(\.\d{1,2})?$'
+                THEN 'invalid cost ' || coalesce(quote_literal(cost), 'NULL')
+            WHEN capacity IS NULL OR capacity !~ '^[1-9]\d{0,5}$'
+                THEN 'invalid capacity ' || coalesce(quote_literal(capacity), 'NULL')
+            WHEN start_time IS NULL
+              OR start_time !~ '^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2})?$'
+              OR try_timestamp(start_time) IS NULL
+                THEN 'invalid start_time ' || coalesce(quote_literal(start_time), 'NULL')
+            WHEN end_time IS NULL
+              OR end_time !~ '^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2})?$'
+              OR try_timestamp(end_time) IS NULL
+                THEN 'invalid end_time ' || coalesce(quote_literal(end_time), 'NULL')
+            WHEN try_timestamp(end_time) <= try_timestamp(start_time)
+                THEN 'end_time must be after start_time'
+        END AS error
+        FROM trips_staging
+    ) checked
+    WHERE error IS NOT NULL
+    ORDER BY line_no
+    LIMIT %s
+"""
+
+INSERT_FROM_STAGING = """
+    INSERT INTO trips (cost, start_time, end_time, capacity, available_seats)
+    SELECT cost::numeric, start_time::timestamp, end_time::timestamp,
+           capacity::integer, capacity::integer
+    FROM trips_staging
+    ORDER BY line_no
+"""
+
+EXPORT_QUERIES = {
+    "trips": (
+        "SELECT id, cost, start_time, end_time, capacity, available_seats, status, "
+        "created_at FROM trips",
+        "created_at",
+    ),
+    "tickets": (
+        "SELECT id, user_id, trip_id, purchase_time, status, seat_number FROM tickets",
+        "purchase_time",
+    ),
+    "transactions": (
+        "SELECT id, user_id, amount, type, description, created_at FROM transactions",
+        "created_at",
+    ),
+}
+
+
+def import_trips(file, max_errors=20):
+    """Load trips from a CSV stream (header: cost,start_time,end_time,capacity).
+
+    Rows are streamed into a staging table with COPY, validated there and then
+    inserted into ``trips`` in the same transaction, so either every row is
+    imported or none is. Returns the number of trips created.
+    """
+    db = Database()
+    with db.transaction() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(STAGING_TABLE)
+            cursor.copy_expert(
+                f"COPY trips_staging ({', '.join(TRIP_COLUMNS)}) "
+                "FROM STDIN WITH (FORMAT csv, HEADER true)",
+                file,
+            )
+            cursor.execute(VALIDATE_STAGING, (max_errors,))
+            errors = cursor.fetchall()
+            if errors:
+                raise ImportValidationError(errors)
+
+            cursor.execute(INSERT_FROM_STAGING)
+            imported = cursor.rowcount
+
+    trip_cache.invalidate()
+    return imported
+
+
+def export_table(name, file, since=None):
+    """Stream ``trips``, ``tickets`` or ``transactions`` to ``file`` as CSV.
+
+    ``since`` limits the export to rows created at or after that timestamp,
+    which keeps nightly exports incremental. Returns the number of rows written.
+    """
+    if name not in EXPORT_QUERIES:
+        choices = ", ".join(EXPORT_QUERIES)
+        raise ValueError(f"Unknown export {name!r}; choose from {choices}")
+
+    query, time_column = EXPORT_QUERIES[name]
+    db = Database()
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
+            if since is not None:
+                # COPY takes no bind parameters, so inline the value safely
+                query = cursor.mogrify(
+                    f"{query} WHERE {time_column} >= %s", (since,)
+                ).decode()
+            cursor.copy_expert(
+                f"COPY ({query} ORDER BY id) "
+                "TO STDOUT WITH (FORMAT csv, HEADER true)",
+                file,
+            )
+            exported = cursor.rowcount
+        conn.rollback()
+    return exported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk trip import and data export")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import-trips", help="import trips from CSV")
+    import_parser.add_argument("path", help="CSV file, or - for stdin")
+
+    export_parser = commands.add_parser("export", help="export a table to CSV")
+    export_parser.add_argument("table", choices=sorted(EXPORT_QUERIES))
+    export_parser.add_argument("path", help="CSV file, or - for stdout")
+    export_parser.add_argument(
+        "--since", help="only rows created at or after this time"
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.command == "import-trips":
+        try:
+            if args.path == "-":
+                imported = import_trips(sys.stdin)
+            else:
+                with open(args.path, newline="") as file:
+                    imported = import_trips(file)
+        except ImportValidationError as e:
+            print(f"Import failed: {e}", file=sys.stderr)
+            return 1
+        print(f"Imported {imported} trips", file=sys.stderr)
+    else:
+        if args.path == "-":
+            exported = export_table(args.table, sys.stdout, args.since)
+        else:
+            with open(args.path, "w", newline="") as file:
+                exported = export_table(args.table, file, args.since)
+        print(f"Exported {exported} {args.table}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
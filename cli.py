@@ -1,16 +1,20 @@
 import os
 import sys
-from models import User, Trip, Ticket
+import uuid
+from datetime import datetime
 from exceptions import (
+    CancellationError,
     InsufficientBalanceError,
     TripNotAvailableError,
     AuthenticationError,
+    TransactionConflictError,
 )
 
 
 class TerminalCLI:
     def __init__(self):
         self.current_user = None
+        self.session_token = None
         self.is_running = True
 
     def clear_screen(self):
@@ -19,13 +23,23 @@ class TerminalCLI:
     def display_menu(self):
         self.clear_screen()
         print("=== Passenger Terminal System === - cli.py:21")
+        if self.session_token:
+            from auth import sessions
+
+            # Picks up balance or role changes made elsewhere, and idle expiry
+            self.current_user = sessions.get_user(self.session_token)
+            if self.current_user is None:
+                self.session_token = None
+                print("Your session has expired, please log in again.")
         if self.current_user:
             if self.current_user.is_admin:
                 print(f"Welcome Admin: {self.current_user.username} - cli.py:24")
                 print("1. Manage Trips (CRUD) - cli.py:25")
                 print("2. View All Users - cli.py:26")
-                print("3. Logout - cli.py:27")
-                print("4. Exit - cli.py:28")
+                print("3. Query Statistics")
+                print("4. Sales Dashboard")
+                print("5. Logout")
+                print("6. Exit")
             else:
                 print(
                     f"Welcome: {self.current_user.username} | Balance: ${self.current_user.balance:.2f}"
@@ -35,8 +49,9 @@ class TerminalCLI:
                 print("3. My Tickets - cli.py:35")
                 print("4. Increase Balance - cli.py:36")
                 print("5. Change Password - cli.py:37")
-                print("6. Logout - cli.py:38")
-                print("7. Exit - cli.py:39")
+                print("6. Cancel Ticket")
+                print("7. Logout - cli.py:38")
+                print("8. Exit - cli.py:39")
         else:
             print("1. Register - cli.py:41")
             print("2. Login - cli.py:42")
@@ -45,6 +60,8 @@ class TerminalCLI:
             print("5. Exit - cli.py:45")
 
     def register_user(self):
+        from models import User
+
         self.clear_screen()
         print("=== User Registration === - cli.py:49")
         username = input("Username: ")
@@ -62,14 +79,17 @@ class TerminalCLI:
         input("Press Enter to continue...")
 
     def login_user(self):
+        from auth import sessions
+
         self.clear_screen()
         print("=== User Login === - cli.py:66")
         username = input("Username: ")
         password = input("Password: ")
 
-        user = User.login(username, password)
+        token, user = sessions.login(username, password)
         if user:
             self.current_user = user
+            self.session_token = token
             print("Login successful! - cli.py:73")
         else:
             print("Invalid credentials! - cli.py:75")
@@ -77,80 +97,201 @@ class TerminalCLI:
         input("Press Enter to continue...")
 
     def admin_login(self):
+        from auth import sessions
+
         self.clear_screen()
         print("=== Admin Login === - cli.py:81")
         username = input("Username: ")
         password = input("Password: ")
 
-        user = User.login(username, password)
+        token, user = sessions.login(username, password)
         if user and user.is_admin:
             self.current_user = user
+            self.session_token = token
             print("Admin login successful! - cli.py:88")
         else:
+            sessions.logout(token)
             print("Invalid admin credentials! - cli.py:90")
 
         input("Press Enter to continue...")
 
-    def view_available_trips(self):
-        self.clear_screen()
-        print("=== Available Trips === - cli.py:96")
-        trips = Trip.get_available_trips()
+    def logout(self):
+        from auth import sessions
+
+        sessions.logout(self.session_token)
+        self.current_user = None
+        self.session_token = None
+
+    SEARCH_SORTS = {"1": "start_time", "2": "cost", "3": "available_seats"}
+
+    def search_trips(self):
+        """Prompt for search filters and print the matching bookable trips"""
+        from models import PAGE_SIZE, Trip
+        from transaction_manager import to_amount
+
+        print("Leave a filter empty to skip it.")
+        try:
+            start_after = input("Departing after (YYYY-MM-DD HH:MM): ").strip()
+            start_before = input("Departing before (YYYY-MM-DD HH:MM): ").strip()
+            max_cost = input("Maximum cost: ").strip()
+            min_seats = input("Minimum free seats: ").strip()
+            sort = input(
+                "Sort by 1. Departure 2. Price 3. Free seats [1]: "
+            ).strip()
+            trips = Trip.search(
+                start_after=(
+                    datetime.fromisoformat(start_after) if start_after else None
+                ),
+                start_before=(
+                    datetime.fromisoformat(start_before) if start_before else None
+                ),
+                max_cost=to_amount(max_cost) if max_cost else None,
+                min_seats=int(min_seats) if min_seats else None,
+                sort=self.SEARCH_SORTS.get(sort, "start_time"),
+            )
+        except ValueError:
+            print("Invalid search filter!")
+            return []
 
         if not trips:
             print("No available trips found. - cli.py:100")
-        else:
-            for trip in trips:
-                print(
-                    f"ID: {trip.id} | Cost: ${trip.cost:.2f} |"
-                    f"Start: {trip.start_time} | End: {trip.end_time} | "
-                    f"Seats: {trip.available_seats}/{trip.capacity}"
-                )
+        for trip in trips:
+            print(
+                f"ID: {trip.id} | Cost: ${trip.cost:.2f} | "
+                f"Start: {trip.start_time} | End: {trip.end_time} | "
+                f"Seats: {trip.available_seats}/{trip.capacity}"
+            )
+        if len(trips) == PAGE_SIZE:
+            print(f"Showing the first {PAGE_SIZE} matches, narrow the search for more.")
+        return trips
 
+    def view_available_trips(self):
+        self.clear_screen()
+        print("=== Search Trips === - cli.py:96")
+        self.search_trips()
         input("Press Enter to continue...")
 
     def purchase_ticket(self):
+        from models import Ticket, Trip
+
         self.clear_screen()
         print("=== Purchase Ticket === - cli.py:113")
 
-        trips = Trip.get_available_trips()
-        if not trips:
-            print("No available trips found. - cli.py:117")
+        if not self.search_trips():
             input("Press Enter to continue...")
             return
 
-        for trip in trips:
-            print(f"ID: {trip.id} | Cost: ${trip.cost:.2f} | Start: {trip.start_time} - cli.py:122")
-
         try:
             trip_id = int(input("Enter Trip ID to purchase: "))
-            ticket = Ticket.purchase_ticket(self.current_user, trip_id)
-            if ticket:
-                print("Ticket purchased successfully! - cli.py:128")
+            seat_map = Trip.get_seat_map(trip_id)
+            if seat_map is None:
+                raise TripNotAvailableError("Trip not found")
+            self.render_seat_map(seat_map)
+            if "0" not in seat_map:
+                choice = input("This trip is sold out. Join the waitlist? (y/n): ")
+                if choice.lower() == "y":
+                    position = Ticket.join_waitlist(self.current_user, trip_id)
+                    print(
+                        f"You are number {position} on the waitlist. A freed seat "
+                        "is booked for you automatically and shows in My Tickets."
+                    )
+                input("Press Enter to continue...")
+                return
+
+            quantity = int(input("Number of tickets [1]: ") or 1)
+            # One key per purchase, so a retry after a lost connection
+            # cannot buy twice
+            idempotency_key = uuid.uuid4().hex
+            if quantity < 1:
+                print("Number of tickets must be at least 1!")
+            elif quantity == 1:
+                seat = input("Seat number [best available]: ").strip()
+                ticket = Ticket.purchase_ticket(
+                    self.current_user,
+                    trip_id,
+                    int(seat) if seat else None,
+                    idempotency_key,
+                )
+                if ticket:
+                    print(
+                        f"Ticket purchased successfully! Seat: {ticket.seat_number}"
+                    )
+                else:
+                    print("Failed to purchase ticket. - cli.py:130")
             else:
-                print("Failed to purchase ticket. - cli.py:130")
-        except (InsufficientBalanceError, TripNotAvailableError) as e:
+                # Groups get the best available block of seats together
+                tickets = Ticket.purchase_tickets(
+                    self.current_user, trip_id, quantity, idempotency_key
+                )
+                seats = ", ".join(str(ticket.seat_number) for ticket in tickets)
+                print(f"{len(tickets)} tickets purchased successfully! Seats: {seats}")
+        except (
+            InsufficientBalanceError,
+            TripNotAvailableError,
+            TransactionConflictError,
+        ) as e:
             print(f"Purchase failed: {e} - cli.py:132")
         except ValueError:
-            print("Invalid trip ID! - cli.py:134")
+            print("Invalid trip ID or quantity!")
         except Exception as e:
             print(f"An error occurred: {e} - cli.py:136")
 
         input("Press Enter to continue...")
 
+    @staticmethod
+    def render_seat_map(seat_map, per_row=4):
+        """Print seats in rows of ``per_row`` with an aisle in the middle;
+        sold seats show as XX"""
+        print("Seat map (XX = taken):")
+        aisle = per_row // 2
+        for start in range(0, len(seat_map), per_row):
+            cells = [
+                "XX" if taken == "1" else f"{start + offset + 1:02d}"
+                for offset, taken in enumerate(seat_map[start : start + per_row])
+            ]
+            print(" ".join(cells[:aisle]) + "   " + " ".join(cells[aisle:]))
+
     def view_my_tickets(self):
+        from user_dashboard import UserDashboard, print_statement
+
         self.clear_screen()
-        print("=== My Tickets === - cli.py:142")
-        tickets = Ticket.get_user_tickets(self.current_user.id)
+        print("=== My Tickets ===")
+        dashboard = UserDashboard(self.current_user.id)
+        print_statement(dashboard)
+        # The full history is only read when asked for, a page at a time
+        choice = input("h: Full ticket history | Enter: Back\nEnter your choice: ")
+        if choice.lower() != "h":
+            return
 
-        if not tickets:
-            print("No tickets found. - cli.py:146")
-        else:
-            for ticket in tickets:
+        self.browse_pages(
+            "Ticket History",
+            lambda after: dashboard.history_page(after=after),
+            lambda ticket: (
+                f"Ticket ID: {ticket.id} | Trip: {ticket.trip_id} | "
+                f"Seat: {ticket.seat_number} | Cost: ${ticket.cost:.2f} | "
+                f"Purchase Time: {ticket.purchase_time} | "
+                f"Status: {ticket.status}"
+            ),
+            empty_message="No tickets found.",
+        )
+
+    def cancel_ticket(self):
+        from models import Ticket
+
+        self.clear_screen()
+        print("=== Cancel Ticket ===")
+        try:
+            ticket_id = int(input("Enter Ticket ID to cancel (see My Tickets): "))
+            if input(f"Cancel ticket {ticket_id}? (y/n): ").lower() == "y":
+                Ticket.cancel_ticket(self.current_user, ticket_id)
                 print(
-                    f"Ticket ID: {ticket['id']} | Trip: {ticket['trip_id']} |"
-                    f"Cost: ${ticket['cost']:.2f} | Purchase Time: {ticket['purchase_time']} | "
-                    f"Status: {ticket['status']}"
+                    "Ticket cancelled and refunded. "
+                    f"New balance: ${self.current_user.balance:.2f}"
                 )
+        except (CancellationError, TransactionConflictError) as e:
+            print(f"Cancellation failed: {e}")
+        except ValueError:
+            print("Invalid ticket ID!")
 
         input("Press Enter to continue...")
 
@@ -158,17 +299,18 @@ class TerminalCLI:
         self.clear_screen()
         print("=== Increase Balance === - cli.py:159")
 
+        from transaction_manager import to_amount
+
         try:
-            amount = float(input("Enter amount to deposit: "))
-            if amount <= 0:
-                print("Amount must be positive! - cli.py:164")
-            else:
-                self.current_user.increase_balance(amount)
-                print(
-                    f"Balance increased by ${amount:.2f}. New balance: ${self.current_user.balance:.2f}"
-                )
-        except ValueError:
-            print("Invalid amount! - cli.py:171")
+            amount = to_amount(input("Enter amount to deposit: "))
+            self.current_user.increase_balance(amount, uuid.uuid4().hex)
+            print(
+                f"Balance increased by ${amount:.2f}. New balance: ${self.current_user.balance:.2f}"
+            )
+        except ValueError as e:
+            print(f"Invalid amount! {e}")
+        except TransactionConflictError as e:
+            print(f"Deposit failed: {e}")
 
         input("Press Enter to continue...")
 
@@ -194,6 +336,8 @@ class TerminalCLI:
         print("2. View All Trips - cli.py:194")
         print("3. Update Trip - cli.py:195")
         print("4. Delete Trip - cli.py:196")
+        print("5. Import Trips from CSV")
+        print("6. Export Data to CSV")
 
         choice = input("Enter your choice: ")
 
@@ -205,18 +349,25 @@ class TerminalCLI:
             self.update_trip()
         elif choice == "4":
             self.delete_trip()
+        elif choice == "5":
+            self.import_trips()
+        elif choice == "6":
+            self.export_data()
 
     def create_trip(self):
         self.clear_screen()
         print("=== Create New Trip === - cli.py:211")
 
+        from transaction_manager import to_amount
+
         try:
-            cost = float(input("Cost: "))
+            cost = to_amount(input("Cost: "))
             start_time = input("Start time (YYYY-MM-DD HH:MM:SS): ")
             end_time = input("End time (YYYY-MM-DD HH:MM:SS): ")
             capacity = int(input("Capacity: "))
 
             from database import Database
+            from trip_cache import trip_cache
 
             db = Database()
             db.execute_query(
@@ -226,6 +377,7 @@ class TerminalCLI:
             """,
                 (cost, start_time, end_time, capacity, capacity),
             )
+            trip_cache.invalidate()
 
             print("Trip created successfully!")
         except Exception as e:
@@ -233,43 +385,155 @@ class TerminalCLI:
 
         input("Press Enter to continue...")
 
-    def view_all_trips(self):
+    def import_trips(self):
         self.clear_screen()
-        print("=== All Trips ===")
+        print("=== Import Trips ===")
+        print("CSV header: cost,start_time,end_time,capacity")
 
-        from database import Database
+        from bulk_io import import_trips
+        from exceptions import ImportValidationError
 
-        db = Database()
-        trips = db.execute_query("SELECT * FROM trips ORDER BY start_time")
+        path = input("CSV file path: ")
+        try:
+            with open(path, newline="") as file:
+                imported = import_trips(file)
+            print(f"Imported {imported} trips successfully!")
+        except ImportValidationError as e:
+            print("Import failed, no trips were created:")
+            for line_no, error in e.errors:
+                print(f"  Line {line_no}: {error}")
+        except Exception as e:
+            print(f"Failed to import trips: {e}")
 
-        for trip in trips:
-            print(
-                f"ID: {trip['id']} | Cost: ${trip['cost']:.2f} | "
-                f"Start: {trip['start_time']} | End: {trip['end_time']} | "
-                f"Status: {trip['status']} | Seats: {trip['available_seats']}/{trip['capacity']}"
-            )
+        input("Press Enter to continue...")
+
+    def export_data(self):
+        self.clear_screen()
+        print("=== Export Data ===")
+
+        from bulk_io import EXPORT_QUERIES, export_table
+
+        table = input(f"Table ({'/'.join(EXPORT_QUERIES)}): ")
+        path = input("CSV file path: ")
+        since = input("Only rows since (YYYY-MM-DD HH:MM:SS, blank for all): ")
+        try:
+            with open(path, "w", newline="") as file:
+                exported = export_table(table, file, since or None)
+            print(f"Exported {exported} rows to {path}")
+        except Exception as e:
+            print(f"Failed to export data: {e}")
 
         input("Press Enter to continue...")
 
+    def view_all_trips(self):
+        from models import Trip
+
+        self.browse_pages(
+            "All Trips",
+            lambda after: Trip.get_trips_page(after=after),
+            lambda trip: (
+                f"ID: {trip.id} | Cost: ${trip.cost:.2f} | "
+                f"Start: {trip.start_time} | End: {trip.end_time} | "
+                f"Status: {trip.status} | Seats: {trip.available_seats}/{trip.capacity}"
+            ),
+        )
+
     def view_all_users(self):
+        from models import User
+
+        self.browse_pages(
+            "All Users",
+            lambda after: User.get_users_page(after=after),
+            lambda user: (
+                f"ID: {user.id} | Username: {user.username} | "
+                f"Balance: ${user.balance:.2f} | "
+                f"Type: {'Admin' if user.is_admin else 'User'}"
+            ),
+        )
+
+    def view_dashboard(self):
+        self.clear_screen()
+        print("=== Sales Dashboard ===")
+
+        from admin_dashboard import AdminDashboard, print_report
+
+        print_report(AdminDashboard())
+        input("Press Enter to continue...")
+
+    def view_query_stats(self):
         self.clear_screen()
-        print("=== All Users ===")
+        print("=== Query Statistics (this process) ===")
 
-        from database import Database
+        from query_stats import query_stats
+        from trip_cache import trip_cache
 
-        db = Database()
-        users = db.execute_query(
-            "SELECT id, username, balance, is_admin FROM users ORDER BY created_at"
+        stats = query_stats.summary()
+        checkout = stats["checkout"]
+        print(
+            f"Connection checkouts: {checkout['count']} | "
+            f"p50: {checkout['p50_ms']:.2f}ms | p95: {checkout['p95_ms']:.2f}ms | "
+            f"p99: {checkout['p99_ms']:.2f}ms"
+        )
+        retries = ", ".join(
+            f"{error}: {count}" for error, count in stats["retries"].items()
+        )
+        print(f"Transaction retries: {retries or 'none'}")
+        cache = trip_cache.stats()
+        print(
+            f"Trip cache: {cache['hits']} hits | {cache['misses']} misses | "
+            f"{cache['invalidations']} invalidations"
         )
+        print()
 
-        for user in users:
-            user_type = "Admin" if user["is_admin"] else "User"
+        for query in stats["queries"][:10]:
             print(
-                f"ID: {user['id']} | Username: {user['username']} | "
-                f"Balance: ${user['balance']:.2f} | Type: {user_type}"
+                f"{query['calls']} calls | total: {query['total_ms']:.1f}ms | "
+                f"p50: {query['p50_ms']:.2f}ms | p95: {query['p95_ms']:.2f}ms | "
+                f"p99: {query['p99_ms']:.2f}ms | rows: {query['rows']}"
             )
-
-        input("Press Enter to continue...")
+            print(f"  {query['query'][:100]}")
+            for site, calls in query["call_sites"].items():
+                print(f"  from {site} ({calls})")
+
+        choice = input("r: Reset statistics | Enter: Back\nEnter your choice: ")
+        if choice.lower() == "r":
+            query_stats.reset()
+
+    def browse_pages(
+        self, title, fetch_page, render, empty_message="No records found."
+    ):
+        # Keyset pages only seek forward, so keep the start key of every page
+        # seen so far to be able to step back
+        page_starts = [None]
+        while True:
+            self.clear_screen()
+            print(f"=== {title} === (Page {len(page_starts)})")
+            rows, next_start = fetch_page(page_starts[-1])
+
+            if not rows:
+                print(empty_message)
+            for row in rows:
+                print(render(row))
+
+            has_previous = len(page_starts) > 1
+            if not next_start and not has_previous:
+                input("Press Enter to continue...")
+                return
+
+            options = []
+            if next_start:
+                options.append("n: Next page")
+            if has_previous:
+                options.append("p: Previous page")
+            options.append("q: Back")
+            choice = input(" | ".join(options) + "\nEnter your choice: ").lower()
+
+            if choice == "n" and next_start:
+                page_starts.append(next_start)
+            elif choice == "p" and has_previous:
+                page_starts.pop()
+            elif choice == "q":
+                return
 
     def run(self):
         while self.is_running:
@@ -299,10 +563,14 @@ class TerminalCLI:
                 elif choice == "2":
                     self.view_all_users()
                 elif choice == "3":
-                    self.current_user = None
+                    self.view_query_stats()
+                elif choice == "4":
+                    self.view_dashboard()
+                elif choice == "5":
+                    self.logout()
                     print("Logged out successfully!")
                     input("Press Enter to continue...")
-                elif choice == "4":
+                elif choice == "6":
                     self.is_running = False
                 else:
                     print("Invalid choice!")
@@ -321,10 +589,12 @@ class TerminalCLI:
                 elif choice == "5":
                     self.change_password()
                 elif choice == "6":
-                    self.current_user = None
+                    self.cancel_ticket()
+                elif choice == "7":
+                    self.logout()
                     print("Logged out successfully!")
                     input("Press Enter to continue...")
-                elif choice == "7":
+                elif choice == "8":
                     self.is_running = False
                 else:
                     print("Invalid choice!")
@@ -333,6 +603,20 @@ class TerminalCLI:
         print("Thank you for using Passenger Terminal System!")
 
 
+def start_background_work():
+    # Importing psycopg2 and opening the first connection happen here, off the
+    # main thread, so the first menu renders without waiting for them. The
+    # schema is created by `python database.py init-db`, never on launch.
+    from trip_scheduler import TripStatusScheduler
+
+    TripStatusScheduler().start()
+
+
 if __name__ == "__main__":
+    import threading
+
+    threading.Thread(
+        target=start_background_work, name="startup", daemon=True
+    ).start()
     cli = TerminalCLI()
     cli.run()
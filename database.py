@@ -1,23 +1,589 @@
+import argparse
+import os
+import random
+import re
+import threading
+import time
+import uuid
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+
 import psycopg2
+from psycopg2 import pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, cursor as BaseCursor
 from psycopg2.extras import RealDictCursor
-from datetime import datetime
-import os
-from decouple import config
+from decouple import Csv, config
+
+from exceptions import PoolTimeoutError, SchemaVersionError, TransactionConflictError
+from query_stats import query_stats
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+
+# Arbitrary key for the advisory lock taken while bootstrapping the schema
+MIGRATION_LOCK_ID = 72_134_001
+
+_PLAIN_SELECT = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+_SIDE_EFFECTS = re.compile(
+    r"\bFOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE|KEY\s+SHARE)\b"
+    r"|\b(?:pg_advisory\w*|pg_notify|nextval|setval)\s*\(",
+    re.IGNORECASE,
+)
+
+# Per-thread routing state; a terminal session runs on one thread
+_session = threading.local()
+
+# Retry policy of Database.run_transaction and AsyncDatabase.run_transaction
+TRANSACTION_ATTEMPTS = config("DB_TRANSACTION_ATTEMPTS", default=10, cast=int)
+RETRY_BACKOFF = config("DB_RETRY_BACKOFF_MS", default=10.0, cast=float) / 1000
+RETRY_BACKOFF_MAX = (
+    config("DB_RETRY_BACKOFF_MAX_MS", default=1000.0, cast=float) / 1000
+)
+CONFLICT_MESSAGE = "The request kept conflicting with others, please try again"
+
+
+def is_replica_safe(query):
+    """True for plain SELECTs that neither lock rows nor have side effects"""
+    if isinstance(query, bytes):
+        query = query.decode()
+    return bool(_PLAIN_SELECT.match(query)) and not _SIDE_EFFECTS.search(query)
+
+
+def is_retryable(error, idempotent=False):
+    """Serialization failures and deadlocks roll the whole transaction back, so
+    it can simply run again. A lost connection may also have lost the reply to
+    COMMIT, so that is only retried when running the work twice is harmless."""
+    if isinstance(error, psycopg2.extensions.TransactionRollbackError):
+        return True
+    return idempotent and isinstance(
+        error, (psycopg2.OperationalError, psycopg2.InterfaceError)
+    )
+
+
+def retry_delay(attempt):
+    """Exponential backoff with full jitter, so conflicting buyers spread out"""
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2**attempt))
+
+
+class PreparedStatement:
+    """A registered query rewritten as PREPARE / EXECUTE statements.
+
+    psycopg2 placeholders become $n parameters: ``%s`` in order, or one per
+    distinct ``%(name)s``.
+    """
+
+    _PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+
+    def __init__(self, name, query):
+        self.name = name
+        self.names = []
+        positional = 0
+
+        def parameter(match):
+            nonlocal positional
+            if match.group(0) == "%%":
+                return "%"
+            if match.group(1) is None:
+                positional += 1
+                return f"${positional}"
+            if match.group(1) not in self.names:
+                self.names.append(match.group(1))
+            return f"${self.names.index(match.group(1)) + 1}"
+
+        body = self._PLACEHOLDER.sub(parameter, query)
+        if positional and self.names:
+            raise ValueError(f"{name}: cannot mix %s and %(name)s placeholders")
+        count = positional or len(self.names)
+        self.prepare_sql = f"PREPARE {name} AS {body}"
+        self.execute_sql = (
+            f"EXECUTE {name} ({', '.join(['%s'] * count)})"
+            if count
+            else f"EXECUTE {name}"
+        )
+
+    def arguments(self, vars):
+        if self.names:
+            return tuple(vars[name] for name in self.names)
+        return tuple(vars or ())
+
+
+class PreparedStatements:
+    """Hot queries run as named server-side prepared statements.
+
+    Modules register their hottest statements once; any cursor executing one
+    of those exact query strings then sends EXECUTE instead of the full text,
+    so the server skips parsing and can reuse the plan. Statements are
+    prepared lazily on each connection, so a replacement connection from the
+    pool simply prepares them again. DB_PREPARED_STATEMENTS=false turns this
+    off.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._statements = {}
+        self._prepared = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def register(self, name, query):
+        self._statements[query] = PreparedStatement(f"hot_{name}", query)
+        return query
+
+    def get(self, query):
+        if not self.enabled:
+            return None
+        return self._statements.get(query)
+
+    def is_prepared(self, conn, statement):
+        return statement.name in self._prepared.get(conn, ())
+
+    def mark_prepared(self, conn, statement):
+        with self._lock:
+            self._prepared.setdefault(conn, set()).add(statement.name)
+
+
+prepared_statements = PreparedStatements(
+    enabled=config("DB_PREPARED_STATEMENTS", default=True, cast=bool)
+)
+
+
+class TimedCursorMixin:
+    """Reports the duration and row count of every execute to query_stats.
+
+    Registered hot queries run through their prepared statement; server-side
+    (named) cursors cannot DECLARE over EXECUTE, so they send the text.
+    """
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            statement = prepared_statements.get(query) if self.name is None else None
+            if statement is None:
+                return super().execute(query, vars)
+            if not prepared_statements.is_prepared(self.connection, statement):
+                super().execute(statement.prepare_sql)
+                prepared_statements.mark_prepared(self.connection, statement)
+            return super().execute(statement.execute_sql, statement.arguments(vars))
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            query_stats.record_query(query, vars, elapsed_ms, self.rowcount)
+
+
+class TimedCursor(TimedCursorMixin, BaseCursor):
+    pass
+
+
+class DictCursor(TimedCursorMixin, RealDictCursor):
+    pass
+
+
+class RowCursor(TimedCursor):
+    """Builds each row as ``row_factory(*values)`` straight from the result
+    tuple, skipping the per-row dict that DictCursor allocates"""
+
+    row_factory = None
+
+    def fetchone(self):
+        row = super().fetchone()
+        return self.row_factory(*row) if row is not None else None
+
+    def fetchmany(self, size=None):
+        factory = self.row_factory
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        return [factory(*row) for row in rows]
+
+    def fetchall(self):
+        factory = self.row_factory
+        return [factory(*row) for row in super().fetchall()]
+
+    def __iter__(self):
+        # super().__iter__() is the cursor itself; a for loop over it would
+        # come back here, so step it with next() as NamedTupleCursor does
+        factory = self.row_factory
+        rows = super().__iter__()
+        while True:
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            yield factory(*row)
+
+
+class ConnectionPool:
+    """Thread-safe pool of open connections with a bounded checkout wait.
+
+    ``minconn`` connections are opened up front; returned connections stay
+    open while at most ``max_idle`` (default ``minconn``) sit idle and are
+    closed beyond that.
+    """
+
+    def __init__(
+        self, minconn, maxconn, timeout, health_check_interval, max_idle=None, **dsn
+    ):
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, **dsn)
+        # psycopg2 closes a returned connection once ``minconn`` are idle, so
+        # after the initial connects its minconn becomes the idle cap
+        if max_idle is not None:
+            self._pool.minconn = max(minconn, max_idle)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self.pid = os.getpid()
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeoutError(
+                f"No database connection available after {self.timeout}s"
+            )
+        try:
+            conn = self._pool.getconn()
+            if not self._is_healthy(conn):
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        return conn
+
+    def putconn(self, conn):
+        try:
+            status = conn.info.transaction_status if not conn.closed else None
+            if status is not None and status != TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+        self._last_used.clear()
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < self.health_check_interval:
+            return True
+        # Only ping connections that sat idle long enough to have been dropped
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+
+class ReplicaSet:
+    """Round-robin over read replica pools, skipping replicas that failed recently"""
+
+    def __init__(self, dsns, pool_factory, retry_interval, read_your_writes_window):
+        self.dsns = dsns
+        self.pid = os.getpid()
+        self.retry_interval = retry_interval
+        self.read_your_writes_window = read_your_writes_window
+        self._pool_factory = pool_factory
+        self._pools = [None] * len(dsns)
+        self._down_until = [0.0] * len(dsns)
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def choose(self):
+        """Return (index, pool) for the next healthy replica, or None if all are down"""
+        now = time.monotonic()
+        with self._lock:
+            for _ in range(len(self.dsns)):
+                index = self._next
+                self._next = (self._next + 1) % len(self.dsns)
+                if self._down_until[index] > now:
+                    continue
+                if self._pools[index] is None:
+                    self._pools[index] = self._pool_factory(self.dsns[index])
+                return index, self._pools[index]
+        return None
+
+    def mark_down(self, index):
+        # Connections of a failed replica are dropped with its pool; checked-out
+        # ones are returned to the orphaned pool and closed there
+        with self._lock:
+            self._down_until[index] = time.monotonic() + self.retry_interval
+            self._pools[index] = None
+
+    def closeall(self):
+        with self._lock:
+            for replica_pool in self._pools:
+                if replica_pool is not None:
+                    replica_pool.closeall()
+            self._pools = [None] * len(self.dsns)
 
 
 class Database:
+    _pool = None
+    _replicas = None
+    _inherited_replicas = None
+    _inherited_pool = None
+    _pool_lock = threading.Lock()
+    _bootstrap_lock = threading.Lock()
+    _schema_checked = False
+
     def __init__(self):
-        self.conn = psycopg2.connect(
-            host=config("DB_HOST", default="localhost"),
-            database=config("DB_NAME", default="terminal_db"),
-            user=config("DB_USER", default="postgres"),
-            password=config("DB_PASSWORD", default="Behnam0900@"),
-            port=config("DB_PORT", default=5432),
+        # No connection is made until the first query
+        self.replicas = self.get_replicas()
+
+    @property
+    def pool(self):
+        return self.get_pool()
+
+    @staticmethod
+    def connection_params():
+        return {
+            "host": config("DB_HOST", default="localhost"),
+            "database": config("DB_NAME", default="terminal_db"),
+            "user": config("DB_USER", default="postgres"),
+            "password": config("DB_PASSWORD", default="Behnam0900@"),
+            "port": config("DB_PORT", default=5432),
+        }
+
+    @classmethod
+    def replica_params(cls):
+        """Connection parameters per DB_REPLICAS entry (``host[:port]``, comma
+        separated); database name and credentials are shared with the primary"""
+        replicas = []
+        for address in config("DB_REPLICAS", default="", cast=Csv()):
+            host, _, port = address.partition(":")
+            params = cls.connection_params()
+            params.update(host=host, port=port or params["port"])
+            replicas.append(params)
+        return replicas
+
+    @staticmethod
+    def create_pool(minconn, max_idle=None, **dsn):
+        # DB_POOL_MIN connections are opened when the pool is created; up to
+        # DB_POOL_MAX_IDLE stay open between queries (default DB_POOL_MAX, so
+        # busy threads do not reconnect)
+        if max_idle is None:
+            max_idle = config(
+                "DB_POOL_MAX_IDLE",
+                default=config("DB_POOL_MAX", default=10, cast=int),
+                cast=int,
+            )
+        return ConnectionPool(
+            minconn=minconn,
+            max_idle=max_idle,
+            maxconn=config("DB_POOL_MAX", default=10, cast=int),
+            timeout=config("DB_POOL_TIMEOUT", default=5.0, cast=float),
+            health_check_interval=config(
+                "DB_POOL_HEALTH_CHECK_INTERVAL", default=30.0, cast=float
+            ),
+            cursor_factory=TimedCursor,
+            **dsn,
         )
-        self.create_tables()
 
-    def create_tables(self):
-        with self.conn.cursor() as cursor:
+    @classmethod
+    def get_pool(cls):
+        # A forked child must not share the parent's sockets, so it gets its own
+        # pool; the inherited one is kept referenced so it is never closed here
+        if cls._pool is None or cls._pool.pid != os.getpid():
+            with cls._pool_lock:
+                if cls._pool is None or cls._pool.pid != os.getpid():
+                    cls._inherited_pool = cls._pool
+                    cls._pool = cls.create_pool(
+                        config("DB_POOL_MIN", default=1, cast=int),
+                        **cls.connection_params(),
+                    )
+        return cls._pool
+
+    @classmethod
+    def get_replicas(cls):
+        """The process's ReplicaSet, or None when DB_REPLICAS is not configured"""
+        if cls._replicas is None or cls._replicas.pid != os.getpid():
+            with cls._pool_lock:
+                if cls._replicas is None or cls._replicas.pid != os.getpid():
+                    dsns = cls.replica_params()
+                    if not dsns:
+                        return None
+                    cls._inherited_replicas = cls._replicas
+                    # Replica pools connect lazily so a dead replica cannot
+                    # stop the terminal from starting, but keep what they
+                    # opened instead of reconnecting for every read
+                    cls._replicas = ReplicaSet(
+                        dsns,
+                        lambda dsn: cls.create_pool(0, **dsn),
+                        retry_interval=config(
+                            "DB_REPLICA_RETRY_INTERVAL", default=30.0, cast=float
+                        ),
+                        read_your_writes_window=config(
+                            "DB_READ_YOUR_WRITES_WINDOW", default=5.0, cast=float
+                        ),
+                    )
+        return cls._replicas
+
+    @classmethod
+    def close_pool(cls):
+        with cls._pool_lock:
+            if cls._pool is not None:
+                cls._pool.closeall()
+                cls._pool = None
+            if cls._replicas is not None:
+                cls._replicas.closeall()
+                cls._replicas = None
+
+    @staticmethod
+    def latest_schema_version():
+        return max(
+            (int(path.name.split("_", 1)[0]) for path in MIGRATIONS_DIR.glob("*.sql")),
+            default=0,
+        )
+
+    @staticmethod
+    def schema_version(conn):
+        """Highest applied migration, or None if the schema was never created"""
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+            if not cursor.fetchone()[0]:
+                return None
+            cursor.execute("SELECT coalesce(max(version), 0) FROM schema_version")
+            return cursor.fetchone()[0]
+
+    @classmethod
+    def check_schema(cls, conn):
+        """Fail fast when init-db has not been run for this version of the code"""
+        version = cls.schema_version(conn)
+        latest = cls.latest_schema_version()
+        if version is None or version < latest:
+            raise SchemaVersionError(
+                f"Database schema is at version {version or 0}, expected {latest}; "
+                "run `python database.py init-db`"
+            )
+
+    @classmethod
+    def verify_schema(cls):
+        """Run the schema version check now instead of on the first query"""
+        with cls().connection():
+            pass
+
+    @classmethod
+    def bootstrap(cls):
+        """Create or upgrade the schema (the init-db command).
+
+        Idempotent: when the recorded schema version is current it returns
+        after one read, without running any DDL.
+        """
+        # Uses the pool directly: connection() would refuse an outdated schema
+        with cls._bootstrap_lock:
+            pool = cls.get_pool()
+            conn = pool.getconn()
+            try:
+                if cls.schema_version(conn) != cls.latest_schema_version():
+                    with conn.cursor() as cursor:
+                        # Serializes terminals bootstrapping the same database
+                        cursor.execute(
+                            "SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,)
+                        )
+                    cls.create_tables(conn)
+                    cls.migrate(conn)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                pool.putconn(conn)
+            cls._schema_checked = True
+
+    def mark_write(self):
+        """Pin this thread's reads to the primary for DB_READ_YOUR_WRITES_WINDOW
+        seconds, so a session sees its own purchases and deposits at once"""
+        if self.replicas is not None:
+            _session.primary_until = (
+                time.monotonic() + self.replicas.read_your_writes_window
+            )
+
+    @staticmethod
+    def recently_wrote():
+        return time.monotonic() < getattr(_session, "primary_until", 0.0)
+
+    @contextmanager
+    def connection(self, pool=None):
+        pool = pool or self.pool
+        started = time.perf_counter()
+        conn = pool.getconn()
+        query_stats.record_checkout((time.perf_counter() - started) * 1000)
+        try:
+            if not Database._schema_checked:
+                # Once per process, on the first real query instead of at launch
+                self.check_schema(conn)
+                conn.rollback()
+                Database._schema_checked = True
+            yield conn
+        finally:
+            pool.putconn(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Read-write transaction on the primary"""
+        with self._transaction(self.pool) as conn:
+            yield conn
+        self.mark_write()
+
+    @contextmanager
+    def _transaction(self, pool):
+        with self.connection(pool) as conn:
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def run_transaction(self, work, idempotent=False, attempts=None):
+        """Return ``work(conn)`` run in a read-write transaction, retried when
+        Postgres aborts it with a serialization failure or deadlock.
+
+        ``work`` may run several times, so it must do nothing but database
+        work in ``conn``. With ``idempotent`` (the work is guarded by an
+        idempotency key) lost connections are retried as well. Raises
+        TransactionConflictError once the attempts run out.
+        """
+        attempts = attempts or TRANSACTION_ATTEMPTS
+        for attempt in range(attempts):
+            try:
+                with self.transaction() as conn:
+                    return work(conn)
+            except psycopg2.Error as e:
+                if not is_retryable(e, idempotent):
+                    raise
+                if attempt == attempts - 1:
+                    if isinstance(e, psycopg2.extensions.TransactionRollbackError):
+                        raise TransactionConflictError(CONFLICT_MESSAGE) from e
+                    raise
+                query_stats.record_retry(e)
+                time.sleep(retry_delay(attempt))
+
+    def read_pool(self, query, primary=False):
+        """Pick where a query runs: (replica index, pool), or None for the primary"""
+        if primary or self.replicas is None or self.recently_wrote():
+            return None
+        if not is_replica_safe(query):
+            return None
+        return self.replicas.choose()
+
+    def _on_replica(self, replica, run):
+        """Run ``run(pool)`` on a replica, falling back to the primary if it fails"""
+        index, pool = replica
+        try:
+            return run(pool)
+        except PoolTimeoutError:
+            return run(None)
+        except psycopg2.OperationalError as e:
+            # Recovery conflicts cancel the query but leave the replica usable
+            if not isinstance(e, psycopg2.extensions.TransactionRollbackError):
+                self.replicas.mark_down(index)
+            return run(None)
+
+    @staticmethod
+    def create_tables(conn):
+        with conn.cursor() as cursor:
             # Users table
             cursor.execute(
                 """
@@ -78,19 +644,110 @@ class Database:
             # Create superuser if not exists
             cursor.execute(
                 """
-                INSERT INTO users (username, password, is_admin) 
+                INSERT INTO users (username, password, is_admin)
                 VALUES (%s, %s, %s)
                 ON CONFLICT (username) DO NOTHING
             """,
                 ("admin", "admin123", True),
             )
 
-            self.conn.commit()
+    @staticmethod
+    def pending_migrations(applied):
+        migrations = []
+        for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+            version = int(path.name.split("_", 1)[0])
+            if version not in applied:
+                migrations.append((version, path))
+        return migrations
+
+    @classmethod
+    def migrate(cls, conn):
+        """Apply every migration script newer than the recorded schema version"""
+        with conn.cursor() as cursor:
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """
+            )
+            cursor.execute("SELECT version FROM schema_version")
+            applied = {row[0] for row in cursor.fetchall()}
+
+            for version, path in cls.pending_migrations(applied):
+                cursor.execute(path.read_text())
+                cursor.execute(
+                    "INSERT INTO schema_version (version, name) VALUES (%s, %s)",
+                    (version, path.stem),
+                )
+
+    @staticmethod
+    def _cursor(conn, row_factory=None, name=None):
+        if row_factory is None:
+            return conn.cursor(name=name, cursor_factory=DictCursor)
+        cursor = conn.cursor(name=name, cursor_factory=RowCursor)
+        cursor.row_factory = row_factory
+        return cursor
+
+    def execute_query(self, query, params=None, primary=False, row_factory=None):
+        """Run one statement; plain SELECTs go to a replica when one is configured,
+        unless ``primary`` is set or this thread wrote recently.
+
+        Rows are dicts, or ``row_factory(*values)`` when one is given.
+        """
+
+        def run(pool):
+            with self._transaction(pool or self.pool) as conn:
+                with self._cursor(conn, row_factory) as cursor:
+                    cursor.execute(query, params or ())
+                    if cursor.description is not None:
+                        return cursor.fetchall()
+                    return cursor.rowcount
+
+        replica = self.read_pool(query, primary)
+        if replica is not None:
+            return self._on_replica(replica, run)
+        result = run(None)
+        if not is_replica_safe(query):
+            self.mark_write()
+        return result
+
+    def stream_query(
+        self, query, params=None, itersize=1000, primary=False, row_factory=None
+    ):
+        """Yield rows from a server-side cursor, ``itersize`` rows per round trip"""
+        replica = self.read_pool(query, primary)
+        try:
+            with self._transaction(replica[1] if replica else self.pool) as conn:
+                name = f"stream_{uuid.uuid4().hex}"
+                with self._cursor(conn, row_factory, name) as cursor:
+                    cursor.itersize = itersize
+                    cursor.execute(query, params or ())
+                    yield from cursor
+        except psycopg2.OperationalError as e:
+            # Rows may already be consumed, so only route the next stream elsewhere
+            if replica and not isinstance(
+                e, psycopg2.extensions.TransactionRollbackError
+            ):
+                self.replicas.mark_down(replica[0])
+            raise
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Database schema management")
+    parser.add_argument(
+        "command",
+        choices=("init-db",),
+        help="create or upgrade the schema; a no-op when it is current",
+    )
+    parser.parse_args(argv)
+
+    Database.bootstrap()
+    print(f"Database schema is at version {Database.latest_schema_version()}")
+    return 0
+
 
-    def execute_query(self, query, params=None):
-        with self.conn.cursor(cursor_factory=RealDictCursor) as cursor:
-            cursor.execute(query, params or ())
-            if query.strip().upper().startswith("SELECT"):
-                return cursor.fetchall()
-            self.conn.commit()
-            return cursor.rowcount
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,113 @@
+import asyncio
+
+from decouple import config
+
+from async_database import AsyncDatabase
+from transaction_manager import (
+    BATCH_DEPOSIT_QUERY,
+    DEPOSIT_QUERY,
+    deposit_description,
+    to_amount,
+)
+
+
+class DepositBatcher:
+    """Group commit for deposits made by the sessions of the async server.
+
+    Deposits wait up to ``max_wait`` seconds, or until ``max_size`` of them
+    are queued, and are then written by one BATCH_DEPOSIT_QUERY in one
+    transaction, so a burst of top-ups pays for one commit rather than one
+    each. deposit() returns the caller's own new balance once the batch
+    holding it has committed. Only one batch is in flight at a time; deposits
+    arriving meanwhile go into the next one.
+    """
+
+    def __init__(self, enabled=True, max_size=100, max_wait=0.002, db=None):
+        self.enabled = enabled
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._db = db
+        self._pending = []
+        self._flusher = None
+        self._full = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = AsyncDatabase()
+        return self._db
+
+    async def deposit(self, user_id, amount, description=None):
+        """Credit ``amount`` and append its ledger entry; returns the new balance"""
+        amount = to_amount(amount)
+        description = deposit_description(amount, description)
+        if not self.enabled:
+            row = await self.db.execute_query(
+                DEPOSIT_QUERY,
+                {"user_id": user_id, "amount": amount, "description": description},
+            )
+            if not row:
+                raise ValueError(f"Unknown user {user_id}")
+            return row[0]["balance"]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((user_id, amount, description, future))
+        full = self._full
+        if len(self._pending) >= self.max_size and full and not full.done():
+            full.set_result(None)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = loop.create_task(self._run())
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            if len(self._pending) < self.max_size:
+                self._full = loop.create_future()
+                await asyncio.wait([self._full], timeout=self.max_wait)
+            batch, self._pending = (
+                self._pending[: self.max_size],
+                self._pending[self.max_size :],
+            )
+            # Callers that gave up before the flush are not deposited
+            batch = [item for item in batch if not item[3].done()]
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch):
+        params = {
+            "user_ids": [user_id for user_id, _, _, _ in batch],
+            "amounts": [amount for _, amount, _, _ in batch],
+            "descriptions": [description for _, _, description, _ in batch],
+        }
+        try:
+            # One commit for the whole batch; a deadlock with a purchase
+            # retries the batch rather than failing every caller in it
+            rows = await self.db.run_transaction(
+                lambda conn: conn.execute(BATCH_DEPOSIT_QUERY, params)
+            )
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except BaseException:
+            for *_, future in batch:
+                future.cancel()
+            raise
+
+        for row, (user_id, _, _, future) in zip(rows, batch):
+            if future.done():
+                continue
+            if row["balance"] is None:
+                future.set_exception(ValueError(f"Unknown user {user_id}"))
+            else:
+                future.set_result(row["balance"])
+
+
+deposit_batcher = DepositBatcher(
+    enabled=config("DEPOSIT_BATCHING", default=True, cast=bool),
+    max_size=config("DEPOSIT_BATCH_SIZE", default=100, cast=int),
+    max_wait=config("DEPOSIT_BATCH_WAIT_MS", default=2.0, cast=float) / 1000,
+)
@@ -10,7 +10,48 @@ class TripNotAvailableError(Exception):
     pass
 
 
+class CancellationError(Exception):
+    """Raised when a ticket cannot be cancelled"""
+
+    pass
+
+
 class AuthenticationError(Exception):
     """Raised when authentication fails"""
 
     pass
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled database connection frees up in time"""
+
+    pass
+
+
+class TransactionConflictError(Exception):
+    """Raised when a transaction still conflicts with concurrent ones after
+    every retry"""
+
+    pass
+
+
+class IdempotencyKeyError(Exception):
+    """Raised when an idempotency key is reused for a different operation"""
+
+    pass
+
+
+class SchemaVersionError(Exception):
+    """Raised when the database schema is missing or older than the code"""
+
+    pass
+
+
+class ImportValidationError(Exception):
+    """Raised when an imported file contains invalid rows"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(
+            "; ".join(f"line {line_no}: {error}" for line_no, error in errors)
+        )
@@ -0,0 +1,105 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+from functools import partial
+
+from psycopg2.extras import Json
+
+from exceptions import IdempotencyKeyError
+
+# Claims the key for the current transaction. A concurrent request with the
+# same key waits on the primary key until this one commits (and then finds the
+# stored response) or rolls back (and then claims the key itself).
+CLAIM_KEY_QUERY = """
+    INSERT INTO idempotency_keys (user_id, key, operation)
+    VALUES (%(user_id)s, %(key)s, %(operation)s)
+    ON CONFLICT (user_id, key) DO NOTHING
+"""
+
+STORED_RESPONSE_QUERY = """
+    SELECT operation, response FROM idempotency_keys
+    WHERE user_id = %(user_id)s AND key = %(key)s
+"""
+
+SAVE_RESPONSE_QUERY = """
+    UPDATE idempotency_keys SET response = %(response)s
+    WHERE user_id = %(user_id)s AND key = %(key)s
+"""
+
+PRUNE_KEYS_QUERY = """
+    DELETE FROM idempotency_keys
+    WHERE created_at < CURRENT_TIMESTAMP - %s * interval '1 hour'
+"""
+
+MAX_KEY_LENGTH = 64
+
+
+def key_params(user_id, key, operation):
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"Idempotency key must be 1 to {MAX_KEY_LENGTH} characters")
+    return {"user_id": user_id, "key": key, "operation": operation}
+
+
+def stored_response(row, operation):
+    if row["operation"] != operation:
+        raise IdempotencyKeyError(
+            f"Idempotency key was already used for a {row['operation']}"
+        )
+    return row["response"]
+
+
+def claim(cursor, user_id, key, operation):
+    """Claim ``key`` inside the caller's transaction.
+
+    Returns None when the request is new and should be applied, or the
+    response saved by the earlier request that used the same key.
+    """
+    params = key_params(user_id, key, operation)
+    cursor.execute(CLAIM_KEY_QUERY, params)
+    if cursor.rowcount:
+        return None
+    cursor.execute(STORED_RESPONSE_QUERY, params)
+    return stored_response(cursor.fetchone(), operation)
+
+
+def save(cursor, user_id, key, response):
+    """Store the response of a claimed key; it commits with the work itself"""
+    cursor.execute(SAVE_RESPONSE_QUERY, save_params(user_id, key, response))
+
+
+async def aclaim(conn, user_id, key, operation):
+    params = key_params(user_id, key, operation)
+    if await conn.execute(CLAIM_KEY_QUERY, params):
+        return None
+    row = await conn.fetchone(STORED_RESPONSE_QUERY, params)
+    return stored_response(row, operation)
+
+
+async def asave(conn, user_id, key, response):
+    await conn.execute(SAVE_RESPONSE_QUERY, save_params(user_id, key, response))
+
+
+def save_params(user_id, key, response):
+    # Decimals and timestamps are stored as strings; see decode_ticket
+    return {
+        "user_id": user_id,
+        "key": key,
+        "response": Json(response, dumps=partial(json.dumps, default=str)),
+    }
+
+
+def decode_ticket(row):
+    """A ticket row (with ``balance``, if present) as it was before storing"""
+    row = dict(row)
+    row["purchase_time"] = datetime.fromisoformat(row["purchase_time"])
+    if "balance" in row:
+        row["balance"] = Decimal(row["balance"])
+    return row
+
+
+def decode_group(response):
+    """(tickets, balance) of a stored group purchase"""
+    return (
+        [decode_ticket(ticket) for ticket in response["tickets"]],
+        Decimal(response["balance"]),
+    )
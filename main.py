@@ -0,0 +1,348 @@
+"""Async terminal server: serves many kiosk sessions from one process.
+
+Each connection gets the passenger menu of cli.TerminalCLI over a plain text
+protocol (try ``nc localhost 8765``). Business rules come from models,
+ticket_manager and transaction_manager; only the I/O is asynchronous.
+"""
+
+import asyncio
+import uuid
+from datetime import datetime
+
+from decouple import config
+
+import idempotency
+from async_database import AsyncDatabase
+from auth import sessions
+from database import Database
+from deposit_batcher import deposit_batcher
+from exceptions import (
+    InsufficientBalanceError,
+    TransactionConflictError,
+    TripNotAvailableError,
+)
+from models import (
+    AVAILABLE_TRIPS_QUERY,
+    LOGIN_QUERY,
+    PAGE_SIZE,
+    REGISTER_QUERY,
+    REHASH_PASSWORD_QUERY,
+    USER_TICKETS_PAGE_QUERY,
+    Ticket,
+    Trip,
+    User,
+    keyset_page,
+    user_tickets_seek,
+)
+from ticket_manager import GROUP_PURCHASE_QUERY, PURCHASE_QUERY, TicketManager
+from transaction_manager import to_amount
+from trip_cache import trip_cache
+from trip_scheduler import TripStatusScheduler
+
+
+class SessionClosed(Exception):
+    pass
+
+
+class TerminalSession:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.db = AsyncDatabase()
+        self.current_user = None
+        self.session_token = None
+        self.is_running = True
+
+    async def send(self, text=""):
+        self.writer.write(f"{text}\n".encode())
+        await self.writer.drain()
+
+    async def prompt(self, text):
+        self.writer.write(text.encode())
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise SessionClosed()
+        return line.decode(errors="replace").strip()
+
+    async def pause(self):
+        await self.prompt("Press Enter to continue...")
+
+    async def display_menu(self):
+        await self.send()
+        await self.send("=== Passenger Terminal System ===")
+        if self.session_token:
+            self.current_user = await sessions.aget_user(self.session_token, self.db)
+            if self.current_user is None:
+                self.session_token = None
+                await self.send("Your session has expired, please log in again.")
+        if self.current_user:
+            await self.send(
+                f"Welcome: {self.current_user.username} | "
+                f"Balance: ${self.current_user.balance:.2f}"
+            )
+            await self.send("1. View Available Trips")
+            await self.send("2. Purchase Ticket")
+            await self.send("3. My Tickets")
+            await self.send("4. Increase Balance")
+            await self.send("5. Logout")
+            await self.send("6. Exit")
+        else:
+            await self.send("1. Register")
+            await self.send("2. Login")
+            await self.send("3. View Available Trips")
+            await self.send("4. Exit")
+
+    async def register_user(self):
+        await self.send("=== User Registration ===")
+        username = await self.prompt("Username: ")
+        password = await self.prompt("Password: ")
+        try:
+            # Password hashing is deliberately slow; keep it off the event loop
+            hashed = await asyncio.get_running_loop().run_in_executor(
+                None, User.hash_password, password
+            )
+            await self.db.execute_query(REGISTER_QUERY, (username, hashed))
+            await self.send("Registration successful!")
+        except Exception as e:
+            await self.send(f"Registration failed: {e}")
+
+    async def login_user(self):
+        await self.send("=== User Login ===")
+        username = await self.prompt("Username: ")
+        password = await self.prompt("Password: ")
+        result = await self.db.execute_query(LOGIN_QUERY, (username,))
+        user, rehash = await asyncio.get_running_loop().run_in_executor(
+            None, User.authenticate, result[0] if result else None, password
+        )
+        if rehash and await self.db.execute_query(REHASH_PASSWORD_QUERY, rehash):
+            user.version += 1
+        # Admin tools stay on the local CLI
+        if user and not user.is_admin:
+            self.current_user = user
+            self.session_token = sessions.open(user)
+            await self.send("Login successful!")
+        else:
+            await self.send("Invalid credentials!")
+
+    async def available_trips(self):
+        trips = await trip_cache.aget(self.load_available_trips)
+        now = datetime.now()
+        return [trip for trip in trips if trip.start_time > now]
+
+    async def load_available_trips(self):
+        # The cache holds Trip objects, as it does for the threaded CLI
+        rows = await self.db.execute_query(AVAILABLE_TRIPS_QUERY)
+        return [Trip(**trip) for trip in rows]
+
+    async def view_available_trips(self):
+        await self.send("=== Available Trips ===")
+        trips = await self.available_trips()
+        if not trips:
+            await self.send("No available trips found.")
+        for trip in trips:
+            await self.send(
+                f"ID: {trip.id} | Cost: ${trip.cost:.2f} | "
+                f"Start: {trip.start_time} | End: {trip.end_time} | "
+                f"Seats: {trip.available_seats}/{trip.capacity}"
+            )
+
+    async def purchase_ticket(self):
+        await self.send("=== Purchase Ticket ===")
+        try:
+            trip_id = int(await self.prompt("Enter Trip ID to purchase: "))
+            quantity = int(await self.prompt("Number of tickets [1]: ") or 1)
+            user_id = self.current_user.id
+            # One key per purchase, so a retry after a lost connection
+            # cannot buy twice
+            key = uuid.uuid4().hex
+
+            async def buy_one(conn):
+                stored = await idempotency.aclaim(conn, user_id, key, "purchase")
+                if stored is not None:
+                    return idempotency.decode_ticket(stored)
+                row = await conn.fetchone(
+                    PURCHASE_QUERY,
+                    {"user_id": user_id, "trip_id": trip_id, "seat": None},
+                )
+                ticket = TicketManager.purchase_result(row)
+                await idempotency.asave(conn, user_id, key, ticket)
+                return ticket
+
+            async def buy_group(conn):
+                stored = await idempotency.aclaim(conn, user_id, key, "purchase_group")
+                if stored is not None:
+                    return idempotency.decode_group(stored)
+                quantities = {trip_id: quantity}
+                rows = await conn.execute(
+                    GROUP_PURCHASE_QUERY,
+                    TicketManager.group_purchase_params(user_id, quantities),
+                )
+                tickets, balance = TicketManager.group_purchase_result(
+                    rows, quantities
+                )
+                await idempotency.asave(
+                    conn, user_id, key, {"tickets": tickets, "balance": balance}
+                )
+                return tickets, balance
+
+            if quantity == 1:
+                ticket = await self.db.run_transaction(buy_one, idempotent=True)
+                balance = ticket.pop("balance")
+                tickets = [ticket]
+            else:
+                tickets, balance = await self.db.run_transaction(
+                    buy_group, idempotent=True
+                )
+            trip_cache.invalidate()
+            self.current_user.balance = balance
+            tickets = [Ticket(**ticket) for ticket in tickets]
+            seats = ", ".join(str(ticket.seat_number) for ticket in tickets)
+            await self.send(
+                f"{len(tickets)} ticket(s) purchased successfully! Seats: {seats}"
+            )
+        except (
+            InsufficientBalanceError,
+            TripNotAvailableError,
+            TransactionConflictError,
+        ) as e:
+            await self.send(f"Purchase failed: {e}")
+        except ValueError:
+            await self.send("Invalid trip ID or quantity!")
+
+    async def view_my_tickets(self):
+        page_starts = [None]
+        while True:
+            seek, seek_params = user_tickets_seek(page_starts[-1])
+            result = await self.db.execute_query(
+                USER_TICKETS_PAGE_QUERY.format(seek=seek),
+                (self.current_user.id, *seek_params, PAGE_SIZE + 1),
+            )
+            tickets, next_start = keyset_page(
+                [Ticket(**row) for row in result], PAGE_SIZE, "purchase_time", "id"
+            )
+
+            await self.send(f"=== My Tickets === (Page {len(page_starts)})")
+            if not tickets:
+                await self.send("No tickets found.")
+            for ticket in tickets:
+                await self.send(
+                    f"Ticket ID: {ticket.id} | Trip: {ticket.trip_id} | "
+                    f"Seat: {ticket.seat_number} | Cost: ${ticket.cost:.2f} | "
+                    f"Purchase Time: {ticket.purchase_time} | "
+                    f"Status: {ticket.status}"
+                )
+
+            choice = await self.prompt(
+                "n: Next page | p: Previous page | q: Back: "
+            )
+            if choice == "n" and next_start:
+                page_starts.append(next_start)
+            elif choice == "p" and len(page_starts) > 1:
+                page_starts.pop()
+            elif choice == "q":
+                return
+
+    async def increase_balance(self):
+        await self.send("=== Increase Balance ===")
+        try:
+            amount = to_amount(await self.prompt("Enter amount to deposit: "))
+        except ValueError as e:
+            await self.send(f"Invalid amount! {e}")
+            return
+        # Committed together with other sessions' deposits (DEPOSIT_BATCHING)
+        self.current_user.balance = await deposit_batcher.deposit(
+            self.current_user.id, amount
+        )
+        await self.send(
+            f"Balance increased by ${amount:.2f}. "
+            f"New balance: ${self.current_user.balance:.2f}"
+        )
+
+    async def run(self):
+        while self.is_running:
+            await self.display_menu()
+            choice = await self.prompt("Enter your choice: ")
+
+            if not self.current_user:
+                actions = {
+                    "1": self.register_user,
+                    "2": self.login_user,
+                    "3": self.view_available_trips,
+                }
+                if choice == "4":
+                    break
+            else:
+                actions = {
+                    "1": self.view_available_trips,
+                    "2": self.purchase_ticket,
+                    "3": self.view_my_tickets,
+                    "4": self.increase_balance,
+                }
+                if choice == "5":
+                    sessions.logout(self.session_token)
+                    self.session_token = None
+                    self.current_user = None
+                    await self.send("Logged out successfully!")
+                    continue
+                if choice == "6":
+                    break
+
+            action = actions.get(choice)
+            if action is None:
+                await self.send("Invalid choice!")
+                continue
+            try:
+                await action()
+            except SessionClosed:
+                raise
+            except Exception as e:
+                await self.send(f"An error occurred: {e}")
+            if action != self.view_my_tickets:
+                await self.pause()
+
+        await self.send("Thank you for using Passenger Terminal System!")
+
+
+async def handle_session(reader, writer):
+    session = TerminalSession(reader, writer)
+    try:
+        await session.run()
+    except (SessionClosed, ConnectionError):
+        pass
+    finally:
+        sessions.logout(session.session_token)
+        writer.close()
+
+
+async def serve():
+    socket_path = config("SERVER_SOCKET", default="")
+    if socket_path:
+        server = await asyncio.start_unix_server(handle_session, path=socket_path)
+    else:
+        server = await asyncio.start_server(
+            handle_session,
+            host=config("SERVER_HOST", default="127.0.0.1"),
+            port=config("SERVER_PORT", default=8765, cast=int),
+        )
+
+    addresses = ", ".join(str(sock.getsockname()) for sock in server.sockets)
+    print(f"Passenger Terminal server listening on {addresses}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await AsyncDatabase.close_pool()
+
+
+def main():
+    Database.verify_schema()
+    TripStatusScheduler().start()
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+-- Trip.get_available_trips: status = 'SCHEDULED' AND start_time > now ORDER BY start_time
+CREATE INDEX IF NOT EXISTS trips_scheduled_start_time_idx
+    ON trips (start_time)
+    WHERE status = 'SCHEDULED';
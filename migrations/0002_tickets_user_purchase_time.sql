@@ -0,0 +1,7 @@
+-- Ticket.get_user_tickets: user_id = ? ORDER BY purchase_time DESC
+CREATE INDEX IF NOT EXISTS tickets_user_id_purchase_time_idx
+    ON tickets (user_id, purchase_time DESC);
+
+-- Foreign key lookups from trips to their tickets
+CREATE INDEX IF NOT EXISTS tickets_trip_id_idx
+    ON tickets (trip_id);
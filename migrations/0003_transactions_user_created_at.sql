@@ -0,0 +1,3 @@
+-- Per-user transaction history, newest first
+CREATE INDEX IF NOT EXISTS transactions_user_id_created_at_idx
+    ON transactions (user_id, created_at DESC);
@@ -0,0 +1,12 @@
+-- Lets every terminal process drop its cached trip list when trips change
+CREATE OR REPLACE FUNCTION notify_trips_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('trips_changed', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trips_changed_notify ON trips;
+CREATE TRIGGER trips_changed_notify
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON trips
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_trips_changed();
@@ -0,0 +1,4 @@
+-- TripStatusScheduler: trips still to be completed, by end_time
+CREATE INDEX IF NOT EXISTS trips_active_end_time_idx
+    ON trips (end_time)
+    WHERE status IN ('SCHEDULED', 'IN_PROGRESS');
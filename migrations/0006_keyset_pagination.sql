@@ -0,0 +1,11 @@
+-- Keyset pagination sorts on (sort column, id); the id tie-breaker must be in
+-- the index for row-value seeks like (purchase_time, id) < (%s, %s)
+CREATE INDEX IF NOT EXISTS tickets_user_id_purchase_time_id_idx
+    ON tickets (user_id, purchase_time, id);
+DROP INDEX IF EXISTS tickets_user_id_purchase_time_idx;
+
+CREATE INDEX IF NOT EXISTS trips_start_time_id_idx
+    ON trips (start_time, id);
+
+CREATE INDEX IF NOT EXISTS users_created_at_id_idx
+    ON users (created_at, id);
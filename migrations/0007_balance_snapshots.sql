@@ -0,0 +1,11 @@
+-- Per-user balance as of a ledger position; current balance is the snapshot
+-- plus the (short) tail of transactions after last_transaction_id
+CREATE TABLE IF NOT EXISTS balance_snapshots (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    balance DECIMAL(12,2) NOT NULL,
+    last_transaction_id INTEGER NOT NULL,
+    taken_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS transactions_user_id_id_idx
+    ON transactions (user_id, id);
@@ -0,0 +1,15 @@
+-- Bumped on every change to a user row so cached sessions can detect stale
+-- state with a single-column lookup
+ALTER TABLE users ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+
+CREATE OR REPLACE FUNCTION bump_user_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_bump_version ON users;
+CREATE TRIGGER users_bump_version
+    BEFORE UPDATE ON users
+    FOR EACH ROW EXECUTE FUNCTION bump_user_version();
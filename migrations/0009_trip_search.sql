@@ -0,0 +1,7 @@
+-- Trip.search outside the cached scheduled set: departure windows per status
+-- and cheapest-first listings
+CREATE INDEX IF NOT EXISTS trips_status_start_time_idx
+    ON trips (status, start_time, id);
+
+CREATE INDEX IF NOT EXISTS trips_status_cost_idx
+    ON trips (status, cost, start_time, id);
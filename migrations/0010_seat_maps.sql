@@ -0,0 +1,107 @@
+-- Per-trip seat inventory: bit n-1 of trips.seat_map is set when seat n is sold
+ALTER TABLE trips ADD COLUMN IF NOT EXISTS seat_map VARBIT;
+ALTER TABLE tickets ADD COLUMN IF NOT EXISTS seat_number INTEGER;
+
+-- New trips start with every seat free; a capacity change resizes the map
+CREATE OR REPLACE FUNCTION fit_seat_map() RETURNS trigger AS $$
+BEGIN
+    NEW.seat_map := rpad(coalesce(NEW.seat_map::text, ''), NEW.capacity, '0')::varbit;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trips_fit_seat_map ON trips;
+CREATE TRIGGER trips_fit_seat_map
+    BEFORE INSERT OR UPDATE OF capacity, seat_map ON trips
+    FOR EACH ROW EXECUTE FUNCTION fit_seat_map();
+
+-- Existing tickets get seats 1..n per trip in purchase order
+UPDATE tickets t
+SET seat_number = numbered.seat_number
+FROM (
+    SELECT id, row_number() OVER (
+        PARTITION BY trip_id ORDER BY purchase_time, id
+    ) AS seat_number
+    FROM tickets
+) numbered
+WHERE t.id = numbered.id AND t.seat_number IS NULL;
+
+UPDATE trips t
+SET seat_map = (repeat('1', sold.seats) || repeat('0', t.capacity - sold.seats))::varbit
+FROM (
+    SELECT tr.id, least(count(k.id), tr.capacity)::int AS seats
+    FROM trips tr
+    LEFT JOIN tickets k ON k.trip_id = tr.id
+    GROUP BY tr.id
+) sold
+WHERE t.id = sold.id AND t.seat_map IS NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS tickets_trip_seat_idx
+    ON tickets (trip_id, seat_number)
+    WHERE status = 'PURCHASED';
+
+-- True when ``seat`` exists on the map and is free
+CREATE OR REPLACE FUNCTION seat_free(map VARBIT, seat INTEGER) RETURNS BOOLEAN AS $$
+    SELECT CASE
+        WHEN seat BETWEEN 1 AND length(map) THEN get_bit(map, seat - 1) = 0
+        ELSE FALSE
+    END;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Best available block of ``wanted`` seats: the smallest run of free seats
+-- that fits them all, so large gaps stay open for larger groups; if no run is
+-- long enough, the lowest free seats. NULL when fewer seats are free.
+CREATE OR REPLACE FUNCTION seat_block(map VARBIT, wanted INTEGER) RETURNS INTEGER[] AS $$
+DECLARE
+    best_start INTEGER := 0;
+    best_length INTEGER := 0;
+    run_start INTEGER := 0;
+    seat INTEGER;
+    seats INTEGER[];
+BEGIN
+    IF wanted < 1 THEN
+        RETURN NULL;
+    END IF;
+    -- One past the last seat closes a trailing run of free seats
+    FOR seat IN 1..length(map) + 1 LOOP
+        IF seat <= length(map) AND get_bit(map, seat - 1) = 0 THEN
+            IF run_start = 0 THEN
+                run_start := seat;
+            END IF;
+        ELSIF run_start > 0 THEN
+            IF seat - run_start >= wanted
+               AND (best_start = 0 OR seat - run_start < best_length) THEN
+                best_start := run_start;
+                best_length := seat - run_start;
+            END IF;
+            run_start := 0;
+        END IF;
+    END LOOP;
+
+    IF best_start > 0 THEN
+        RETURN ARRAY(SELECT generate_series(best_start, best_start + wanted - 1));
+    END IF;
+    seats := ARRAY(
+        SELECT s FROM generate_series(1, length(map)) s
+        WHERE get_bit(map, s - 1) = 0
+        ORDER BY s
+        LIMIT wanted
+    );
+    IF cardinality(seats) < wanted THEN
+        RETURN NULL;
+    END IF;
+    RETURN seats;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION set_seats(map VARBIT, seats INTEGER[], taken INTEGER)
+RETURNS VARBIT AS $$
+DECLARE
+    seat INTEGER;
+BEGIN
+    FOREACH seat IN ARRAY seats LOOP
+        map := set_bit(map, seat - 1, taken);
+    END LOOP;
+    RETURN map;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
@@ -0,0 +1,11 @@
+-- Passengers waiting for a seat on a sold-out trip, served in enqueue order
+CREATE TABLE IF NOT EXISTS waitlist (
+    id BIGSERIAL PRIMARY KEY,
+    trip_id INTEGER NOT NULL REFERENCES trips(id),
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    enqueued_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (trip_id, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS waitlist_trip_queue_idx
+    ON waitlist (trip_id, enqueued_at, id);
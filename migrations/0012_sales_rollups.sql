@@ -0,0 +1,144 @@
+-- Sales rollups for the admin dashboard, maintained by triggers on tickets so
+-- dashboard reads never scan tickets or transactions.
+--
+-- Every purchase touches today's sales_daily row, so each day is split into
+-- 16 slots picked by backend pid; concurrent terminals then rarely wait on the
+-- same row and readers sum the slots.
+CREATE TABLE IF NOT EXISTS sales_daily (
+    day DATE NOT NULL,
+    slot SMALLINT NOT NULL,
+    tickets_sold INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+    tickets_cancelled INTEGER NOT NULL DEFAULT 0,
+    refunds DECIMAL(12,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, slot)
+);
+
+-- Net of cancellations; purchases already lock the trip row, so one row per
+-- trip adds no contention
+CREATE TABLE IF NOT EXISTS trip_sales (
+    trip_id INTEGER PRIMARY KEY REFERENCES trips(id),
+    tickets_sold INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(12,2) NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS trip_sales_revenue_idx ON trip_sales (revenue DESC);
+
+CREATE TABLE IF NOT EXISTS customer_sales (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    tickets INTEGER NOT NULL DEFAULT 0,
+    spent DECIMAL(12,2) NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS customer_sales_spent_idx ON customer_sales (spent DESC);
+
+-- Applies (day, trip, user, tickets, amount) deltas; cancellations pass
+-- negative tickets and amounts
+CREATE OR REPLACE FUNCTION apply_sales_deltas(deltas JSONB) RETURNS void AS $$
+BEGIN
+    INSERT INTO sales_daily AS s (day, slot, tickets_sold, revenue, tickets_cancelled, refunds)
+    SELECT (d->>'day')::date, pg_backend_pid() % 16,
+           sum(greatest((d->>'tickets')::int, 0)),
+           sum(greatest((d->>'amount')::numeric, 0)),
+           sum(greatest(-(d->>'tickets')::int, 0)),
+           sum(greatest(-(d->>'amount')::numeric, 0))
+    FROM jsonb_array_elements(deltas) d
+    GROUP BY 1
+    ON CONFLICT (day, slot) DO UPDATE
+    SET tickets_sold = s.tickets_sold + EXCLUDED.tickets_sold,
+        revenue = s.revenue + EXCLUDED.revenue,
+        tickets_cancelled = s.tickets_cancelled + EXCLUDED.tickets_cancelled,
+        refunds = s.refunds + EXCLUDED.refunds;
+
+    INSERT INTO trip_sales AS s (trip_id, tickets_sold, revenue)
+    SELECT (d->>'trip_id')::int, sum((d->>'tickets')::int), sum((d->>'amount')::numeric)
+    FROM jsonb_array_elements(deltas) d
+    GROUP BY 1
+    ORDER BY 1
+    ON CONFLICT (trip_id) DO UPDATE
+    SET tickets_sold = s.tickets_sold + EXCLUDED.tickets_sold,
+        revenue = s.revenue + EXCLUDED.revenue;
+
+    INSERT INTO customer_sales AS s (user_id, tickets, spent)
+    SELECT (d->>'user_id')::int, sum((d->>'tickets')::int), sum((d->>'amount')::numeric)
+    FROM jsonb_array_elements(deltas) d
+    WHERE d->>'user_id' IS NOT NULL
+    GROUP BY 1
+    ORDER BY 1
+    ON CONFLICT (user_id) DO UPDATE
+    SET tickets = s.tickets + EXCLUDED.tickets,
+        spent = s.spent + EXCLUDED.spent;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level with transition tables, so a group purchase is folded in
+-- with one upsert per rollup instead of one per ticket
+CREATE OR REPLACE FUNCTION rollup_ticket_inserts() RETURNS trigger AS $$
+BEGIN
+    PERFORM apply_sales_deltas(coalesce(jsonb_agg(jsonb_build_object(
+        'day', n.purchase_time::date,
+        'trip_id', n.trip_id,
+        'user_id', n.user_id,
+        'tickets', 1,
+        'amount', tr.cost
+    )), '[]'))
+    FROM new_tickets n
+    JOIN trips tr ON tr.id = n.trip_id
+    WHERE n.status = 'PURCHASED';
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_ticket_cancellations() RETURNS trigger AS $$
+BEGIN
+    PERFORM apply_sales_deltas(coalesce(jsonb_agg(jsonb_build_object(
+        'day', CURRENT_DATE,
+        'trip_id', n.trip_id,
+        'user_id', n.user_id,
+        'tickets', -1,
+        'amount', -tr.cost
+    )), '[]'))
+    FROM new_tickets n
+    JOIN old_tickets o ON o.id = n.id
+    JOIN trips tr ON tr.id = n.trip_id
+    WHERE o.status = 'PURCHASED' AND n.status = 'CANCELLED';
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tickets_rollup_insert ON tickets;
+CREATE TRIGGER tickets_rollup_insert
+    AFTER INSERT ON tickets
+    REFERENCING NEW TABLE AS new_tickets
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_ticket_inserts();
+
+DROP TRIGGER IF EXISTS tickets_rollup_cancel ON tickets;
+CREATE TRIGGER tickets_rollup_cancel
+    AFTER UPDATE ON tickets
+    REFERENCING OLD TABLE AS old_tickets NEW TABLE AS new_tickets
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_ticket_cancellations();
+
+-- One-time backfill from existing history. CREATE TRIGGER above blocks ticket
+-- writes until this migration commits, so every ticket is counted once.
+INSERT INTO sales_daily (day, slot, tickets_sold, revenue, tickets_cancelled, refunds)
+SELECT t.purchase_time::date, 0, count(*), sum(tr.cost),
+       count(*) FILTER (WHERE t.status = 'CANCELLED'),
+       coalesce(sum(tr.cost) FILTER (WHERE t.status = 'CANCELLED'), 0)
+FROM tickets t
+JOIN trips tr ON tr.id = t.trip_id
+GROUP BY 1
+ON CONFLICT DO NOTHING;
+
+INSERT INTO trip_sales (trip_id, tickets_sold, revenue)
+SELECT t.trip_id, count(*), sum(tr.cost)
+FROM tickets t
+JOIN trips tr ON tr.id = t.trip_id
+WHERE t.status = 'PURCHASED'
+GROUP BY 1
+ON CONFLICT DO NOTHING;
+
+INSERT INTO customer_sales (user_id, tickets, spent)
+SELECT t.user_id, count(*), sum(tr.cost)
+FROM tickets t
+JOIN trips tr ON tr.id = t.trip_id
+WHERE t.status = 'PURCHASED' AND t.user_id IS NOT NULL
+GROUP BY 1
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,143 @@
+-- tickets and transactions become monthly range partitions on purchase_time
+-- and created_at, so each month's heap and indexes stay small and old months
+-- can be detached and archived (see partition_manager.py).
+--
+-- Primary keys must include the partition key, so they become
+-- (id, purchase_time) and (id, created_at); ids still come from the original
+-- sequences. For the same reason the unique (trip_id, seat_number) index from
+-- 0010 cannot be kept: seat uniqueness rests on trips.seat_map, which every
+-- purchase updates under the trip row lock.
+
+-- Partition of ``parent`` holding the month starting at ``month``, e.g.
+-- tickets_y2026m10
+CREATE OR REPLACE FUNCTION monthly_partition_name(parent TEXT, month DATE)
+RETURNS TEXT AS $$
+    SELECT parent || '_' || to_char(month, '"y"YYYY"m"MM');
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Creates any missing monthly partitions of ``parent`` from first_month through
+-- last_month and returns how many were created. Each is built as a standalone
+-- table and then attached. The attach takes a SHARE UPDATE EXCLUSIVE lock on
+-- the parent, but cloning the foreign keys also locks users and trips until
+-- commit, which blocks purchases and deposits meanwhile; PartitionManager
+-- therefore attaches one month per transaction under a short lock_timeout.
+CREATE OR REPLACE FUNCTION ensure_monthly_partitions(
+    parent TEXT, first_month DATE, last_month DATE
+) RETURNS INTEGER AS $$
+DECLARE
+    month DATE := date_trunc('month', first_month);
+    partition TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month <= last_month LOOP
+        partition := monthly_partition_name(parent, month);
+        IF to_regclass(partition) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                partition, parent
+            );
+            EXECUTE format(
+                'ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                parent, partition, month, month + interval '1 month'
+            );
+            created := created + 1;
+        END IF;
+        month := month + interval '1 month';
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE tickets RENAME TO tickets_unpartitioned;
+ALTER TABLE transactions RENAME TO transactions_unpartitioned;
+ALTER SEQUENCE tickets_id_seq OWNED BY NONE;
+ALTER SEQUENCE transactions_id_seq OWNED BY NONE;
+-- Free the index names for the new tables; the copy below is a full scan
+ALTER TABLE tickets_unpartitioned
+    RENAME CONSTRAINT tickets_pkey TO tickets_unpartitioned_pkey;
+ALTER TABLE transactions_unpartitioned
+    RENAME CONSTRAINT transactions_pkey TO transactions_unpartitioned_pkey;
+DROP INDEX IF EXISTS
+    tickets_user_id_purchase_time_id_idx,
+    tickets_trip_id_idx,
+    tickets_trip_seat_idx,
+    transactions_user_id_created_at_idx,
+    transactions_user_id_id_idx;
+
+CREATE TABLE tickets (
+    id INTEGER NOT NULL DEFAULT nextval('tickets_id_seq'),
+    user_id INTEGER REFERENCES users(id),
+    trip_id INTEGER REFERENCES trips(id),
+    purchase_time TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    status VARCHAR(20) DEFAULT 'PURCHASED',
+    seat_number INTEGER,
+    PRIMARY KEY (id, purchase_time)
+) PARTITION BY RANGE (purchase_time);
+ALTER SEQUENCE tickets_id_seq OWNED BY tickets.id;
+
+CREATE TABLE transactions (
+    id INTEGER NOT NULL DEFAULT nextval('transactions_id_seq'),
+    user_id INTEGER REFERENCES users(id),
+    amount DECIMAL(10,2) NOT NULL,
+    type VARCHAR(20) NOT NULL,
+    description TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id;
+
+-- Same secondary indexes as before, now one per partition
+CREATE INDEX tickets_user_id_purchase_time_id_idx
+    ON tickets (user_id, purchase_time, id);
+CREATE INDEX tickets_trip_id_idx ON tickets (trip_id);
+CREATE INDEX transactions_user_id_created_at_idx
+    ON transactions (user_id, created_at DESC);
+CREATE INDEX transactions_user_id_id_idx ON transactions (user_id, id);
+
+-- Every month with history, plus the next three
+SELECT ensure_monthly_partitions(
+    'tickets',
+    coalesce((SELECT min(purchase_time) FROM tickets_unpartitioned), CURRENT_DATE)::date,
+    (CURRENT_DATE + interval '3 months')::date
+);
+SELECT ensure_monthly_partitions(
+    'transactions',
+    coalesce((SELECT min(created_at) FROM transactions_unpartitioned), CURRENT_DATE)::date,
+    (CURRENT_DATE + interval '3 months')::date
+);
+
+INSERT INTO tickets (id, user_id, trip_id, purchase_time, status, seat_number)
+SELECT id, user_id, trip_id, coalesce(purchase_time, CURRENT_TIMESTAMP), status,
+       seat_number
+FROM tickets_unpartitioned;
+
+INSERT INTO transactions (id, user_id, amount, type, description, created_at)
+SELECT id, user_id, amount, type, description, coalesce(created_at, CURRENT_TIMESTAMP)
+FROM transactions_unpartitioned;
+
+DROP TABLE tickets_unpartitioned;
+DROP TABLE transactions_unpartitioned;
+
+-- The 0012 rollup triggers went with the old table; they are recreated only
+-- now so the copy above is not counted twice
+CREATE TRIGGER tickets_rollup_insert
+    AFTER INSERT ON tickets
+    REFERENCING NEW TABLE AS new_tickets
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_ticket_inserts();
+
+CREATE TRIGGER tickets_rollup_cancel
+    AFTER UPDATE ON tickets
+    REFERENCING OLD TABLE AS old_tickets NEW TABLE AS new_tickets
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_ticket_cancellations();
+
+-- Per-user ledger totals of archived transaction partitions, so balances can
+-- still be reconciled against the full history
+CREATE TABLE IF NOT EXISTS archived_ledger (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    amount DECIMAL(12,2) NOT NULL DEFAULT 0,
+    transactions INTEGER NOT NULL DEFAULT 0
+);
+
+-- The copied tables start without planner statistics
+ANALYZE tickets;
+ANALYZE transactions;
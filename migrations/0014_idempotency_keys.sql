@@ -0,0 +1,16 @@
+-- Client-supplied keys of purchases and deposits that have been applied, with
+-- the response they produced, so a retried or double-submitted request is
+-- answered from here instead of being applied twice (see idempotency.py).
+-- Keys are scoped to the user; rows older than IDEMPOTENCY_KEY_TTL_HOURS are
+-- pruned by the trip scheduler.
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    key VARCHAR(64) NOT NULL,
+    operation VARCHAR(20) NOT NULL,
+    response JSONB,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, key)
+);
+
+CREATE INDEX IF NOT EXISTS idempotency_keys_created_at_idx
+    ON idempotency_keys (created_at);
@@ -0,0 +1,114 @@
+-- Per-passenger monthly statements for user_dashboard.py, maintained by
+-- statement-level triggers on tickets and transactions, so a dashboard reads
+-- one row per month however many tickets the passenger has.
+--
+-- trips counts the tickets bought in the month that were not cancelled later;
+-- spent, deposits and refunds are the month's ledger totals by type.
+CREATE TABLE IF NOT EXISTS user_monthly (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    month DATE NOT NULL,
+    trips INTEGER NOT NULL DEFAULT 0,
+    spent DECIMAL(12,2) NOT NULL DEFAULT 0,
+    deposits DECIMAL(12,2) NOT NULL DEFAULT 0,
+    refunds DECIMAL(12,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, month)
+);
+
+-- Only the passenger's own writes touch their rows, and those already queue on
+-- the users row, so there is no slotting as in sales_daily
+CREATE OR REPLACE FUNCTION rollup_user_ledger() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO user_monthly AS m (user_id, month, spent, deposits, refunds)
+    SELECT n.user_id, date_trunc('month', n.created_at)::date,
+           coalesce(-sum(n.amount) FILTER (WHERE n.type = 'PURCHASE'), 0),
+           coalesce(sum(n.amount) FILTER (WHERE n.type = 'DEPOSIT'), 0),
+           coalesce(sum(n.amount) FILTER (WHERE n.type = 'REFUND'), 0)
+    FROM new_transactions n
+    WHERE n.user_id IS NOT NULL
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (user_id, month) DO UPDATE
+    SET spent = m.spent + EXCLUDED.spent,
+        deposits = m.deposits + EXCLUDED.deposits,
+        refunds = m.refunds + EXCLUDED.refunds;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_user_tickets() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO user_monthly AS m (user_id, month, trips)
+    SELECT n.user_id, date_trunc('month', n.purchase_time)::date, count(*)
+    FROM new_tickets n
+    WHERE n.user_id IS NOT NULL AND n.status = 'PURCHASED'
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (user_id, month) DO UPDATE
+    SET trips = m.trips + EXCLUDED.trips;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A cancellation takes the ticket off the month it was bought in
+CREATE OR REPLACE FUNCTION rollup_user_cancellations() RETURNS trigger AS $$
+BEGIN
+    UPDATE user_monthly m
+    SET trips = m.trips - c.tickets
+    FROM (
+        SELECT n.user_id, date_trunc('month', n.purchase_time)::date AS month,
+               count(*) AS tickets
+        FROM new_tickets n
+        JOIN old_tickets o ON o.id = n.id AND o.purchase_time = n.purchase_time
+        WHERE n.user_id IS NOT NULL
+          AND o.status = 'PURCHASED' AND n.status = 'CANCELLED'
+        GROUP BY 1, 2
+    ) c
+    WHERE m.user_id = c.user_id AND m.month = c.month;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS transactions_user_monthly ON transactions;
+CREATE TRIGGER transactions_user_monthly
+    AFTER INSERT ON transactions
+    REFERENCING NEW TABLE AS new_transactions
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_user_ledger();
+
+DROP TRIGGER IF EXISTS tickets_user_monthly_insert ON tickets;
+CREATE TRIGGER tickets_user_monthly_insert
+    AFTER INSERT ON tickets
+    REFERENCING NEW TABLE AS new_tickets
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_user_tickets();
+
+DROP TRIGGER IF EXISTS tickets_user_monthly_cancel ON tickets;
+CREATE TRIGGER tickets_user_monthly_cancel
+    AFTER UPDATE ON tickets
+    REFERENCING OLD TABLE AS old_tickets NEW TABLE AS new_tickets
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_user_cancellations();
+
+-- One-time backfill, counted once for the same reason as in 0012. Months
+-- already archived by partition_manager.py are only in archived_ledger, which
+-- has no per-month detail, so they are not backfilled.
+INSERT INTO user_monthly (user_id, month, spent, deposits, refunds)
+SELECT user_id, date_trunc('month', created_at)::date,
+       coalesce(-sum(amount) FILTER (WHERE type = 'PURCHASE'), 0),
+       coalesce(sum(amount) FILTER (WHERE type = 'DEPOSIT'), 0),
+       coalesce(sum(amount) FILTER (WHERE type = 'REFUND'), 0)
+FROM transactions
+WHERE user_id IS NOT NULL
+GROUP BY 1, 2
+ON CONFLICT DO NOTHING;
+
+INSERT INTO user_monthly AS m (user_id, month, trips)
+SELECT user_id, date_trunc('month', purchase_time)::date, count(*)
+FROM tickets
+WHERE user_id IS NOT NULL AND status = 'PURCHASED'
+GROUP BY 1, 2
+ON CONFLICT (user_id, month) DO UPDATE SET trips = EXCLUDED.trips;
+
+-- UPCOMING_TRIPS_QUERY bounds a passenger's tickets by the creation time of
+-- the oldest trip still to depart, read from this index alone
+CREATE INDEX IF NOT EXISTS trips_scheduled_start_time_created_at_idx
+    ON trips (start_time) INCLUDE (created_at)
+    WHERE status = 'SCHEDULED';
+DROP INDEX IF EXISTS trips_scheduled_start_time_idx;
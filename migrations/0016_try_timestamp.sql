@@ -0,0 +1,10 @@
+-- Casts CSV text to a timestamp for bulk_io.py's import validation, returning
+-- NULL instead of raising for text that looks like a timestamp but is not a
+-- real date or time (e.g. 2027-02-30 10:00)
+CREATE OR REPLACE FUNCTION try_timestamp(value TEXT) RETURNS TIMESTAMP AS $$
+BEGIN
+    RETURN value::timestamp;
+EXCEPTION WHEN datetime_field_overflow OR invalid_datetime_format THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql STABLE;
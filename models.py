@@ -1,28 +1,136 @@
 from datetime import datetime
-from database import Database
-from exceptions import InsufficientBalanceError, TripNotAvailableError
-import hashlib
+from decimal import Decimal
+from database import Database, prepared_statements
+from decouple import config
+import auth
+from ticket_manager import TicketManager
+from transaction_manager import TransactionManager
+from trip_cache import TRIP_SORT_KEYS, trip_cache
+
+PAGE_SIZE = config("PAGE_SIZE", default=20, cast=int)
+
+# Shared with the async terminal server in main.py
+REGISTER_QUERY = (
+    "INSERT INTO users (username, password) VALUES (%s, %s) "
+    "RETURNING id, username, balance, is_admin, version"
+)
+
+LOGIN_QUERY = prepared_statements.register(
+    "login",
+    "SELECT id, username, password, balance, is_admin, version FROM users "
+    "WHERE username = %s",
+)
+
+# Compare-and-set so a concurrent password change is never overwritten
+REHASH_PASSWORD_QUERY = (
+    "UPDATE users SET password = %s WHERE id = %s AND password = %s"
+)
+
+# Column lists in constructor order, for building models with row_factory
+USER_COLUMNS = "id, username, balance, is_admin, version, created_at"
+TRIP_COLUMNS = "id, cost, start_time, end_time, capacity, available_seats, status"
+TICKET_COLUMNS = (
+    "t.id, t.user_id, t.trip_id, t.purchase_time, t.status, t.seat_number, "
+    "tr.start_time, tr.end_time, tr.cost"
+)
+
+TRIP_BY_ID_QUERY = prepared_statements.register(
+    "trip_by_id", f"SELECT {TRIP_COLUMNS} FROM trips WHERE id = %s"
+)
+
+AVAILABLE_TRIPS_QUERY = f"""
+    SELECT {TRIP_COLUMNS}
+    FROM trips
+    WHERE status = 'SCHEDULED' AND start_time > CURRENT_TIMESTAMP
+    ORDER BY start_time
+"""
+
+TRIP_SEARCH_ORDER = {
+    "start_time": "start_time, id",
+    "cost": "cost, start_time, id",
+    "available_seats": "available_seats DESC, start_time, id",
+}
+
+USER_TICKETS_PAGE_QUERY = f"""
+    SELECT {TICKET_COLUMNS}
+    FROM tickets t
+    JOIN trips tr ON t.trip_id = tr.id
+    WHERE t.user_id = %s {{seek}}
+    ORDER BY t.purchase_time DESC, t.id DESC
+    LIMIT %s
+"""
+# tickets is partitioned by month on purchase_time. The row comparison alone
+# does not prune partitions, so each page also bounds purchase_time on its own;
+# the first page stops at the present, skipping the empty future months.
+USER_TICKETS_FIRST_PAGE = "AND t.purchase_time <= LOCALTIMESTAMP"
+USER_TICKETS_SEEK = (
+    "AND t.purchase_time <= %s AND (t.purchase_time, t.id) < (%s, %s)"
+)
+
+
+def user_tickets_seek(after):
+    """USER_TICKETS_PAGE_QUERY seek clause and parameters for the page after
+    ``after``, a (purchase_time, id) key from keyset_page"""
+    if after is None:
+        return USER_TICKETS_FIRST_PAGE, ()
+    return USER_TICKETS_SEEK, (after[0], *after)
+
+
+def keyset_page(rows, limit, *key):
+    """Trim a ``limit + 1`` row result to one page and return the seek key.
+
+    The extra row only tells us whether another page exists; the returned key
+    is the sort key (attribute names) of the last row shown, or None on the
+    final page.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, tuple(getattr(rows[-1], column) for column in key)
 
 
 class User:
-    def __init__(self, id, username, balance=0, is_admin=False):
+    # Models are built per row for every listing; slots keep them small
+    __slots__ = ("id", "username", "balance", "is_admin", "version", "created_at")
+
+    def __init__(
+        self, id, username, balance=0, is_admin=False, version=None, created_at=None
+    ):
         self.id = id
         self.username = username
-        self.balance = float(balance)
+        self.balance = Decimal(balance)
         self.is_admin = is_admin
+        self.version = version
+        self.created_at = created_at
 
     @staticmethod
     def hash_password(password):
-        return hashlib.sha256(password.encode()).hexdigest()
+        return auth.hash_password(password)
+
+    @classmethod
+    def authenticate(cls, row, password):
+        """Verify ``password`` against a LOGIN_QUERY row.
+
+        Returns the user (or None) and, when the stored hash is legacy or uses
+        outdated parameters, the REHASH_PASSWORD_QUERY parameters to upgrade it.
+        """
+        if row is None:
+            auth.dummy_verify(password)
+            return None, None
+        if not auth.verify_password(password, row["password"]):
+            return None, None
+        stored = row.pop("password")
+        user = cls(**row)
+        rehash = None
+        if auth.needs_rehash(stored):
+            rehash = (auth.hash_password(password), user.id, stored)
+        return user, rehash
 
     @classmethod
     def register(cls, username, password):
         db = Database()
         hashed_password = cls.hash_password(password)
-        result = db.execute_query(
-            "INSERT INTO users (username, password) VALUES (%s, %s) RETURNING id, username, balance, is_admin",
-            (username, hashed_password),
-        )
+        result = db.execute_query(REGISTER_QUERY, (username, hashed_password))
         if result:
             return cls(**result[0])
         return None
@@ -30,25 +138,18 @@ class User:
     @classmethod
     def login(cls, username, password):
         db = Database()
-        hashed_password = cls.hash_password(password)
-        result = db.execute_query(
-            "SELECT id, username, balance, is_admin FROM users WHERE username = %s AND password = %s",
-            (username, hashed_password),
-        )
-        if result:
-            return cls(**result[0])
-        return None
+        result = db.execute_query(LOGIN_QUERY, (username,))
+        user, rehash = cls.authenticate(result[0] if result else None, password)
+        # The rehash bumps users.version; follow it so sessions stay warm
+        if rehash and db.execute_query(REHASH_PASSWORD_QUERY, rehash):
+            user.version += 1
+        return user
 
-    def increase_balance(self, amount):
-        db = Database()
-        db.execute_query(
-            "UPDATE users SET balance = balance + %s WHERE id = %s", (amount, self.id)
-        )
-        db.execute_query(
-            "INSERT INTO transactions (user_id, amount, type, description) VALUES (%s, %s, %s, %s)",
-            (self.id, amount, "DEPOSIT", f"Balance increased by {amount}"),
+    def increase_balance(self, amount, idempotency_key=None):
+        # Balance update and ledger entry commit together
+        self.balance = TransactionManager().deposit(
+            self.id, amount, idempotency_key=idempotency_key
         )
-        self.balance += amount
 
     def change_password(self, new_password):
         db = Database()
@@ -57,8 +158,49 @@ class User:
             "UPDATE users SET password = %s WHERE id = %s", (hashed_password, self.id)
         )
 
+    @staticmethod
+    def get_users_page(limit=PAGE_SIZE, after=None):
+        """One page of users ordered by (created_at, id), resuming after ``after``"""
+        db = Database()
+        seek = "WHERE (created_at, id) > (%s, %s)" if after else ""
+        result = db.execute_query(
+            f"""
+            SELECT {USER_COLUMNS}
+            FROM users
+            {seek}
+            ORDER BY created_at, id
+            LIMIT %s
+        """,
+            (*(after or ()), limit + 1),
+            row_factory=User,
+        )
+        return keyset_page(result, limit, "created_at", "id")
+
+    @staticmethod
+    def iter_users(itersize=1000):
+        db = Database()
+        return db.stream_query(
+            f"""
+            SELECT {USER_COLUMNS}
+            FROM users
+            ORDER BY created_at, id
+        """,
+            itersize=itersize,
+            row_factory=User,
+        )
+
 
 class Trip:
+    __slots__ = (
+        "id",
+        "cost",
+        "start_time",
+        "end_time",
+        "capacity",
+        "available_seats",
+        "status",
+    )
+
     def __init__(
         self,
         id,
@@ -70,7 +212,7 @@ class Trip:
         status="SCHEDULED",
     ):
         self.id = id
-        self.cost = float(cost)
+        self.cost = Decimal(cost)
         self.start_time = start_time
         self.end_time = end_time
         self.capacity = capacity
@@ -79,116 +221,250 @@ class Trip:
 
     @classmethod
     def get_available_trips(cls):
+        """Bookable trips, shared with the cache: treat them as read-only"""
+        trips = trip_cache.get(cls._load_available_trips)
+        # Cached trips may include some that have departed since they were loaded
+        now = datetime.now()
+        return [trip for trip in trips if trip.start_time > now]
+
+    @classmethod
+    def _load_available_trips(cls):
+        # Runs right after a trips_changed notification, when a replica may not
+        # have replayed the change yet; the cache already keeps this load rare
         db = Database()
-        result = db.execute_query(
-            """
-            SELECT * FROM trips 
-            WHERE status = 'SCHEDULED' AND start_time > CURRENT_TIMESTAMP
-            ORDER BY start_time
+        return db.execute_query(AVAILABLE_TRIPS_QUERY, primary=True, row_factory=cls)
+
+    @classmethod
+    def search(
+        cls,
+        start_after=None,
+        start_before=None,
+        max_cost=None,
+        min_seats=None,
+        status="SCHEDULED",
+        sort="start_time",
+        limit=PAGE_SIZE,
+    ):
+        """Trips departing inside (start_after, start_before) that cost at most
+        ``max_cost`` and have at least ``min_seats`` free seats.
+
+        Bookable trips are answered from the cached TripIndex; other statuses
+        (or ``status=None`` for all trips) query the database.
         """
+        if sort not in TRIP_SORT_KEYS:
+            raise ValueError(f"Unknown sort order: {sort}")
+        if max_cost is not None:
+            max_cost = Decimal(str(max_cost))
+        if status == "SCHEDULED":
+            now = datetime.now()
+            start_after = max(start_after, now) if start_after else now
+            index = trip_cache.get_index(cls._load_available_trips)
+            return index.search(
+                start_after, start_before, max_cost, min_seats, sort, limit
+            )
+
+        conditions, params = [], []
+        for condition, value in (
+            ("status = %s", status),
+            ("start_time > %s", start_after),
+            ("start_time < %s", start_before),
+            ("cost <= %s", max_cost),
+            ("available_seats >= %s", min_seats),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        db = Database()
+        return db.execute_query(
+            f"""
+            SELECT {TRIP_COLUMNS}
+            FROM trips
+            {where}
+            ORDER BY {TRIP_SEARCH_ORDER[sort]}
+            LIMIT %s
+        """,
+            (*params, limit),
+            row_factory=cls,
         )
-        return [cls(**trip) for trip in result]
 
     @classmethod
     def get_trip_by_id(cls, trip_id):
         db = Database()
-        result = db.execute_query("SELECT * FROM trips WHERE id = %s", (trip_id,))
+        result = db.execute_query(TRIP_BY_ID_QUERY, (trip_id,), row_factory=cls)
         if result:
-            return cls(**result[0])
+            return result[0]
         return None
 
-    def update_status(self):
+    @classmethod
+    def get_trips_page(cls, limit=PAGE_SIZE, after=None):
+        """One page of all trips ordered by (start_time, id), resuming after ``after``"""
         db = Database()
-        current_time = datetime.now()
-        if current_time >= self.start_time:
-            db.execute_query(
-                "UPDATE trips SET status = %s WHERE id = %s", ("IN_PROGRESS", self.id)
-            )
-            self.status = "IN_PROGRESS"
+        seek = "WHERE (start_time, id) > (%s, %s)" if after else ""
+        result = db.execute_query(
+            f"""
+            SELECT {TRIP_COLUMNS}
+            FROM trips
+            {seek}
+            ORDER BY start_time, id
+            LIMIT %s
+        """,
+            (*(after or ()), limit + 1),
+            row_factory=cls,
+        )
+        return keyset_page(result, limit, "start_time", "id")
+
+    @classmethod
+    def iter_trips(cls, itersize=1000):
+        db = Database()
+        return db.stream_query(
+            f"""
+            SELECT {TRIP_COLUMNS}
+            FROM trips
+            ORDER BY start_time, id
+        """,
+            itersize=itersize,
+            row_factory=cls,
+        )
 
-    def can_be_booked(self):
-        self.update_status()
-        return self.status == "SCHEDULED" and self.available_seats > 0
+    @staticmethod
+    def get_seat_map(trip_id):
+        """The trip's seats as a string with one character per seat, '1' if
+        sold and '0' if free, or None if the trip does not exist"""
+        db = Database()
+        result = db.execute_query(
+            "SELECT seat_map::text AS seat_map FROM trips WHERE id = %s",
+            (trip_id,),
+        )
+        return result[0]["seat_map"] if result else None
 
 
 class Ticket:
-    def __init__(self, id, user_id, trip_id, purchase_time, status="PURCHASED"):
+    # start_time, end_time and cost are the trip's, filled in by listings
+    __slots__ = (
+        "id",
+        "user_id",
+        "trip_id",
+        "purchase_time",
+        "status",
+        "seat_number",
+        "start_time",
+        "end_time",
+        "cost",
+    )
+
+    def __init__(
+        self,
+        id,
+        user_id,
+        trip_id,
+        purchase_time,
+        status="PURCHASED",
+        seat_number=None,
+        start_time=None,
+        end_time=None,
+        cost=None,
+    ):
         self.id = id
         self.user_id = user_id
         self.trip_id = trip_id
         self.purchase_time = purchase_time
         self.status = status
+        self.seat_number = seat_number
+        self.start_time = start_time
+        self.end_time = end_time
+        self.cost = cost
 
     @classmethod
-    def purchase_ticket(cls, user, trip_id):
-        db = Database()
+    def purchase_ticket(cls, user, trip_id, seat=None, idempotency_key=None):
+        # Seat, balance, ticket and transaction are written in one atomic step
+        row = TicketManager().purchase(user.id, trip_id, seat, idempotency_key)
+        trip_cache.invalidate()
+        user.balance = row.pop("balance")
+        return cls(**row)
 
-        # Check if trip exists and can be booked
-        trip = Trip.get_trip_by_id(trip_id)
-        if not trip or not trip.can_be_booked():
-            raise TripNotAvailableError("Trip is not available for booking")
-
-        # Check user balance
-        if user.balance < trip.cost:
-            raise InsufficientBalanceError("Insufficient balance")
-
-        # Start transaction
-        try:
-            # Deduct cost from user balance
-            db.execute_query(
-                "UPDATE users SET balance = balance - %s WHERE id = %s",
-                (trip.cost, user.id),
-            )
+    @classmethod
+    def purchase_tickets(cls, user, trip_id, count, idempotency_key=None):
+        # One seat update, one multi-row ticket insert and one ledger row
+        tickets, balance = TicketManager().purchase_many(
+            user.id, trip_id, count, idempotency_key
+        )
+        trip_cache.invalidate()
+        user.balance = balance
+        return [cls(**row) for row in tickets]
 
-            # Create ticket
-            result = db.execute_query(
-                """
-                INSERT INTO tickets (user_id, trip_id) 
-                VALUES (%s, %s) 
-                RETURNING id, user_id, trip_id, purchase_time, status
-            """,
-                (user.id, trip_id),
-            )
+    @classmethod
+    def purchase_tickets_for_trips(cls, user, quantities, idempotency_key=None):
+        tickets, balance = TicketManager().purchase_group(
+            user.id, quantities, idempotency_key
+        )
+        trip_cache.invalidate()
+        user.balance = balance
+        return [cls(**row) for row in tickets]
 
-            # Update available seats
-            db.execute_query(
-                "UPDATE trips SET available_seats = available_seats - 1 WHERE id = %s",
-                (trip_id,),
-            )
+    @staticmethod
+    def cancel_ticket(user, ticket_id):
+        """Cancel one of ``user``'s tickets with a refund to their balance.
 
-            # Record transaction
-            db.execute_query(
-                """
-                INSERT INTO transactions (user_id, amount, type, description) 
-                VALUES (%s, %s, %s, %s)
-            """,
-                (
-                    user.id,
-                    -trip.cost,
-                    "PURCHASE",
-                    f"Ticket purchased for trip {trip_id}",
-                ),
-            )
+        Returns the ticket given to the next waiting passenger, if any.
+        """
+        balance, promoted = TicketManager().cancel(user.id, ticket_id)
+        trip_cache.invalidate()
+        user.balance = balance
+        return Ticket(**promoted) if promoted else None
 
-            user.balance -= trip.cost
+    @staticmethod
+    def join_waitlist(user, trip_id):
+        return TicketManager().join_waitlist(user.id, trip_id)
 
-            return cls(**result[0]) if result else None
+    @staticmethod
+    def leave_waitlist(user, trip_id):
+        return TicketManager().leave_waitlist(user.id, trip_id)
 
-        except Exception as e:
-            db.conn.rollback()
-            raise e
+    @classmethod
+    def get_user_tickets(cls, user_id, since=None):
+        """All of a user's tickets, newest first; ``since`` limits them to
+        purchases at or after that time and skips older partitions"""
+        db = Database()
+        return db.execute_query(
+            f"""
+            SELECT {TICKET_COLUMNS}
+            FROM tickets t
+            JOIN trips tr ON t.trip_id = tr.id
+            WHERE t.user_id = %s
+              AND t.purchase_time >= %s
+              AND t.purchase_time <= LOCALTIMESTAMP
+            ORDER BY t.purchase_time DESC
+        """,
+            (user_id, since or datetime.min),
+            row_factory=cls,
+        )
 
     @classmethod
-    def get_user_tickets(cls, user_id):
+    def get_user_tickets_page(cls, user_id, limit=PAGE_SIZE, after=None):
+        """One page of a user's tickets, newest first, resuming after ``after``"""
         db = Database()
+        seek, seek_params = user_tickets_seek(after)
         result = db.execute_query(
-            """
-            SELECT t.*, tr.start_time, tr.end_time, tr.cost 
-            FROM tickets t 
-            JOIN trips tr ON t.trip_id = tr.id 
-            WHERE t.user_id = %s 
-            ORDER BY t.purchase_time DESC
+            USER_TICKETS_PAGE_QUERY.format(seek=seek),
+            (user_id, *seek_params, limit + 1),
+            row_factory=cls,
+        )
+        return keyset_page(result, limit, "purchase_time", "id")
+
+    @classmethod
+    def iter_user_tickets(cls, user_id, itersize=1000):
+        db = Database()
+        return db.stream_query(
+            f"""
+            SELECT {TICKET_COLUMNS}
+            FROM tickets t
+            JOIN trips tr ON t.trip_id = tr.id
+            WHERE t.user_id = %s
+            ORDER BY t.purchase_time DESC, t.id DESC
         """,
             (user_id,),
+            itersize=itersize,
+            row_factory=cls,
         )
-        return result
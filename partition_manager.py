@@ -0,0 +1,259 @@
+import argparse
+import os
+import time
+from datetime import date
+from pathlib import Path
+
+import psycopg2
+from decouple import config
+
+from database import Database
+
+# History tables partitioned by month in migration 0013
+PARTITIONED_TABLES = ("tickets", "transactions")
+
+# Named partitions of a table, attached or left detached by an interrupted
+# archive run
+PARTITIONS_QUERY = r"""
+    SELECT c.relname AS partition,
+           to_date(right(c.relname, 8), '"y"YYYY"m"MM') AS month,
+           i.inhrelid IS NOT NULL AS attached,
+           coalesce(i.inhdetachpending, FALSE) AS detach_pending,
+           greatest(c.reltuples, 0)::bigint AS estimated_rows,
+           pg_total_relation_size(c.oid) AS bytes
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace AND n.nspname = current_schema()
+    LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+    WHERE c.relkind = 'r' AND c.relname ~ ('^' || %s || '_y\d{4}m\d{2}$')
+    ORDER BY month
+"""
+
+# One month at a time, so each attach holds its locks only briefly
+ENSURE_QUERY = """
+    SELECT ensure_monthly_partitions(%(table)s, month, month)
+    FROM (SELECT (CURRENT_DATE + %(offset)s * interval '1 month')::date AS month) m
+"""
+
+# Tickets may only leave once their trips are over
+OPEN_TICKETS_QUERY = """
+    SELECT EXISTS (
+        SELECT 1 FROM {partition} t
+        JOIN trips tr ON tr.id = t.trip_id
+        WHERE tr.end_time > CURRENT_TIMESTAMP
+    )
+"""
+
+# Ledger rows may only leave once every balance snapshot covers them, since
+# BALANCE_QUERY reads the ledger after each user's snapshot
+UNSNAPSHOTTED_QUERY = """
+    SELECT coalesce(max(t.id), 0) > (
+        SELECT coalesce(max(last_transaction_id), 0) FROM balance_snapshots
+    )
+    FROM {partition} t
+"""
+
+ARCHIVE_LEDGER_QUERY = """
+    INSERT INTO archived_ledger AS a (user_id, amount, transactions)
+    SELECT user_id, sum(amount), count(*)
+    FROM {partition}
+    WHERE user_id IS NOT NULL
+    GROUP BY user_id
+    ORDER BY user_id
+    ON CONFLICT (user_id) DO UPDATE
+    SET amount = a.amount + EXCLUDED.amount,
+        transactions = a.transactions + EXCLUDED.transactions
+"""
+
+
+def month_start(value, months=0):
+    """First day of the month ``months`` after the one containing ``value``"""
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+class PartitionManager:
+    def __init__(self, db=None):
+        self.db = db or Database()
+
+    def ensure_partitions(self, months_ahead=None):
+        """Create any missing partitions up to ``months_ahead`` months from now.
+
+        Attaching a partition locks users and trips for its foreign keys, so
+        each month is attached in its own transaction that gives up quickly
+        and retries rather than hold up purchases and deposits. Returns the
+        number of partitions created.
+        """
+        if months_ahead is None:
+            months_ahead = config("PARTITION_MONTHS_AHEAD", default=3, cast=int)
+        created = 0
+        for table in PARTITIONED_TABLES:
+            for offset in range(months_ahead + 1):
+                created += self.with_lock_retry(
+                    lambda cursor: self._ensure_month(cursor, table, offset)
+                )
+        return created
+
+    @staticmethod
+    def _ensure_month(cursor, table, offset):
+        cursor.execute(ENSURE_QUERY, {"table": table, "offset": offset})
+        return cursor.fetchone()[0]
+
+    def with_lock_retry(self, work, attempts=20):
+        """Return ``work(cursor)`` run in a transaction with a short lock_timeout,
+        retried until it gets its locks.
+
+        For DDL that briefly locks users and trips: waiting behind an in-flight
+        purchase would make every new purchase queue behind the DDL, so it
+        backs off and tries again in a gap instead.
+        """
+        for attempt in range(attempts):
+            try:
+                with self.db.transaction() as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SET LOCAL lock_timeout = '100ms'")
+                        return work(cursor)
+            except psycopg2.errors.LockNotAvailable:
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(0.5)
+
+    def partitions(self, table):
+        return self.db.execute_query(PARTITIONS_QUERY, (table,), primary=True)
+
+    def archive(self, before, directory):
+        """Move every partition for a month before ``before`` out of the database.
+
+        Each partition is detached with DETACH PARTITION CONCURRENTLY, which
+        never blocks purchases or deposits, then written to
+        ``directory/<partition>.csv`` and dropped. Transaction totals are
+        added to archived_ledger first, so reconcile still sees them.
+        Partitions that cannot go yet are skipped with a reason. Returns
+        ``(partition, rows or None, path or reason)`` tuples.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        cutoff = month_start(before)
+        results = []
+        for table in PARTITIONED_TABLES:
+            for partition in self.partitions(table):
+                if partition["month"] >= cutoff:
+                    continue
+                name = partition["partition"]
+                reason = self.retention_blocker(table, name)
+                if reason:
+                    results.append((name, None, reason))
+                    continue
+                if partition["attached"]:
+                    self.detach(table, name, partition["detach_pending"])
+                path = directory / f"{name}.csv"
+                rows = self.export(name, path)
+                self.drop(table, name)
+                results.append((name, rows, str(path)))
+        return results
+
+    def retention_blocker(self, table, partition):
+        query = OPEN_TICKETS_QUERY if table == "tickets" else UNSNAPSHOTTED_QUERY
+        with self.db.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query.format(partition=partition))
+                blocked = cursor.fetchone()[0]
+            conn.rollback()
+        if not blocked:
+            return None
+        if table == "tickets":
+            return "has tickets for trips that have not ended"
+        return "not covered by balance snapshots; run `python transaction_manager.py snapshot`"
+
+    def detach(self, table, partition, pending=False):
+        # CONCURRENTLY cannot run inside a transaction block; FINALIZE completes
+        # a concurrent detach that was interrupted
+        mode = "FINALIZE" if pending else "CONCURRENTLY"
+        with self.db.connection() as conn:
+            conn.autocommit = True
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        f"ALTER TABLE {table} DETACH PARTITION {partition} {mode}"
+                    )
+            finally:
+                conn.autocommit = False
+
+    def export(self, partition, path):
+        """Write a detached partition to ``path`` as CSV; returns the row count"""
+        partial = path.with_suffix(".csv.partial")
+        with self.db.connection() as conn:
+            with conn.cursor() as cursor, open(partial, "w", newline="") as file:
+                cursor.copy_expert(
+                    f"COPY (SELECT * FROM {partition} ORDER BY id) "
+                    "TO STDOUT WITH (FORMAT csv, HEADER true)",
+                    file,
+                )
+                exported = cursor.rowcount
+                file.flush()
+                os.fsync(file.fileno())
+            conn.rollback()
+        # Only a complete export replaces the file, and only then is the
+        # partition dropped
+        partial.replace(path)
+        return exported
+
+    def drop(self, table, partition):
+        # Dropping the partition's foreign keys needs a brief lock on users and
+        # trips that conflicts with in-flight purchases
+        def work(cursor):
+            if table == "transactions":
+                cursor.execute(ARCHIVE_LEDGER_QUERY.format(partition=partition))
+            cursor.execute(f"DROP TABLE {partition}")
+
+        self.with_lock_retry(work)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monthly history partitions")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ensure_parser = commands.add_parser("ensure", help="create upcoming partitions")
+    ensure_parser.add_argument("--months-ahead", type=int)
+
+    commands.add_parser("list", help="show partitions and their sizes")
+
+    archive_parser = commands.add_parser(
+        "archive", help="detach, export and drop old partitions"
+    )
+    archive_parser.add_argument("directory", help="where the CSV files are written")
+    archive_parser.add_argument(
+        "--keep-months",
+        type=int,
+        default=config("RETENTION_MONTHS", default=24, cast=int),
+        help="months kept before the current one",
+    )
+
+    args = parser.parse_args(argv)
+    manager = PartitionManager()
+
+    if args.command == "ensure":
+        print(f"Created {manager.ensure_partitions(args.months_ahead)} partitions")
+    elif args.command == "list":
+        for table in PARTITIONED_TABLES:
+            for partition in manager.partitions(table):
+                state = "attached" if partition["attached"] else "detached"
+                if partition["detach_pending"]:
+                    state = "detach pending"
+                print(
+                    f"{partition['partition']} | {state} | "
+                    f"~{partition['estimated_rows']} rows | "
+                    f"{partition['bytes'] / 2**20:.1f} MB"
+                )
+    else:
+        before = month_start(date.today(), -args.keep_months)
+        print(f"Archiving partitions before {before}")
+        for partition, rows, detail in manager.archive(before, args.directory):
+            if rows is None:
+                print(f"{partition}: skipped, {detail}")
+            else:
+                print(f"{partition}: {rows} rows archived to {detail}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
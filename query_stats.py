@@ -0,0 +1,156 @@
+import logging
+import os
+import re
+import sys
+import threading
+from collections import Counter, defaultdict, deque
+
+from decouple import config
+
+logger = logging.getLogger("database.slow_query")
+
+# Slow queries go to SLOW_QUERY_LOG when set; otherwise they stay out of the
+# terminal UI unless the application configures logging itself
+if config("SLOW_QUERY_LOG", default=""):
+    logger.addHandler(logging.FileHandler(config("SLOW_QUERY_LOG")))
+else:
+    logger.addHandler(logging.NullHandler())
+
+# Frames from these files are plumbing, not the code that issued the query
+_INTERNAL_FILES = {
+    os.path.abspath(__file__),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "database.py"),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "async_database.py"),
+}
+
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query):
+    """Collapse whitespace and replace literals so similar statements group together"""
+    if isinstance(query, bytes):
+        query = query.decode()
+    return _WHITESPACE.sub(" ", _LITERAL.sub("?", str(query))).strip()
+
+
+def params_shape(params):
+    """Describe parameters by type only, so values never reach the log"""
+    if params is None:
+        return "()"
+    if isinstance(params, dict):
+        fields = (f"{key}: {type(value).__name__}" for key, value in params.items())
+        return "{" + ", ".join(fields) + "}"
+    return "(" + ", ".join(type(v).__name__ for v in params) + ")"
+
+
+def _is_library(filename):
+    return "psycopg2" in filename or os.path.basename(filename) == "contextlib.py"
+
+
+def call_site():
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename not in _INTERNAL_FILES and not _is_library(filename):
+            name = os.path.basename(filename)
+            return f"{name}:{frame.f_lineno} {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = round(fraction * (len(sorted_values) - 1))
+    return sorted_values[index]
+
+
+class QueryStats:
+    """Per-process latency, row count and call-site statistics per normalized query"""
+
+    def __init__(self, slow_query_ms, sample_size=1000):
+        self.slow_query_ms = slow_query_ms
+        self.sample_size = sample_size
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._calls = Counter()
+            self._total_ms = Counter()
+            self._rows = Counter()
+            self._samples = defaultdict(lambda: deque(maxlen=self.sample_size))
+            self._call_sites = defaultdict(Counter)
+            self._checkouts = deque(maxlen=self.sample_size)
+            self._retries = Counter()
+
+    def record_query(self, query, params, elapsed_ms, rowcount):
+        normalized = normalize_query(query)
+        site = call_site()
+        with self._lock:
+            self._calls[normalized] += 1
+            self._total_ms[normalized] += elapsed_ms
+            self._rows[normalized] += max(rowcount, 0)
+            self._samples[normalized].append(elapsed_ms)
+            self._call_sites[normalized][site] += 1
+
+        if elapsed_ms >= self.slow_query_ms:
+            logger.warning(
+                "Slow query (%.1f ms, %d rows) from %s: %s params=%s",
+                elapsed_ms,
+                rowcount,
+                site,
+                normalized,
+                params_shape(params),
+            )
+
+    def record_checkout(self, wait_ms):
+        with self._lock:
+            self._checkouts.append(wait_ms)
+
+    def record_retry(self, error):
+        """Count a transaction attempt aborted by ``error``"""
+        with self._lock:
+            self._retries[type(error).__name__] += 1
+
+    def summary(self):
+        """Aggregated statistics per normalized query, slowest total time first"""
+        with self._lock:
+            queries = []
+            for normalized, calls in self._calls.items():
+                samples = sorted(self._samples[normalized])
+                queries.append(
+                    {
+                        "query": normalized,
+                        "calls": calls,
+                        "total_ms": self._total_ms[normalized],
+                        "mean_ms": self._total_ms[normalized] / calls,
+                        "p50_ms": percentile(samples, 0.50),
+                        "p95_ms": percentile(samples, 0.95),
+                        "p99_ms": percentile(samples, 0.99),
+                        "rows": self._rows[normalized],
+                        "call_sites": dict(
+                            self._call_sites[normalized].most_common(3)
+                        ),
+                    }
+                )
+            checkouts = sorted(self._checkouts)
+            retries = dict(self._retries)
+
+        queries.sort(key=lambda q: q["total_ms"], reverse=True)
+        return {
+            "queries": queries,
+            "checkout": {
+                "count": len(checkouts),
+                "p50_ms": percentile(checkouts, 0.50),
+                "p95_ms": percentile(checkouts, 0.95),
+                "p99_ms": percentile(checkouts, 0.99),
+            },
+            "retries": retries,
+        }
+
+
+query_stats = QueryStats(
+    slow_query_ms=config("SLOW_QUERY_MS", default=200.0, cast=float)
+)
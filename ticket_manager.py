@@ -0,0 +1,417 @@
+import idempotency
+from database import Database, DictCursor, prepared_statements
+from exceptions import (
+    CancellationError,
+    InsufficientBalanceError,
+    TripNotAvailableError,
+)
+
+
+# Seat allocation, balance debit, ticket insert and ledger row in one statement.
+# Each step only fires if the previous one matched, so a sold-out trip, a taken
+# seat or a short balance leaves the corresponding CTE empty and nothing is
+# written beyond the seat row, which the surrounding transaction then rolls
+# back. The trip row is locked before its seat map is read, so concurrent
+# buyers each see the map left by the previous one.
+PURCHASE_QUERY = """
+    WITH locked AS (
+        SELECT id,
+               CASE
+                   WHEN %(seat)s::int IS NULL THEN (seat_block(seat_map, 1))[1]
+                   WHEN seat_free(seat_map, %(seat)s) THEN %(seat)s
+               END AS seat_number
+        FROM trips
+        WHERE id = %(trip_id)s
+        FOR UPDATE
+    ), seat AS (
+        UPDATE trips t
+        SET available_seats = t.available_seats - 1,
+            seat_map = set_seats(t.seat_map, ARRAY[l.seat_number], 1)
+        FROM locked l
+        WHERE t.id = l.id
+          AND t.status = 'SCHEDULED'
+          AND t.start_time > CURRENT_TIMESTAMP
+          AND t.available_seats > 0
+          AND l.seat_number IS NOT NULL
+        RETURNING t.id, t.cost, l.seat_number
+    ), debit AS (
+        UPDATE users u
+        SET balance = u.balance - seat.cost
+        FROM seat
+        WHERE u.id = %(user_id)s AND u.balance >= seat.cost
+        RETURNING u.id AS user_id, u.balance, seat.id AS trip_id, seat.cost,
+                  seat.seat_number
+    ), ticket AS (
+        INSERT INTO tickets (user_id, trip_id, seat_number)
+        SELECT user_id, trip_id, seat_number FROM debit
+        RETURNING id, user_id, trip_id, purchase_time, status, seat_number
+    ), ledger AS (
+        INSERT INTO transactions (user_id, amount, type, description)
+        SELECT user_id, -cost, 'PURCHASE', 'Ticket purchased for trip ' || trip_id
+        FROM debit
+    )
+    SELECT
+        seat.id IS NOT NULL AS seat_reserved,
+        debit.balance,
+        ticket.id,
+        ticket.user_id,
+        ticket.trip_id,
+        ticket.purchase_time,
+        ticket.status,
+        ticket.seat_number
+    FROM (SELECT 1) AS one
+    LEFT JOIN seat ON TRUE
+    LEFT JOIN debit ON TRUE
+    LEFT JOIN ticket ON TRUE
+"""
+prepared_statements.register("purchase", PURCHASE_QUERY)
+
+
+# Group variant of PURCHASE_QUERY: every requested trip must have enough seats
+# or the debit (and so every insert) is skipped. Each trip gets the best
+# available block of seats (see seat_block). Trip rows are locked in id order
+# first so concurrent multi-trip buyers cannot deadlock each other.
+GROUP_PURCHASE_QUERY = """
+    WITH wanted (trip_id, quantity) AS (
+        SELECT * FROM unnest(%(trip_ids)s::int[], %(quantities)s::int[])
+    ), locked AS (
+        SELECT t.id, seat_block(t.seat_map, w.quantity) AS seats
+        FROM trips t
+        JOIN wanted w ON w.trip_id = t.id
+        ORDER BY t.id
+        FOR UPDATE OF t
+    ), seat AS (
+        UPDATE trips t
+        SET available_seats = t.available_seats - w.quantity,
+            seat_map = set_seats(t.seat_map, l.seats, 1)
+        FROM wanted w
+        JOIN locked l ON l.id = w.trip_id
+        WHERE t.id = w.trip_id
+          AND t.status = 'SCHEDULED'
+          AND t.start_time > CURRENT_TIMESTAMP
+          AND t.available_seats >= w.quantity
+          AND l.seats IS NOT NULL
+        RETURNING t.id, t.cost, w.quantity, l.seats
+    ), total AS (
+        SELECT count(*) AS trips, coalesce(sum(cost * quantity), 0) AS cost
+        FROM seat
+    ), debit AS (
+        UPDATE users u
+        SET balance = u.balance - total.cost
+        FROM total
+        WHERE u.id = %(user_id)s
+          AND total.trips = cardinality(%(trip_ids)s::int[])
+          AND u.balance >= total.cost
+        RETURNING u.id AS user_id, u.balance, total.cost
+    ), ticket AS (
+        INSERT INTO tickets (user_id, trip_id, seat_number)
+        SELECT debit.user_id, seat.id, s.seat_number
+        FROM debit
+        CROSS JOIN seat
+        CROSS JOIN unnest(seat.seats) AS s (seat_number)
+        RETURNING id, user_id, trip_id, purchase_time, status, seat_number
+    ), ledger AS (
+        INSERT INTO transactions (user_id, amount, type, description)
+        SELECT user_id, -cost, 'PURCHASE', %(description)s
+        FROM debit
+    )
+    SELECT
+        total.trips AS trips_reserved,
+        debit.balance,
+        ticket.id,
+        ticket.user_id,
+        ticket.trip_id,
+        ticket.purchase_time,
+        ticket.status,
+        ticket.seat_number
+    FROM total
+    LEFT JOIN debit ON TRUE
+    LEFT JOIN ticket ON TRUE
+    ORDER BY ticket.id
+"""
+
+
+# Locks the cancelled ticket's trip, then the passenger. Purchases take trips,
+# then users, then the sales rollups their ticket triggers write, so cancel
+# follows the same order and leaves its own rollup writes (CANCEL_QUERY and
+# REFUND_QUERY triggers) for last; otherwise a cancel and a purchase on the same
+# trip or by the same passenger deadlock. As a result cancellations on one trip
+# run one at a time, as they would anyway: each one updates the trip's seat map
+# or hands its seat on, and writes the trip's single trip_sales row.
+LOCK_TICKET_QUERY = """
+    SELECT t.trip_id, t.seat_number, tr.cost
+    FROM tickets t
+    JOIN trips tr ON tr.id = t.trip_id
+    WHERE t.id = %(ticket_id)s
+      AND t.user_id = %(user_id)s
+      AND t.status = 'PURCHASED'
+      AND tr.status = 'SCHEDULED'
+      AND tr.start_time > CURRENT_TIMESTAMP
+    FOR UPDATE OF tr
+"""
+
+LOCK_USER_QUERY = "SELECT id FROM users WHERE id = %(user_id)s FOR UPDATE"
+
+# Marks a ticket of a trip that has not departed yet as cancelled. Rechecked
+# here because LOCK_TICKET_QUERY may have read the ticket before a concurrent
+# cancellation of it committed.
+CANCEL_QUERY = """
+    UPDATE tickets t
+    SET status = 'CANCELLED'
+    FROM trips tr
+    WHERE t.id = %(ticket_id)s
+      AND t.user_id = %(user_id)s
+      AND t.status = 'PURCHASED'
+      AND tr.id = t.trip_id
+      AND tr.status = 'SCHEDULED'
+      AND tr.start_time > CURRENT_TIMESTAMP
+    RETURNING t.id
+"""
+
+# Hands a freed seat to the longest-waiting passenger who can pay for it. The
+# caller holds the trip lock, so no other cancellation competes for the queue;
+# SKIP LOCKED only passes over a passenger who is leaving the waitlist right
+# now. The entry is only removed once the debit succeeded.
+PROMOTE_QUERY = """
+    WITH next AS (
+        SELECT w.id, w.user_id
+        FROM waitlist w
+        JOIN users u ON u.id = w.user_id
+        WHERE w.trip_id = %(trip_id)s AND u.balance >= %(cost)s
+        ORDER BY w.enqueued_at, w.id
+        LIMIT 1
+        FOR UPDATE OF w SKIP LOCKED
+    ), debit AS (
+        UPDATE users u
+        SET balance = u.balance - %(cost)s
+        FROM next
+        WHERE u.id = next.user_id AND u.balance >= %(cost)s
+        RETURNING u.id AS user_id, next.id AS waitlist_id
+    ), dequeued AS (
+        DELETE FROM waitlist w
+        USING debit
+        WHERE w.id = debit.waitlist_id
+    ), ticket AS (
+        INSERT INTO tickets (user_id, trip_id, seat_number)
+        SELECT user_id, %(trip_id)s, %(seat_number)s FROM debit
+        RETURNING id, user_id, trip_id, purchase_time, status, seat_number
+    ), ledger AS (
+        INSERT INTO transactions (user_id, amount, type, description)
+        SELECT user_id, -%(cost)s, 'PURCHASE',
+               'Waitlist ticket for trip ' || %(trip_id)s
+        FROM debit
+    )
+    SELECT * FROM ticket
+"""
+
+# Nobody took the seat over, so it goes back on sale
+RELEASE_SEAT_QUERY = """
+    UPDATE trips
+    SET available_seats = available_seats + 1,
+        seat_map = coalesce(
+            set_seats(seat_map, ARRAY[%(seat_number)s::int], 0), seat_map
+        )
+    WHERE id = %(trip_id)s
+"""
+
+REFUND_QUERY = """
+    WITH credit AS (
+        UPDATE users SET balance = balance + %(cost)s
+        WHERE id = %(user_id)s
+        RETURNING id, balance
+    ), entry AS (
+        INSERT INTO transactions (user_id, amount, type, description)
+        SELECT id, %(cost)s, 'REFUND', 'Ticket ' || %(ticket_id)s || ' cancelled'
+        FROM credit
+    )
+    SELECT balance FROM credit
+"""
+
+JOIN_WAITLIST_QUERY = """
+    WITH entry AS (
+        INSERT INTO waitlist (trip_id, user_id)
+        SELECT id, %(user_id)s FROM trips
+        WHERE id = %(trip_id)s
+          AND status = 'SCHEDULED'
+          AND start_time > CURRENT_TIMESTAMP
+        ON CONFLICT (trip_id, user_id) DO UPDATE SET trip_id = EXCLUDED.trip_id
+        RETURNING trip_id, enqueued_at, id
+    )
+    SELECT 1 + (
+        SELECT count(*) FROM waitlist w
+        WHERE w.trip_id = entry.trip_id
+          AND (w.enqueued_at, w.id) < (entry.enqueued_at, entry.id)
+    ) AS position
+    FROM entry
+"""
+
+
+class TicketManager:
+    def __init__(self, db=None):
+        self.db = db or Database()
+
+    def purchase(self, user_id, trip_id, seat=None, idempotency_key=None):
+        """Reserve a seat and charge the user atomically.
+
+        ``seat`` picks a specific seat number; by default the best available
+        one is assigned. Returns the new ticket row plus the user's resulting
+        ``balance``. A repeated call with the same ``idempotency_key`` returns
+        the first call's ticket instead of buying another.
+        """
+
+        def work(conn):
+            with conn.cursor(cursor_factory=DictCursor) as cursor:
+                if idempotency_key:
+                    stored = idempotency.claim(
+                        cursor, user_id, idempotency_key, "purchase"
+                    )
+                    if stored is not None:
+                        return idempotency.decode_ticket(stored)
+                cursor.execute(
+                    PURCHASE_QUERY,
+                    {"user_id": user_id, "trip_id": trip_id, "seat": seat},
+                )
+                ticket = self.purchase_result(cursor.fetchone(), seat)
+                if idempotency_key:
+                    idempotency.save(cursor, user_id, idempotency_key, ticket)
+                return ticket
+
+        return self.db.run_transaction(work, idempotent=bool(idempotency_key))
+
+    def purchase_many(self, user_id, trip_id, count, idempotency_key=None):
+        """Buy ``count`` seats on one trip, all-or-nothing."""
+        return self.purchase_group(user_id, {trip_id: count}, idempotency_key)
+
+    def purchase_group(self, user_id, quantities, idempotency_key=None):
+        """Buy seats on several trips at once, all-or-nothing.
+
+        ``quantities`` maps trip id to the number of tickets wanted. Returns the
+        new ticket rows and the user's resulting balance.
+        """
+        params = self.group_purchase_params(user_id, quantities)
+
+        def work(conn):
+            with conn.cursor(cursor_factory=DictCursor) as cursor:
+                if idempotency_key:
+                    stored = idempotency.claim(
+                        cursor, user_id, idempotency_key, "purchase_group"
+                    )
+                    if stored is not None:
+                        return idempotency.decode_group(stored)
+                cursor.execute(GROUP_PURCHASE_QUERY, params)
+                tickets, balance = self.group_purchase_result(
+                    cursor.fetchall(), quantities
+                )
+                if idempotency_key:
+                    idempotency.save(
+                        cursor,
+                        user_id,
+                        idempotency_key,
+                        {"tickets": tickets, "balance": balance},
+                    )
+                return tickets, balance
+
+        return self.db.run_transaction(work, idempotent=bool(idempotency_key))
+
+    def cancel(self, user_id, ticket_id):
+        """Cancel a ticket and refund its cost.
+
+        The seat goes to the first waiting passenger in the same transaction,
+        or back on sale if nobody is waiting. Returns the user's new balance
+        and the promoted passenger's ticket row, if any.
+        """
+        params = {"user_id": user_id, "ticket_id": ticket_id}
+
+        def work(conn):
+            with conn.cursor(cursor_factory=DictCursor) as cursor:
+                cursor.execute(LOCK_TICKET_QUERY, params)
+                locked = cursor.fetchone()
+                if locked is None:
+                    raise CancellationError(
+                        "Ticket not found, already cancelled or its trip has departed"
+                    )
+                cursor.execute(LOCK_USER_QUERY, params)
+
+                # The seat changes hands before the cancellation is written,
+                # so the waiting passenger's row is locked ahead of any rollup
+                seat = dict(locked)
+                cursor.execute(PROMOTE_QUERY, seat)
+                promoted = cursor.fetchone()
+                if promoted is None:
+                    cursor.execute(RELEASE_SEAT_QUERY, seat)
+
+                cursor.execute(CANCEL_QUERY, params)
+                if cursor.fetchone() is None:
+                    raise CancellationError(
+                        "Ticket not found, already cancelled or its trip has departed"
+                    )
+
+                cursor.execute(REFUND_QUERY, {**params, **seat})
+                return cursor.fetchone()["balance"], promoted
+
+        return self.db.run_transaction(work)
+
+    def join_waitlist(self, user_id, trip_id):
+        """Queue the user for the next freed seat; returns their position"""
+        with self.db.transaction() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cursor:
+                cursor.execute(
+                    JOIN_WAITLIST_QUERY, {"user_id": user_id, "trip_id": trip_id}
+                )
+                row = cursor.fetchone()
+        if row is None:
+            raise TripNotAvailableError("Trip is not available for booking")
+        return row["position"]
+
+    def leave_waitlist(self, user_id, trip_id):
+        return bool(
+            self.db.execute_query(
+                "DELETE FROM waitlist WHERE trip_id = %s AND user_id = %s",
+                (trip_id, user_id),
+            )
+        )
+
+    # The helpers below are shared with the async server so both front ends
+    # apply the same rules. Raising inside the caller's transaction rolls back
+    # the seat decrement that may already have happened.
+
+    @staticmethod
+    def purchase_result(row, seat=None):
+        if not row["seat_reserved"]:
+            if seat is not None:
+                raise TripNotAvailableError(f"Seat {seat} is not available")
+            raise TripNotAvailableError("Trip is not available for booking")
+        if row["id"] is None:
+            raise InsufficientBalanceError("Insufficient balance")
+        del row["seat_reserved"]
+        return row
+
+    @staticmethod
+    def group_purchase_params(user_id, quantities):
+        if not quantities or any(count < 1 for count in quantities.values()):
+            raise ValueError("Ticket count must be at least 1")
+
+        trip_ids = list(quantities)
+        return {
+            "user_id": user_id,
+            "trip_ids": trip_ids,
+            "quantities": [quantities[trip_id] for trip_id in trip_ids],
+            "description": "Tickets purchased: "
+            + ", ".join(
+                f"{count} for trip {trip_id}" for trip_id, count in quantities.items()
+            ),
+        }
+
+    @staticmethod
+    def group_purchase_result(rows, quantities):
+        if rows[0]["trips_reserved"] != len(quantities):
+            raise TripNotAvailableError("Not enough seats available for booking")
+        if rows[0]["id"] is None:
+            raise InsufficientBalanceError("Insufficient balance")
+
+        balance = rows[0]["balance"]
+        tickets = []
+        for row in rows:
+            del row["trips_reserved"], row["balance"]
+            tickets.append(row)
+        return tickets, balance
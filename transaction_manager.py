@@ -0,0 +1,245 @@
+import argparse
+from decimal import Decimal, InvalidOperation
+
+import idempotency
+from database import Database, DictCursor, prepared_statements
+
+CENT = Decimal("0.01")
+
+# Balance column and ledger row change together in one statement
+DEPOSIT_QUERY = """
+    WITH credit AS (
+        UPDATE users SET balance = balance + %(amount)s
+        WHERE id = %(user_id)s
+        RETURNING id, balance
+    ), entry AS (
+        INSERT INTO transactions (user_id, amount, type, description)
+        SELECT id, %(amount)s, 'DEPOSIT', %(description)s FROM credit
+        RETURNING id
+    )
+    SELECT credit.balance, entry.id AS transaction_id
+    FROM credit, entry
+"""
+prepared_statements.register("deposit", DEPOSIT_QUERY)
+
+# Many deposits in one statement, for DepositBatcher. Users are locked in id
+# order, each is credited once with the sum of their deposits and every
+# deposit still gets its own ledger row. ``balance`` is the running balance
+# after each deposit, as DEPOSIT_QUERY would have returned it; it is NULL for
+# unknown users.
+BATCH_DEPOSIT_QUERY = """
+    WITH batch (user_id, amount, description, position) AS (
+        SELECT * FROM unnest(
+            %(user_ids)s::int[], %(amounts)s::numeric[], %(descriptions)s::text[]
+        ) WITH ORDINALITY
+    ), locked AS (
+        SELECT u.id
+        FROM users u
+        WHERE u.id IN (SELECT user_id FROM batch)
+        ORDER BY u.id
+        FOR UPDATE
+    ), totals AS (
+        SELECT user_id, sum(amount) AS amount
+        FROM batch
+        GROUP BY user_id
+    ), credit AS (
+        UPDATE users u
+        SET balance = u.balance + totals.amount
+        FROM totals
+        JOIN locked l ON l.id = totals.user_id
+        WHERE u.id = totals.user_id
+        RETURNING u.id, u.balance, totals.amount
+    ), entry AS (
+        INSERT INTO transactions (user_id, amount, type, description)
+        SELECT b.user_id, b.amount, 'DEPOSIT', b.description
+        FROM batch b
+        JOIN credit c ON c.id = b.user_id
+        ORDER BY b.position
+    )
+    SELECT b.position,
+           c.balance - c.amount
+               + sum(b.amount) OVER (PARTITION BY b.user_id ORDER BY b.position)
+               AS balance
+    FROM batch b
+    LEFT JOIN credit c ON c.id = b.user_id
+    ORDER BY b.position
+"""
+prepared_statements.register("deposit_batch", BATCH_DEPOSIT_QUERY)
+
+# transactions is partitioned by month on created_at, so the tail is also
+# bounded by time: from a day before the snapshot (a ledger row committed after
+# it may have started earlier) to just past now, which skips archived months
+# and the empty future partitions.
+BALANCE_QUERY = """
+    SELECT coalesce(s.balance, 0) + coalesce((
+        SELECT sum(t.amount) FROM transactions t
+        WHERE t.user_id = %(user_id)s
+          AND t.id > coalesce(s.last_transaction_id, 0)
+          AND t.created_at >= coalesce(s.taken_at - interval '1 day', '-infinity')
+          AND t.created_at <= LOCALTIMESTAMP + interval '1 hour'
+    ), 0) AS balance
+    FROM (SELECT %(user_id)s::integer AS user_id) u
+    LEFT JOIN balance_snapshots s ON s.user_id = u.user_id
+"""
+
+# Folds every ledger row after the previous run's high-water mark into the
+# owning user's snapshot, so each run only reads the new part of the ledger
+SNAPSHOT_QUERY = """
+    WITH watermark AS (
+        SELECT coalesce(max(last_transaction_id), 0) AS id FROM balance_snapshots
+    ), tail AS (
+        SELECT t.user_id, sum(t.amount) AS amount, max(t.id) AS last_id
+        FROM transactions t, watermark w
+        WHERE t.id > w.id
+        GROUP BY t.user_id
+    )
+    INSERT INTO balance_snapshots (user_id, balance, last_transaction_id, taken_at)
+    SELECT tail.user_id, coalesce(s.balance, 0) + tail.amount, tail.last_id,
+           CURRENT_TIMESTAMP
+    FROM tail
+    LEFT JOIN balance_snapshots s ON s.user_id = tail.user_id
+    ON CONFLICT (user_id) DO UPDATE
+    SET balance = EXCLUDED.balance,
+        last_transaction_id = EXCLUDED.last_transaction_id,
+        taken_at = EXCLUDED.taken_at
+"""
+
+# Full-ledger check: snapshots must equal the ledger up to their position and
+# users.balance must equal snapshot plus tail. Archived ledger partitions only
+# ever hold rows below every snapshot position, so their totals count on both
+# sides.
+RECONCILE_QUERY = """
+    WITH ledger AS (
+        SELECT t.user_id,
+               sum(t.amount) AS total,
+               sum(t.amount) FILTER (
+                   WHERE t.id <= coalesce(s.last_transaction_id, 0)
+               ) AS upto_snapshot
+        FROM transactions t
+        LEFT JOIN balance_snapshots s ON s.user_id = t.user_id
+        GROUP BY t.user_id
+    ), totals AS (
+        SELECT u.id AS user_id,
+               u.balance,
+               coalesce(a.amount, 0) + coalesce(l.total, 0) AS ledger_balance,
+               s.user_id IS NOT NULL AS has_snapshot,
+               s.balance AS snapshot_balance,
+               coalesce(a.amount, 0) + coalesce(l.upto_snapshot, 0)
+                   AS ledger_at_snapshot
+        FROM users u
+        LEFT JOIN ledger l ON l.user_id = u.id
+        LEFT JOIN archived_ledger a ON a.user_id = u.id
+        LEFT JOIN balance_snapshots s ON s.user_id = u.id
+    )
+    SELECT user_id, balance, ledger_balance, snapshot_balance, ledger_at_snapshot
+    FROM totals
+    WHERE balance <> ledger_balance
+       OR (has_snapshot AND snapshot_balance <> ledger_at_snapshot)
+    ORDER BY user_id
+"""
+
+
+def deposit_description(amount, description=None):
+    return description or f"Balance increased by {amount}"
+
+
+def to_amount(value):
+    """Convert user input or a float to an exact, positive two-decimal amount"""
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {value!r}")
+    if not amount.is_finite() or amount <= 0:
+        raise ValueError("Amount must be positive")
+    if amount != amount.quantize(CENT):
+        raise ValueError("Amount cannot have more than two decimal places")
+    return amount.quantize(CENT)
+
+
+class TransactionManager:
+    def __init__(self, db=None):
+        self.db = db or Database()
+
+    def deposit(self, user_id, amount, description=None, idempotency_key=None):
+        """Credit ``amount`` and append its ledger entry atomically.
+
+        Returns the user's new balance as a Decimal. A repeated call with the
+        same ``idempotency_key`` returns the first call's balance and credits
+        nothing.
+        """
+        amount = to_amount(amount)
+
+        def work(conn):
+            with conn.cursor(cursor_factory=DictCursor) as cursor:
+                if idempotency_key:
+                    stored = idempotency.claim(
+                        cursor, user_id, idempotency_key, "deposit"
+                    )
+                    if stored is not None:
+                        return Decimal(stored["balance"])
+                cursor.execute(
+                    DEPOSIT_QUERY,
+                    {
+                        "user_id": user_id,
+                        "amount": amount,
+                        "description": deposit_description(amount, description),
+                    },
+                )
+                row = cursor.fetchone()
+                if row is None:
+                    raise ValueError(f"Unknown user {user_id}")
+                if idempotency_key:
+                    idempotency.save(
+                        cursor, user_id, idempotency_key, {"balance": row["balance"]}
+                    )
+                return row["balance"]
+
+        return self.db.run_transaction(work, idempotent=bool(idempotency_key))
+
+    def balance(self, user_id):
+        """Ledger balance: latest snapshot plus the transactions after it"""
+        result = self.db.execute_query(BALANCE_QUERY, {"user_id": user_id})
+        return result[0]["balance"]
+
+    def take_snapshots(self):
+        """Advance every user's snapshot to the end of the ledger.
+
+        The SHARE lock waits for in-flight ledger writes to commit and holds
+        new ones off until the snapshot commits, so no lower transaction id
+        can appear behind the new high-water mark. Returns the number of
+        snapshots written.
+        """
+        with self.db.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("LOCK TABLE transactions IN SHARE MODE")
+                cursor.execute(SNAPSHOT_QUERY)
+                return cursor.rowcount
+
+    def reconcile(self):
+        """Return one row per user whose balance, snapshot and ledger disagree"""
+        return self.db.execute_query(RECONCILE_QUERY)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Balance ledger maintenance")
+    parser.add_argument("command", choices=("snapshot", "reconcile"))
+    args = parser.parse_args(argv)
+
+    manager = TransactionManager()
+    if args.command == "snapshot":
+        print(f"Updated {manager.take_snapshots()} balance snapshots")
+        return 0
+
+    mismatches = manager.reconcile()
+    for row in mismatches:
+        print(
+            f"User {row['user_id']}: balance {row['balance']} | "
+            f"ledger {row['ledger_balance']} | snapshot {row['snapshot_balance']} "
+            f"(ledger at snapshot {row['ledger_at_snapshot']})"
+        )
+    print(f"{len(mismatches)} mismatched balances")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,201 @@
+import os
+import select
+from bisect import bisect_left, bisect_right
+import threading
+import time
+
+import psycopg2
+from decouple import config
+
+from database import Database
+
+
+# Sort keys shared by TripIndex and the SQL search in models.Trip.search
+TRIP_SORT_KEYS = {
+    "start_time": lambda trip: (trip.start_time, trip.id),
+    "cost": lambda trip: (trip.cost, trip.start_time, trip.id),
+    "available_seats": lambda trip: (
+        -trip.available_seats,
+        trip.start_time,
+        trip.id,
+    ),
+}
+
+
+class TripIndex:
+    """Cached trips kept sorted by start time and by cost, so departure
+    window and price searches bisect instead of scanning every trip"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.by_start = sorted(rows, key=TRIP_SORT_KEYS["start_time"])
+        self.start_times = [trip.start_time for trip in self.by_start]
+        self.by_cost = sorted(rows, key=TRIP_SORT_KEYS["cost"])
+        self.costs = [trip.cost for trip in self.by_cost]
+
+    def search(
+        self,
+        start_after=None,
+        start_before=None,
+        max_cost=None,
+        min_seats=None,
+        sort="start_time",
+        limit=None,
+    ):
+        lo = bisect_right(self.start_times, start_after) if start_after else 0
+        hi = (
+            bisect_left(self.start_times, start_before)
+            if start_before
+            else len(self.start_times)
+        )
+        cheap = (
+            bisect_right(self.costs, max_cost)
+            if max_cost is not None
+            else len(self.costs)
+        )
+        # Scan whichever range is narrower and filter on the other predicates
+        if cheap < hi - lo:
+            candidates, ordered_by = self.by_cost[:cheap], "cost"
+        else:
+            candidates, ordered_by = self.by_start[lo:hi], "start_time"
+
+        matches = []
+        for trip in candidates:
+            if start_after and trip.start_time <= start_after:
+                continue
+            if start_before and trip.start_time >= start_before:
+                continue
+            if max_cost is not None and trip.cost > max_cost:
+                continue
+            if min_seats and trip.available_seats < min_seats:
+                continue
+            matches.append(trip)
+            if sort == ordered_by and limit and len(matches) == limit:
+                return matches
+
+        if sort != ordered_by:
+            matches.sort(key=TRIP_SORT_KEYS[sort])
+        return matches[:limit] if limit else matches
+
+
+class TripCache:
+    """In-process cache of the scheduled trip list.
+
+    Entries expire after ``ttl`` seconds and are dropped as soon as any process
+    changes the ``trips`` table, via the ``trips_changed`` notification.
+    """
+
+    CHANNEL = "trips_changed"
+
+    def __init__(self, ttl, reconnect_delay=1.0):
+        self.ttl = ttl
+        self.reconnect_delay = reconnect_delay
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._rows = None
+        self._index = None
+        self._expires_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._listener_pid = None
+
+    def get(self, loader):
+        self._ensure_listener()
+        with self._lock:
+            if self._rows is not None and time.monotonic() < self._expires_at:
+                self.hits += 1
+                return self._rows
+            self.misses += 1
+            generation = self._generation
+
+        rows = loader()
+        with self._lock:
+            # Do not store a result that was invalidated while it was loading
+            if generation == self._generation:
+                self._rows = rows
+                self._expires_at = time.monotonic() + self.ttl
+        return rows
+
+    async def aget(self, loader):
+        """Same as get() for a coroutine loader, for the async server"""
+        self._ensure_listener()
+        with self._lock:
+            if self._rows is not None and time.monotonic() < self._expires_at:
+                self.hits += 1
+                return self._rows
+            self.misses += 1
+            generation = self._generation
+
+        rows = await loader()
+        with self._lock:
+            if generation == self._generation:
+                self._rows = rows
+                self._expires_at = time.monotonic() + self.ttl
+        return rows
+
+    def get_index(self, loader):
+        """TripIndex over the cached rows, rebuilt only when the rows reload"""
+        rows = self.get(loader)
+        with self._lock:
+            index = self._index
+        if index is None or index.rows is not rows:
+            index = TripIndex(rows)
+            with self._lock:
+                if self._rows is rows:
+                    self._index = index
+        return index
+
+    def invalidate(self):
+        with self._lock:
+            self._rows = None
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _ensure_listener(self):
+        # Threads do not survive fork, so each process starts its own listener
+        if self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+        threading.Thread(
+            target=self._listen, name="trip-cache-listener", daemon=True
+        ).start()
+
+    def _listen(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**Database.connection_params())
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.CHANNEL}")
+                # Anything may have changed while we were not listening
+                self.invalidate()
+                while True:
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self.invalidate()
+            except psycopg2.Error:
+                time.sleep(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+trip_cache = TripCache(ttl=config("TRIP_CACHE_TTL", default=30.0, cast=float))
@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+
+from decouple import config
+
+from database import Database
+from idempotency import PRUNE_KEYS_QUERY
+from partition_manager import PartitionManager
+
+logger = logging.getLogger("trip_scheduler")
+# Runs on a background thread of the terminal, so failures stay off the menus
+# unless the application configures logging itself
+logger.addHandler(logging.NullHandler())
+
+# Arbitrary key so only one terminal process runs a given tick
+SCHEDULER_LOCK_ID = 72_134_002
+
+DUE_QUERY = """
+    SELECT
+        EXISTS (
+            SELECT 1 FROM trips
+            WHERE status = 'SCHEDULED' AND start_time <= CURRENT_TIMESTAMP
+        ) AS departures,
+        EXISTS (
+            SELECT 1 FROM trips
+            WHERE status IN ('SCHEDULED', 'IN_PROGRESS')
+              AND end_time <= CURRENT_TIMESTAMP
+        ) AS arrivals
+"""
+
+START_TRIPS_QUERY = """
+    UPDATE trips SET status = 'IN_PROGRESS'
+    WHERE status = 'SCHEDULED'
+      AND start_time <= CURRENT_TIMESTAMP
+      AND end_time > CURRENT_TIMESTAMP
+"""
+
+COMPLETE_TRIPS_QUERY = """
+    UPDATE trips SET status = 'COMPLETED'
+    WHERE status IN ('SCHEDULED', 'IN_PROGRESS')
+      AND end_time <= CURRENT_TIMESTAMP
+"""
+
+
+class TripStatusScheduler:
+    """Background thread moving due trips SCHEDULED -> IN_PROGRESS -> COMPLETED.
+
+    It also keeps the upcoming monthly history partitions created and drops
+    idempotency keys older than IDEMPOTENCY_KEY_TTL_HOURS, both every
+    PARTITION_CHECK_INTERVAL seconds.
+    """
+
+    def __init__(self, interval=None, db=None):
+        self.interval = interval or config(
+            "TRIP_STATUS_INTERVAL", default=30.0, cast=float
+        )
+        self.partition_check_interval = config(
+            "PARTITION_CHECK_INTERVAL", default=3600.0, cast=float
+        )
+        self.idempotency_key_ttl_hours = config(
+            "IDEMPOTENCY_KEY_TTL_HOURS", default=24.0, cast=float
+        )
+        self.db = db or Database()
+        self._next_partition_check = 0.0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="trip-status-scheduler", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def tick(self):
+        """Run one set-based transition pass; returns (started, completed)"""
+        started = completed = 0
+        with self.db.transaction() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT pg_try_advisory_xact_lock(%s)", (SCHEDULER_LOCK_ID,)
+                )
+                if not cursor.fetchone()[0]:
+                    return started, completed
+
+                # Skip no-op UPDATEs: they would still fire the trips_changed
+                # trigger and flush every terminal's trip cache
+                cursor.execute(DUE_QUERY)
+                departures, arrivals = cursor.fetchone()
+                if departures:
+                    cursor.execute(START_TRIPS_QUERY)
+                    started = cursor.rowcount
+                if arrivals:
+                    cursor.execute(COMPLETE_TRIPS_QUERY)
+                    completed = cursor.rowcount
+        return started, completed
+
+    def maintain(self):
+        if time.monotonic() < self._next_partition_check:
+            return
+        self._next_partition_check = (
+            time.monotonic() + self.partition_check_interval
+        )
+        PartitionManager(self.db).ensure_partitions()
+        self.db.execute_query(PRUNE_KEYS_QUERY, (self.idempotency_key_ttl_hours,))
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Trip status update failed")
+            try:
+                self.maintain()
+            except Exception:
+                logger.exception("Partition and idempotency key maintenance failed")
+            self._stopped.wait(self.interval)
@@ -0,0 +1,121 @@
+import argparse
+from datetime import date
+
+from database import Database
+from models import PAGE_SIZE, TICKET_COLUMNS, Ticket
+from partition_manager import month_start
+
+# Statements come from user_monthly, kept current by the triggers in migration
+# 0015, so they cost one row per month however many tickets the passenger has
+
+MONTHLY_QUERY = """
+    SELECT month, trips, spent, deposits, refunds
+    FROM user_monthly
+    WHERE user_id = %(user_id)s AND month >= %(since)s
+    ORDER BY month DESC
+"""
+
+TOTALS_QUERY = """
+    SELECT coalesce(sum(trips), 0) AS trips,
+           coalesce(sum(spent), 0) AS spent,
+           coalesce(sum(deposits), 0) AS deposits,
+           coalesce(sum(refunds), 0) AS refunds
+    FROM user_monthly
+    WHERE user_id = %(user_id)s
+"""
+
+# No ticket for a trip still to depart was bought before that trip existed, so
+# only the partitions from the oldest such trip's creation on are read (a day
+# earlier, for purchases whose transaction began just before it). The cost
+# follows recent bookings rather than the passenger's whole history.
+UPCOMING_TRIPS_QUERY = f"""
+    SELECT {TICKET_COLUMNS}
+    FROM tickets t
+    JOIN trips tr ON tr.id = t.trip_id
+    WHERE t.user_id = %(user_id)s
+      AND t.purchase_time >= (
+          SELECT coalesce(min(created_at), '-infinity') - interval '1 day'
+          FROM trips
+          WHERE status = 'SCHEDULED' AND start_time > CURRENT_TIMESTAMP
+      )
+      AND t.purchase_time <= LOCALTIMESTAMP
+      AND t.status = 'PURCHASED'
+      AND tr.status = 'SCHEDULED'
+      AND tr.start_time > CURRENT_TIMESTAMP
+    ORDER BY tr.start_time, t.id
+"""
+
+
+class UserDashboard:
+    """A passenger's spending statements, upcoming trips and, on request, their
+    full ticket history"""
+
+    def __init__(self, user_id, db=None):
+        self.user_id = user_id
+        self.db = db or Database()
+
+    def monthly(self, months=12):
+        """Trips, spending, deposits and refunds for each of the last ``months``
+        months with any activity, newest first"""
+        since = month_start(date.today(), 1 - months)
+        return self.db.execute_query(
+            MONTHLY_QUERY, {"user_id": self.user_id, "since": since}
+        )
+
+    def totals(self):
+        return self.db.execute_query(TOTALS_QUERY, {"user_id": self.user_id})[0]
+
+    def upcoming(self):
+        """Tickets for trips that have not departed yet, soonest first"""
+        return self.db.execute_query(
+            UPCOMING_TRIPS_QUERY, {"user_id": self.user_id}, row_factory=Ticket
+        )
+
+    def history_page(self, limit=PAGE_SIZE, after=None):
+        """One keyset page of the full ticket history; nothing is read until
+        the passenger asks for it"""
+        return Ticket.get_user_tickets_page(self.user_id, limit, after)
+
+
+def print_statement(dashboard, months=12):
+    totals = dashboard.totals()
+    print(
+        f"All time | Trips: {totals['trips']} | Spent: ${totals['spent']:.2f} | "
+        f"Deposits: ${totals['deposits']:.2f} | Refunds: ${totals['refunds']:.2f}"
+    )
+
+    print(f"--- Last {months} months ---")
+    rows = dashboard.monthly(months)
+    if not rows:
+        print("No activity.")
+    for row in rows:
+        print(
+            f"{row['month']:%Y-%m} | Trips: {row['trips']} | "
+            f"Spent: ${row['spent']:.2f} | Deposits: ${row['deposits']:.2f} | "
+            f"Refunds: ${row['refunds']:.2f}"
+        )
+
+    print("--- Upcoming trips ---")
+    tickets = dashboard.upcoming()
+    if not tickets:
+        print("No upcoming trips.")
+    for ticket in tickets:
+        print(
+            f"Ticket ID: {ticket.id} | Trip: {ticket.trip_id} | "
+            f"Departs: {ticket.start_time} | Seat: {ticket.seat_number} | "
+            f"Cost: ${ticket.cost:.2f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Passenger statement")
+    parser.add_argument("user_id", type=int)
+    parser.add_argument("--months", type=int, default=12)
+    args = parser.parse_args(argv)
+
+    print_statement(UserDashboard(args.user_id), args.months)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())